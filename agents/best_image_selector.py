@@ -5,7 +5,9 @@ from tenacity import retry, stop_after_attempt
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain.chat_models import init_chat_model
-from utils.image import image_path_to_b64
+from utils.image import prepare_image_b64
+from utils.llm_cache import cached_ainvoke
+from utils.tracing import traced
 
 
 
@@ -74,6 +76,7 @@ class BestImageSelector:
         )
 
 
+    @traced("agent")
     @retry(
         stop=stop_after_attempt(3),
         after=lambda retry_state: logging.warning(f"Retrying best image selection due to {retry_state.outcome.exception()}"),
@@ -102,6 +105,7 @@ class BestImageSelector:
 
         logging.info(f"Selecting the best image from candidates: {candidate_image_paths}")
 
+        # Comparing consistency needs fewer pixels than generating, so images are sent downscaled
         human_content = []
         for idx, (ref_image_path, text) in enumerate(reference_image_path_and_text_pairs):
             human_content.append({
@@ -110,7 +114,7 @@ class BestImageSelector:
             })
             human_content.append({
                 "type": "image_url",
-                "image_url": {"url": image_path_to_b64(ref_image_path, mime=True)}
+                "image_url": {"url": prepare_image_b64(ref_image_path, max_side=1024)}
             })
 
         for idx, candidate_image_path in enumerate(candidate_image_paths):
@@ -120,7 +124,7 @@ class BestImageSelector:
             })
             human_content.append({
                 "type": "image_url",
-                "image_url": {"url": image_path_to_b64(candidate_image_path, mime=True)}
+                "image_url": {"url": prepare_image_b64(candidate_image_path, max_side=1024)}
             })
         human_content.append({
             "type": "text",
@@ -136,7 +140,7 @@ class BestImageSelector:
 
         chain = self.chat_model | parser
 
-        response = await chain.ainvoke(messages)
+        response = await cached_ainvoke(chain, messages)
         idx = response.best_image_index
         if not isinstance(idx, int) or idx < 0 or idx >= len(candidate_image_paths):
             logging.warning(f"Received invalid best_image_index={idx}; defaulting to 0")
@@ -14,6 +14,8 @@ from interfaces import ShotDescription, ShotBriefDescription, Camera, ImageOutpu
 
 from moviepy import VideoFileClip
 from PIL import Image
+from utils.llm_cache import cached_ainvoke
+from utils.tracing import traced
 
 
 system_prompt_template_select_reference_camera = \
@@ -118,6 +120,7 @@ class CameraImageGenerator:
         self.video_generator = video_generator
 
 
+    @traced("agent")
     async def construct_camera_tree(
         self,
         cameras: List[Camera],
@@ -139,7 +142,7 @@ class CameraImageGenerator:
         ]
 
         chain = self.chat_model | parser
-        response: CameraTreeResponse = await chain.ainvoke(messages)
+        response: CameraTreeResponse = await cached_ainvoke(chain, messages)
         for cam, parent_cam_item in zip(cameras, response.camera_parent_items):
             cam.parent_cam_idx = parent_cam_item.parent_cam_idx if parent_cam_item is not None else None
             cam.parent_shot_idx = parent_cam_item.parent_shot_idx if parent_cam_item is not None else None
@@ -150,6 +153,7 @@ class CameraImageGenerator:
         return cameras
 
 
+    @traced("agent")
     async def generate_transition_video(
         self,
         first_shot_visual_desc: str,
@@ -200,6 +204,7 @@ class CameraImageGenerator:
             return ImageOutput(fmt="pil", ext="png", data=lf)
 
 
+    @traced("agent")
     async def generate_first_frame(
         self,
         shot_desc: ShotDescription,
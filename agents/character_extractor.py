@@ -10,6 +10,8 @@ from interfaces import CharacterInScene
 from langchain_core.messages import HumanMessage, SystemMessage
 
 from utils.retry import after_func
+from utils.llm_cache import cached_ainvoke
+from utils.tracing import traced
 
 
 system_prompt_template_extract_characters = \
@@ -68,6 +70,7 @@ class CharacterExtractor:
     ):
         self.chat_model = chat_model
 
+    @traced("agent")
     @retry(
         stop=stop_after_attempt(3),
         after=after_func,
@@ -83,7 +86,7 @@ class CharacterExtractor:
 
         chain = self.chat_model | parser
 
-        response: ExtractCharactersResponse = await chain.ainvoke(messages)
+        response: ExtractCharactersResponse = await cached_ainvoke(chain, messages)
 
         return response.characters
 
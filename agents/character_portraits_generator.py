@@ -11,6 +11,7 @@ from tenacity import retry, stop_after_attempt
 from interfaces import CharacterInScene, ImageOutput
 from langchain_core.messages import HumanMessage, SystemMessage
 from utils.retry import after_func
+from utils.tracing import traced
 
 
 
@@ -40,6 +41,7 @@ class CharacterPortraitsGenerator:
         self.image_generator = image_generator
 
 
+    @traced("agent")
     @retry(stop=stop_after_attempt(3), after=after_func, reraise=True)
     async def generate_front_portrait(
         self,
@@ -58,6 +60,7 @@ class CharacterPortraitsGenerator:
         )
         return image_output
 
+    @traced("agent")
     @retry(stop=stop_after_attempt(3), after=after_func, reraise=True)
     async def generate_side_portrait(
         self,
@@ -75,6 +78,7 @@ class CharacterPortraitsGenerator:
         return image_output
 
 
+    @traced("agent")
     @retry(stop=stop_after_attempt(3), after=after_func, reraise=True)
     async def generate_back_portrait(
         self,
@@ -1,14 +1,18 @@
 import os
+import time
 import logging
 import asyncio
-from typing import List
+from typing import List, Literal
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain.chat_models import init_chat_model
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from pydantic import BaseModel, Field
 from tenacity import retry, stop_after_attempt
 
 from interfaces import Event
+from utils.llm_cache import cached_ainvoke
+from utils.tracing import traced
 
 system_prompt_template_extract_events = \
 """
@@ -76,13 +80,122 @@ human_prompt_template_extract_next_event = \
 
 
 
+system_prompt_template_extract_window_events = \
+"""
+You are a highly skilled Literary Analyst AI. Your expertise is in narrative structure, plot deconstruction, and thematic analysis. You meticulously read and interpret prose to break down a story into its fundamental sequential events.
+
+**TASK**
+Extract all events from the provided excerpt of a novel, in the order in which they happen. The excerpt is one of several overlapping excerpts that together cover the whole novel, so its beginning and its end may cut through an event.
+
+**INPUT**
+1. The position of the excerpt in the novel, which is enclosed within <EXCERPT_POSITION> and </EXCERPT_POSITION> tags.
+2. The text of the excerpt, which is enclosed within <EXCERPT_TEXT_START> and <EXCERPT_TEXT_END> tags.
+
+**OUTPUT**
+{format_instructions}
+
+**GUIDELINES**
+1. Focus on events that are critical to the plot, character development, or thematic depth. Each event contains multiple processes and constitutes a complete causal chain.
+2. Ensure each event is logically distinct from the previous and subsequent events.
+3. If an event spans multiple scenes, unify them under a single dramatic goal. For example, a chase sequence might begin in a city market, continue through back alleys, and conclude on a rooftop—all comprising a single event because they collectively achieve the dramatic purpose of "the protagonist evading capture."
+4. Maintain objectivity: describe events based on the text without interpretation or judgment.
+5. For the process field, provide a detailed, step-by-step account of the event's progression, including key actions, decisions, and turning points.
+6. If an event is cut off by the beginning or the end of the excerpt, still extract the part that is in the excerpt and mark it as incomplete.
+7. Every detail in your event description must be directly supported by the excerpt. Do not add, assume, or invent any information.
+8. The language of outputs in values should be same as the input text.
+"""
+
+human_prompt_template_extract_window_events = \
+"""
+<EXCERPT_POSITION>
+Excerpt {window_index} of {num_windows}
+</EXCERPT_POSITION>
+
+<EXCERPT_TEXT_START>
+{window_text}
+<EXCERPT_TEXT_END>
+"""
+
+
+class WindowEvent(BaseModel):
+    description: str = Field(
+        description="A concise description of the event, capturing its essence in one sentence",
+    )
+    process_chain: List[str] = Field(
+        description="A list of steps or actions that make up the event's process chain, which constitutes a complete causal chain.",
+    )
+    is_complete: bool = Field(
+        description="False if the beginning or the end of the excerpt cuts through the event, otherwise True",
+    )
+
+
+class ExtractWindowEventsResponse(BaseModel):
+    events: List[WindowEvent] = Field(
+        description="The events of the excerpt, in the order in which they happen",
+    )
+
+
+def _shingles(text: str) -> set:
+    words = text.lower().split()
+    if len(words) > 1 and len(text) / len(words) < 20:
+        return {word.strip(".,;:!?\"'()") for word in words if len(word) > 3}
+    # Text without spaces (e.g. Chinese) is compared by character bigrams instead of words
+    text = "".join(words)
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _event_similarity(a: WindowEvent, b: WindowEvent) -> float:
+    shingles_a = _shingles(" ".join([a.description] + a.process_chain))
+    shingles_b = _shingles(" ".join([b.description] + b.process_chain))
+    if not shingles_a or not shingles_b:
+        return 0.0
+    return len(shingles_a & shingles_b) / len(shingles_a | shingles_b)
+
+
 class EventExtractor:
+    """
+    Extracts the sequence of events of a (compressed) novel.
+
+    In "sequential" mode, every call sends the whole novel together with all the
+    events extracted so far and gets the next event back, so the prompt grows with
+    every event and nothing runs in parallel. In "windowed" mode, the novel is split
+    into overlapping windows whose events are extracted concurrently, and the events
+    repeated in the overlap of two adjacent windows are merged.
+
+    __call__ always extracts sequentially, since it is synchronous and may be called
+    from a running event loop; in windowed mode, await extract_events_windowed().
+    """
+
     def __init__(
         self,
         api_key: str,
         base_url: str,
         chat_model: str,
+        mode: Literal["sequential", "windowed"] = "sequential",
+        window_size: int = 16384,
+        window_overlap: int = 2048,
+        max_concurrent_windows: int = 5,
+        duplicate_threshold: float = 0.5,
+        max_boundary_events: int = 3,
     ):
+        """
+        Initialize the event extractor.
+
+        Args:
+            api_key: API key of the chat model.
+            base_url: Base URL of the chat model.
+            chat_model: Name of the chat model.
+            mode: How the pipeline extracts the events, see the class docstring.
+            window_size: Characters per window in windowed mode.
+            window_overlap: Characters shared by two adjacent windows. It should hold the
+                            longest event, so that every event is complete in some window.
+            max_concurrent_windows: Maximum number of windows extracted at the same time.
+            duplicate_threshold: Similarity above which two events at the boundary of adjacent
+                                 windows are considered the same event.
+            max_boundary_events: Number of events on each side of a window boundary that are compared
+                                 when looking for duplicates. It should cover the events that fit in
+                                 window_overlap, so raise it with the overlap or for short events.
+        """
         self.chat_model = init_chat_model(
             model=chat_model,
             model_provider="openai",
@@ -90,6 +203,23 @@ class EventExtractor:
             base_url=base_url,
         )
         self.parser = PydanticOutputParser(pydantic_object=Event)
+        self.window_parser = PydanticOutputParser(pydantic_object=ExtractWindowEventsResponse)
+
+        self.mode = mode
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=window_size,
+            chunk_overlap=window_overlap,
+        )
+        self.max_concurrent_windows = max_concurrent_windows
+        self.duplicate_threshold = duplicate_threshold
+        self.max_boundary_events = max_boundary_events
+
+        self.mode_stats = {
+            mode_name: {"calls": 0, "input_chars": 0, "output_chars": 0, "call_seconds": 0.0, "seconds": 0.0, "events": 0}
+            for mode_name in ["sequential", "windowed"]
+        }
+        self.num_duplicates_merged = 0
+        self.estimated_sequential_input_chars = 0
 
 
     def __call__(
@@ -98,6 +228,7 @@ class EventExtractor:
     ):
         logging.info("Extracting events from novel...")
 
+        start_time = time.monotonic()
         events = []
         while True:
             event = self.extract_next_event(novel_text, events)
@@ -107,9 +238,12 @@ class EventExtractor:
             if event.is_last:
                 break
 
+        self.mode_stats["sequential"]["seconds"] += time.monotonic() - start_time
+        self.mode_stats["sequential"]["events"] += len(events)
         return events
 
 
+    @traced("agent")
     @retry(
         stop=stop_after_attempt(3),
         after=lambda retry_state: logging.warning(f"Retrying extract_next_event due to error: {retry_state.outcome.exception()}"),
@@ -136,11 +270,182 @@ class EventExtractor:
 
         chain = self.chat_model | self.parser
 
+        start_time = time.monotonic()
         event: Event = chain.invoke(messages)
+        self._record_call("sequential", messages, event.model_dump_json(), time.monotonic() - start_time)
 
         assert event.index == len(extracted_events), f"Extracted event index {event.index} does not match the expected index {len(extracted_events)}"
 
         return event
 
 
+    @traced("agent")
+    async def extract_events_windowed(
+        self,
+        novel_text: str,
+    ) -> List[Event]:
+        """
+        Extract the events of the novel from overlapping windows in parallel.
+
+        Returns:
+            The events in story order, indexed from 0, with is_last set on the last one.
+        """
+        windows = self.splitter.split_text(novel_text)
+        logging.info(f"Extracting events from {len(windows)} windows of the novel...")
+
+        start_time = time.monotonic()
+        sem = asyncio.Semaphore(self.max_concurrent_windows)
+
+        async def extract(window_index: int, window_text: str) -> List[WindowEvent]:
+            async with sem:
+                return await self.extract_window_events(window_index, len(windows), window_text)
+
+        window_events = await asyncio.gather(*[
+            extract(window_index, window_text)
+            for window_index, window_text in enumerate(windows)
+        ])
+        merged_events = self.merge_window_events(window_events)
+
+        events = [
+            Event(
+                index=index,
+                is_last=index == len(merged_events) - 1,
+                description=window_event.description,
+                process_chain=window_event.process_chain,
+            )
+            for index, window_event in enumerate(merged_events)
+        ]
+
+        self.mode_stats["windowed"]["seconds"] += time.monotonic() - start_time
+        self.mode_stats["windowed"]["events"] += len(events)
+        self.estimated_sequential_input_chars += self._estimate_sequential_input_chars(novel_text, events)
+        logging.info(f"Extracted {len(events)} events from {len(windows)} windows.")
+        return events
+
+
+    @traced("agent")
+    @retry(
+        stop=stop_after_attempt(3),
+        after=lambda retry_state: logging.warning(f"Retrying extract_window_events due to error: {retry_state.outcome.exception()}"),
+    )
+    async def extract_window_events(
+        self,
+        window_index: int,
+        num_windows: int,
+        window_text: str,
+    ) -> List[WindowEvent]:
+        messages = [
+            SystemMessage(
+                content=system_prompt_template_extract_window_events.format(format_instructions=self.window_parser.get_format_instructions()),
+            ),
+            HumanMessage(
+                content=human_prompt_template_extract_window_events.format(
+                    window_index=window_index + 1,
+                    num_windows=num_windows,
+                    window_text=window_text,
+                )
+            ),
+        ]
+
+        chain = self.chat_model | self.window_parser
+
+        start_time = time.monotonic()
+        response: ExtractWindowEventsResponse = await cached_ainvoke(chain, messages)
+        self._record_call("windowed", messages, response.model_dump_json(), time.monotonic() - start_time)
+
+        return response.events
+
 
+    def merge_window_events(
+        self,
+        window_events: List[List[WindowEvent]],
+    ) -> List[WindowEvent]:
+        """
+        Concatenate the events of consecutive windows, dropping the events that the
+        overlap of two windows repeats.
+
+        An event among the first max_boundary_events of a window is a duplicate if it
+        is similar enough to one of the last max_boundary_events merged so far. Of the two, the
+        complete one is kept, or else the one with the longer process chain.
+        """
+        merged: List[WindowEvent] = []
+        for events in window_events:
+            # Only the events near the boundary can be repeated by the overlap
+            boundary_start, boundary_end = max(0, len(merged) - self.max_boundary_events), len(merged)
+            for position, event in enumerate(events):
+                match_index = None
+                if position < self.max_boundary_events:
+                    similarities = [
+                        (_event_similarity(previous, event), index)
+                        for index, previous in enumerate(merged[boundary_start:boundary_end], start=boundary_start)
+                    ]
+                    best_similarity, best_index = max(similarities, default=(0.0, None))
+                    if best_similarity >= self.duplicate_threshold:
+                        match_index = best_index
+
+                if match_index is None:
+                    merged.append(event)
+                    continue
+
+                self.num_duplicates_merged += 1
+                previous = merged[match_index]
+                if (event.is_complete, len(event.process_chain)) > (previous.is_complete, len(previous.process_chain)):
+                    merged[match_index] = event
+        return merged
+
+
+    def _record_call(
+        self,
+        mode: str,
+        messages: List,
+        output: str,
+        duration: float,
+    ) -> None:
+        mode_stats = self.mode_stats[mode]
+        mode_stats["calls"] += 1
+        mode_stats["input_chars"] += sum(len(message.content) for message in messages)
+        mode_stats["output_chars"] += len(output)
+        mode_stats["call_seconds"] += duration
+
+
+    def _estimate_sequential_input_chars(
+        self,
+        novel_text: str,
+        events: List[Event],
+    ) -> int:
+        # The sequential mode makes one call per event, each with the whole novel and every earlier event
+        system_chars = len(system_prompt_template_extract_events.format(format_instructions=self.parser.get_format_instructions()))
+        call_chars = system_chars + len(human_prompt_template_extract_next_event.format(novel_text=novel_text, extracted_events=""))
+        total_chars, events_chars = 0, 0
+        for event in events:
+            total_chars += call_chars + events_chars
+            events_chars += len(str(event)) + 2
+        return total_chars
+
+
+    def stats(self) -> dict:
+        """
+        Get the calls, input and output characters and time spent per mode, and for
+        windowed extraction the estimated savings against the sequential mode.
+
+        Token counts are estimated as 4 characters per token. The sequential time
+        is estimated as one call per event, one after another, each taking as long
+        as a measured sequential call, or a windowed one if there were none.
+        """
+        stats = {mode: dict(mode_stats) for mode, mode_stats in self.mode_stats.items()}
+        windowed = stats["windowed"]
+        if windowed["calls"] > 0:
+            sequential = stats["sequential"]
+            mean_call_seconds = (sequential["call_seconds"] / sequential["calls"]) if sequential["calls"] else windowed["call_seconds"] / windowed["calls"]
+            estimated_tokens = self.estimated_sequential_input_chars // 4
+            windowed_tokens = windowed["input_chars"] // 4
+            estimated_seconds = windowed["events"] * mean_call_seconds
+            stats["windowed_savings"] = {
+                "duplicates_merged": self.num_duplicates_merged,
+                "estimated_sequential_input_tokens": estimated_tokens,
+                "windowed_input_tokens": windowed_tokens,
+                "input_tokens_saved": estimated_tokens - windowed_tokens,
+                "estimated_sequential_seconds": estimated_seconds,
+                "seconds_saved": estimated_seconds - windowed["seconds"],
+            }
+        return stats
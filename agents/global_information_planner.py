@@ -9,6 +9,7 @@ from langchain.output_parsers import PydanticOutputParser
 from interfaces import Event, Scene
 from interfaces import CharacterInScene, CharacterInEvent, CharacterInNovel
 from tenacity import retry, stop_after_attempt
+from utils.tracing import traced
 
 
 system_prompt_template_merge_characters_across_scenes_in_event = \
@@ -151,6 +152,7 @@ class GlobalInformationPlanner:
             base_url=base_url,
         )
     
+    @traced("agent")
     @retry(
         stop=stop_after_attempt(3),
         after=lambda retry_state: logging.warning(f"Retrying due to {retry_state.outcome.exception()}"),
@@ -213,6 +215,7 @@ class GlobalInformationPlanner:
 
         return characters_in_event
 
+    @traced("agent")
     @retry(
         stop=stop_after_attempt(3),
         after=lambda retry_state: logging.warning(f"Retrying due to {retry_state.outcome.exception()}"),
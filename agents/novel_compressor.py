@@ -1,10 +1,14 @@
 import os
+import hashlib
+import functools
 import logging
 import asyncio
-from typing import List, Tuple
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Literal, Optional, Tuple
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain.chat_models import init_chat_model
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.tracing import traced
+from utils.text_stream import StreamingTextSplitter
 
 
 
@@ -85,7 +89,28 @@ class NovelCompressor:
         chat_model: str,
         chunk_size: int = 65536,
         chunk_overlap: int = 8192,
+        aggregate_mode: Literal["single", "hierarchical"] = "single",
+        aggregate_fan_in: int = 4,
+        max_aggregate_chars: int = 200000,
     ):
+        """
+        Initialize the novel compressor.
+
+        Args:
+            api_key: API key of the chat model.
+            base_url: Base URL of the chat model.
+            chat_model: Name of the chat model.
+            chunk_size: Characters per chunk of the novel.
+            chunk_overlap: Characters shared by two adjacent chunks.
+            aggregate_mode: "single" merges all compressed chunks in one call, "hierarchical"
+                            merges groups of adjacent chunks concurrently, level by level.
+            aggregate_fan_in: Maximum number of texts merged by one call in hierarchical mode.
+            max_aggregate_chars: Maximum number of input characters of one merge call in
+                                 hierarchical mode. Set it from the context size of the chat
+                                 model, leaving room for the output, which is about as long.
+                                 Texts longer than max_aggregate_chars / aggregate_fan_in are
+                                 compressed again before they are merged.
+        """
         self.chat_model = init_chat_model(
             model=chat_model,
             api_key=api_key,
@@ -97,6 +122,14 @@ class NovelCompressor:
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
         )
+        self.stream_splitter = StreamingTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+        )
+
+        self.aggregate_mode = aggregate_mode
+        self.aggregate_fan_in = aggregate_fan_in
+        self.max_aggregate_chars = max_aggregate_chars
 
 
     def split(
@@ -107,6 +140,102 @@ class NovelCompressor:
         return novel_chunks
 
 
+    def split_stream(
+        self,
+        path: str,
+        block_size: int = 1 << 20,
+    ) -> Iterator[str]:
+        """
+        Split the novel in a text file into chunks lazily, reading it block by block,
+        so that only a block and a few chunks are in memory however large the file.
+
+        The chunks near the block boundaries can differ from those of split() on the
+        whole text, see StreamingTextSplitter. That only matters for reuse across runs,
+        and the compressed chunks are keyed by the content hash of their chunk, which
+        is the same on every run over the same file.
+
+        Args:
+            path: Path of the UTF-8 text file.
+            block_size: Characters read at a time.
+
+        Yields:
+            The chunks, in order. num_chars_read counts the characters read so far.
+        """
+        for _, novel_chunk in self.stream_splitter.split_file(path, block_size=block_size):
+            yield novel_chunk
+
+
+    @property
+    def num_chars_read(self) -> int:
+        return self.stream_splitter.num_chars_read
+
+
+    @traced("agent")
+    async def compress_stream(
+        self,
+        novel_chunks: Iterable[str],
+        compress_chunk: Optional[Callable[[int, str], Awaitable[str]]] = None,
+        max_concurrent_tasks: int = 5,
+    ) -> List[str]:
+        """
+        Compress chunks while they are still being produced, e.g. by split_stream().
+
+        The next chunk is only read, in a worker thread, once one of the
+        max_concurrent_tasks slots is free, so compression of the first chunks
+        overlaps reading the later ones and at most one chunk per slot is held.
+
+        Args:
+            novel_chunks: The chunks, in order.
+            compress_chunk: Coroutine function that returns the compressed text of the chunk
+                            with the given index, e.g. to checkpoint it. Defaults to
+                            compress_single_novel_chunk.
+            max_concurrent_tasks: Maximum number of chunks compressed at the same time.
+
+        Returns:
+            The compressed chunks, in order.
+        """
+        if compress_chunk is None:
+            # Concurrency is bounded by the slots below, this semaphore never blocks
+            sem = asyncio.Semaphore(max_concurrent_tasks)
+
+            async def compress_chunk(index: int, novel_chunk: str) -> str:
+                _, compressed_novel_chunk = await self.compress_single_novel_chunk(sem, index, novel_chunk)
+                return compressed_novel_chunk
+
+        slots = asyncio.Semaphore(max_concurrent_tasks)
+        compressed_novel_chunks: Dict[int, str] = {}
+
+        async def run(index: int, novel_chunk: str) -> None:
+            try:
+                compressed_novel_chunks[index] = await compress_chunk(index, novel_chunk)
+            finally:
+                slots.release()
+
+        iterator = iter(novel_chunks)
+        end = object()
+        tasks = []
+        try:
+            while True:
+                await slots.acquire()
+                # Stop reading as soon as a chunk failed
+                for task in tasks:
+                    if task.done() and task.exception() is not None:
+                        raise task.exception()
+
+                novel_chunk = await asyncio.to_thread(next, iterator, end)
+                if novel_chunk is end:
+                    break
+                tasks.append(asyncio.create_task(run(len(tasks), novel_chunk)))
+
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return [compressed_novel_chunks[index] for index in range(len(tasks))]
+
+
+    @traced("agent")
     async def compress(
         self,
         index_chunk_pairs: List[Tuple[int, str]],
@@ -122,6 +251,7 @@ class NovelCompressor:
         return compressed_novel_chunks
 
 
+    @traced("agent")
     async def compress_single_novel_chunk(
         self,
         semaphore: asyncio.Semaphore,
@@ -150,12 +280,21 @@ class NovelCompressor:
         self,
         compressed_novel_chunks: List[str],
     ):
+        messages = self._make_aggregate_messages(compressed_novel_chunks)
+        response = self.chat_model.invoke(messages)
+        aggregated_novel = response.content
+        return aggregated_novel
+
+
+    def _make_aggregate_messages(
+        self,
+        chunks: List[str],
+    ) -> List:
         chunks_str = "\n".join([
             f"<CHUNK_{i}_START>\n{chunk}\n<CHUNK_{i}_END>"
-            for i, chunk in enumerate(compressed_novel_chunks)
+            for i, chunk in enumerate(chunks)
         ])
-
-        messages = [
+        return [
             SystemMessage(
                 content=system_prompt_template_aggregate
             ),
@@ -165,7 +304,172 @@ class NovelCompressor:
                 )
             ),
         ]
-        response = self.chat_model.invoke(messages)
-        aggregated_novel = response.content
-        return aggregated_novel
+
+
+    def _group(
+        self,
+        texts: List[str],
+    ) -> List[List[str]]:
+        # Every text fits max_aggregate_chars / aggregate_fan_in, so full groups stay within the budget
+        return [texts[start:start + self.aggregate_fan_in] for start in range(0, len(texts), self.aggregate_fan_in)]
+
+
+    async def _checkpointed(
+        self,
+        path: Optional[str],
+        make_text: Callable[[], Awaitable[str]],
+    ) -> str:
+        """
+        Return the text saved at path, or make it and save it there as soon as it is made.
+        """
+        if path is not None and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+
+        text = await make_text()
+        if path is not None:
+            # Write to a temporary file first, so that an interrupted run never leaves a truncated checkpoint behind
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+        return text
+
+
+    def _checkpoint_path(
+        self,
+        checkpoint_dir: Optional[str],
+        name: str,
+        inputs: List[str],
+    ) -> Optional[str]:
+        if checkpoint_dir is None:
+            return None
+        # Keyed by the inputs, so that a checkpoint of an edited novel is never reused
+        inputs_hash = hashlib.sha256("\0".join(inputs).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(checkpoint_dir, f"{name}_{inputs_hash}.txt")
+
+
+    async def _fit(
+        self,
+        semaphore: asyncio.Semaphore,
+        level: int,
+        index: int,
+        text: str,
+        checkpoint_dir: Optional[str],
+    ) -> List[str]:
+        """
+        Make a text fit max_aggregate_chars / aggregate_fan_in by compressing it again
+        in pieces of that size. If it is still too long, its compressed pieces are
+        returned as separate texts, to be merged with their neighbours.
+        """
+        max_text_chars = self.max_aggregate_chars // self.aggregate_fan_in
+        if len(text) <= max_text_chars:
+            return [text]
+
+        splitter = RecursiveCharacterTextSplitter(chunk_size=max_text_chars, chunk_overlap=0)
+        pieces = splitter.split_text(text)
+
+        async def compress_piece(piece_index: int, piece: str) -> str:
+            _, compressed_piece = await self.compress_single_novel_chunk(semaphore, f"{index}.{piece_index}", piece)
+            return compressed_piece
+
+        compressed_pieces = await asyncio.gather(*[
+            self._checkpointed(
+                self._checkpoint_path(checkpoint_dir, f"level_{level}_text_{index}_piece_{piece_index}", [piece]),
+                functools.partial(compress_piece, piece_index, piece),
+            )
+            for piece_index, piece in enumerate(pieces)
+        ])
+        fitted_text = "\n".join(compressed_pieces)
+        if len(fitted_text) <= max_text_chars:
+            return [fitted_text]
+        return [piece for compressed_piece in compressed_pieces for piece in splitter.split_text(compressed_piece)]
+
+
+    @traced("agent")
+    async def aggregate_group(
+        self,
+        semaphore: asyncio.Semaphore,
+        level: int,
+        index: int,
+        chunks: List[str],
+    ) -> Tuple[int, str]:
+        if len(chunks) == 1:
+            return index, chunks[0]
+
+        async with semaphore:
+            logging.info(f"Aggregating {len(chunks)} texts into text {index} of level {level + 1}")
+            response = await self.chat_model.ainvoke(self._make_aggregate_messages(chunks))
+            logging.info(f"Aggregated text {index} of level {level + 1}")
+        return index, response.content
+
+
+    @traced("agent")
+    async def aggregate_hierarchical(
+        self,
+        compressed_novel_chunks: List[str],
+        checkpoint_dir: Optional[str] = None,
+        max_concurrent_tasks: int = 5,
+    ) -> str:
+        """
+        Merge the compressed chunks with a tree reduction: adjacent chunks are merged in
+        groups of aggregate_fan_in, all groups of a level concurrently, until a single
+        text remains. Before every level, texts longer than max_aggregate_chars /
+        aggregate_fan_in are compressed again, so no merge call gets more than
+        max_aggregate_chars characters of input.
+
+        Args:
+            compressed_novel_chunks: Compressed chunks, in the order of the novel.
+            checkpoint_dir: Directory in which every merged and recompressed text is saved as
+                            soon as it is made. One whose checkpoint exists for the same input
+                            texts is not made again.
+            max_concurrent_tasks: Maximum number of chat calls at the same time.
+
+        Returns:
+            The aggregated novel.
+
+        Raises:
+            ValueError: If a level leaves as many texts, and as many characters, as it started
+                        with, because they cannot be compressed enough to fit the budget.
+        """
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+        sem = asyncio.Semaphore(max_concurrent_tasks)
+
+        async def gather_all(coroutines) -> list:
+            # Let every call finish, and save its checkpoint, before a failed one is raised
+            results = await asyncio.gather(*coroutines, return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            return results
+
+        async def merge(level: int, index: int, group: List[str]) -> str:
+            _, merged_text = await self.aggregate_group(sem, level, index, group)
+            return merged_text
+
+        texts = list(compressed_novel_chunks)
+        level = 0
+        while len(texts) > 1:
+            fitted_texts = await gather_all([
+                self._fit(sem, level, index, text, checkpoint_dir)
+                for index, text in enumerate(texts)
+            ])
+            fitted_texts = [text for fitted in fitted_texts for text in fitted]
+
+            groups = self._group(fitted_texts)
+            merged_texts = await gather_all([
+                self._checkpointed(
+                    self._checkpoint_path(checkpoint_dir, f"level_{level + 1}_text_{index}", group) if len(group) > 1 else None,
+                    functools.partial(merge, level, index, group),
+                )
+                for index, group in enumerate(groups)
+            ])
+
+            logging.info(f"Aggregated level {level + 1}: {len(texts)} texts into {len(merged_texts)}")
+            if len(merged_texts) >= len(texts) and sum(map(len, merged_texts)) >= sum(map(len, texts)):
+                raise ValueError(f"Aggregation level {level + 1} shortened neither the number nor the length of the texts, the compressed novel does not fit max_aggregate_chars={self.max_aggregate_chars}.")
+            texts = merged_texts
+            level += 1
+
+        return texts[0]
 
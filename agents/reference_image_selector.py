@@ -5,9 +5,11 @@ from pydantic import BaseModel, Field
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain.chat_models import init_chat_model
-from utils.image import image_path_to_b64
+from utils.image import prepare_image_b64
 
 from utils.retry import after_func
+from utils.llm_cache import cached_ainvoke
+from utils.tracing import traced
 
 system_prompt_template_select_reference_images_only_text = \
     """
@@ -140,6 +142,7 @@ class ReferenceImageSelector:
 
         self.chat_model = chat_model
 
+    @traced("agent")
     @retry(
         stop=stop_after_attempt(3),
         after=after_func,
@@ -173,7 +176,7 @@ class ReferenceImageSelector:
             chain = self.chat_model | parser
 
             try:
-                ref = await chain.ainvoke(messages)
+                ref = await cached_ainvoke(chain, messages)
                 filtered_image_path_and_text_pairs = [available_image_path_and_text_pairs[i] for i in ref.ref_image_indices]
                 logging.info(f"Filtered image idx:{ref.ref_image_indices}")
 
@@ -183,6 +186,7 @@ class ReferenceImageSelector:
 
         # 2. filter images using multimodal model
         human_content = []
+        # Judging relevance needs far fewer pixels than generating from the image
         for idx, (image_path, text) in enumerate(filtered_image_path_and_text_pairs):
             human_content.append({
                 "type": "text",
@@ -190,7 +194,7 @@ class ReferenceImageSelector:
             })
             human_content.append({
                 "type": "image_url",
-                "image_url": {"url": image_path_to_b64(image_path)}
+                "image_url": {"url": prepare_image_b64(image_path, max_side=768)}
             })
         human_content.append({
             "type": "text",
@@ -207,7 +211,7 @@ class ReferenceImageSelector:
         chain = self.chat_model | parser
 
         try:
-            response = await chain.ainvoke(messages)
+            response = await cached_ainvoke(chain, messages)
             reference_image_path_and_text_pairs = [filtered_image_path_and_text_pairs[i] for i in response.ref_image_indices]
             return {
                 "reference_image_path_and_text_pairs": reference_image_path_and_text_pairs,
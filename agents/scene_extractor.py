@@ -7,6 +7,7 @@ from typing import List, Optional, Literal, Tuple, Dict
 from langchain_core.output_parsers import PydanticOutputParser
 from tenacity import retry, stop_after_attempt
 import logging
+from utils.tracing import traced
 
 system_prompt_template_get_next_scene = \
 """
@@ -72,6 +73,7 @@ class SceneExtractor:
             model_provider="openai",
         )
 
+    @traced("agent")
     @retry(
         stop=stop_after_attempt(5),
         after=lambda retry_state: logging.warning(f"Retrying SceneExtractor.get_next_scene due to error: {retry_state.outcome.exception()}"),
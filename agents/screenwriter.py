@@ -3,9 +3,12 @@ from optparse import Option
 from typing import List, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.runnables import RunnableLambda
 from langchain.chat_models import init_chat_model
 from pydantic import BaseModel, Field
 from tenacity import retry, stop_after_attempt
+from utils.llm_cache import cached_ainvoke
+from utils.tracing import traced
 
 
 system_prompt_template_develop_story = \
@@ -120,6 +123,7 @@ class Screenwriter:
     ):
         self.chat_model = chat_model
 
+    @traced("agent")
     async def develop_story(
         self,
         idea: str,
@@ -129,10 +133,11 @@ class Screenwriter:
             ("system", system_prompt_template_develop_story),
             ("human", human_prompt_template_develop_story.format(idea=idea, user_requirement=user_requirement)),
         ]
-        response = await self.chat_model.ainvoke(messages)
+        response = await cached_ainvoke(self.chat_model, messages)
         story = response.content
         return story
 
+    @traced("agent")
     async def write_script_based_on_story(
         self,
         story: str,
@@ -154,28 +159,31 @@ class Screenwriter:
             ("system", system_prompt_template_write_script_based_on_story.format(format_instructions=format_instructions)),
             ("human", human_prompt_template_write_script_based_on_story.format(story=story, user_requirement=user_requirement)),
         ]
-        response = await self.chat_model.ainvoke(messages)
-
-        try:
-            parsed_response = parser.parse(response.content)
-            raw_script = parsed_response.script
-        except Exception as e:
-            logging.warning(f"Failed to parse script with Pydantic: {e}. Trying to parse as raw JSON or returning raw content.")
-            # Fallback output handling if Pydantic fails completely
-            # attempting manual json load if possible
-            import json
+        def parse_script(response) -> List[Union[str, Dict[str, Any]]]:
             try:
-                # Try to find json-like list in content
-                content = response.content
-                start = content.find('[')
-                end = content.rfind(']')
-                if start != -1 and end != -1:
-                    raw_script = json.loads(content[start:end+1])
-                else:
-                    raise ValueError("No JSON list found")
-            except:
-                # Fail hard if we can't get a list
-                raise e
+                parsed_response = parser.parse(response.content)
+                return parsed_response.script
+            except Exception as e:
+                logging.warning(f"Failed to parse script with Pydantic: {e}. Trying to parse as raw JSON or returning raw content.")
+                # Fallback output handling if Pydantic fails completely
+                # attempting manual json load if possible
+                import json
+                try:
+                    # Try to find json-like list in content
+                    content = response.content
+                    start = content.find('[')
+                    end = content.rfind(']')
+                    if start != -1 and end != -1:
+                        return json.loads(content[start:end+1])
+                    else:
+                        raise ValueError("No JSON list found")
+                except:
+                    # Fail hard if we can't get a list
+                    raise e
+
+        # Parse inside the chain, so that only a script that could be parsed gets cached
+        chain = self.chat_model | RunnableLambda(parse_script)
+        raw_script = await cached_ainvoke(chain, messages)
 
         # Post-process: Ensure everything is a string
         final_script = []
@@ -4,6 +4,8 @@ from langchain_core.output_parsers import PydanticOutputParser
 from langchain.chat_models import init_chat_model
 from pydantic import BaseModel, Field
 from tenacity import retry, stop_after_attempt
+from utils.llm_cache import cached_ainvoke
+from utils.tracing import traced
 
 
 system_prompt_template_script_enhancer = \
@@ -85,6 +87,7 @@ class ScriptEnhancer:
             api_key=api_key,
         )
 
+    @traced("agent")
     @retry(
         stop=stop_after_attempt(3),
         after=lambda retry_state: logging.warning(f"Retrying enhance_script due to error: {retry_state.outcome.exception()}"),
@@ -107,7 +110,8 @@ class ScriptEnhancer:
 
         try:
             logging.info("Enhancing planned script...")
-            response: EnhancedScriptResponse = await chain.ainvoke(
+            response: EnhancedScriptResponse = await cached_ainvoke(
+                chain,
                 {
                     "format_instructions": parser.get_format_instructions(),
                     "planned_script": planned_script,
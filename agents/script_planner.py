@@ -5,6 +5,7 @@ from langchain.chat_models import init_chat_model
 from pydantic import BaseModel, Field
 from typing import List, Optional, Literal
 from tenacity import retry
+from utils.tracing import traced
 
 
 narrative_script_prompt_template = \
@@ -341,6 +342,7 @@ class ScriptPlanner:
             api_key=api_key,
         )
 
+    @traced("agent")
     @retry
     def plan_script(
         self,
@@ -9,6 +9,8 @@ from langchain_core.output_parsers import PydanticOutputParser
 from interfaces import CharacterInScene, ShotDescription, ShotBriefDescription
 
 from utils.retry import after_func
+from utils.llm_cache import cached_ainvoke
+from utils.tracing import traced
 
 
 system_prompt_template_design_storyboard = \
@@ -173,6 +175,7 @@ class StoryboardArtist:
     ):
         self.chat_model = chat_model
 
+    @traced("agent")
     @retry(stop=stop_after_attempt(3), after=after_func)
     async def design_storyboard(
         self,
@@ -198,13 +201,14 @@ class StoryboardArtist:
         ]
         chain = self.chat_model | parser
         response: StoryboardResponse = await asyncio.wait_for(
-            chain.ainvoke(messages),
+            cached_ainvoke(chain, messages),
             timeout=retry_timeout,
         )
         storyboard = response.storyboard
 
         return storyboard
 
+    @traced("agent")
     @retry(stop=stop_after_attempt(3), after=after_func)
     async def decompose_visual_description(
         self,
@@ -226,7 +230,8 @@ class StoryboardArtist:
         characters_str = "\n".join([f"{char.identifier_in_scene}: (static) {char.static_features}; (dynamic) {char.dynamic_features}" for char in characters])
 
         decomposition: VisDescDecompositionResponse = await asyncio.wait_for(
-            chain.ainvoke(
+            cached_ainvoke(
+                chain,
                 input={
                     "format_instructions": parser.get_format_instructions(),
                     "visual_desc": visual_desc,
@@ -0,0 +1,188 @@
+"""
+Load test of the HTTP tools against the mock Yunwu and SiliconFlow server.
+
+Runs the real tool classes, pointed at benchmarks.mock_http_server with base_url,
+with hundreds of jobs in flight at once, and reports per tool the latency
+percentiles and failures, and overall the connection reuse of the shared HTTP
+pool and the request, status and polling counts seen by the server.
+
+Usage:
+    python -m benchmarks.http_load_test --tools seedance veo seedream rerank --jobs 200
+    python -m benchmarks.http_load_test --url http://127.0.0.1:8089 --jobs 500
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import logging
+import tempfile
+from typing import Awaitable, Callable, List
+
+import aiohttp
+from PIL import Image
+
+from benchmarks.mock_http_server import add_server_arguments, make_server
+from tools import (
+    ImageGeneratorDoubaoSeedreamYunwuAPI,
+    ImageGeneratorNanobananaYunwuAPI,
+    RerankerBgeSiliconapi,
+    VideoGeneratorDoubaoSeedanceYunwuAPI,
+    VideoGeneratorVeoYunwuAPI,
+)
+from utils.http import close_http_sessions, configure_http_client_pool, http_stats
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def make_jobs(
+    tool_name: str,
+    base_url: str,
+    reference_image_path: str,
+    args: argparse.Namespace,
+) -> Callable[[int], Awaitable]:
+    """
+    Create the coroutine function that runs job number idx of a tool.
+    """
+    if tool_name == "seedance":
+        tool = VideoGeneratorDoubaoSeedanceYunwuAPI(api_key="mock", base_url=base_url)
+        return lambda idx: tool.generate_single_video(prompt=f"Shot {idx}.", reference_image_paths=[reference_image_path])
+    if tool_name == "veo":
+        tool = VideoGeneratorVeoYunwuAPI(api_key="mock", base_url=base_url)
+        return lambda idx: tool.generate_single_video(prompt=f"Shot {idx}.", reference_image_paths=[reference_image_path])
+    if tool_name == "seedream":
+        tool = ImageGeneratorDoubaoSeedreamYunwuAPI(api_key="mock", base_url=base_url)
+        return lambda idx: tool.generate_single_image(prompt=f"Frame {idx}.", reference_image_paths=[reference_image_path])
+    if tool_name == "nanobanana":
+        tool = ImageGeneratorNanobananaYunwuAPI(api_key="mock", base_url=base_url)
+        return lambda idx: tool.generate_single_image(prompt=f"Frame {idx}.", reference_image_paths=[reference_image_path])
+    if tool_name == "rerank":
+        tool = RerankerBgeSiliconapi(api_key="mock", base_url=f"{base_url}/v1")
+        documents = [f"Paragraph {doc_idx} about the harbor and the storm." for doc_idx in range(args.rerank_documents)]
+        return lambda idx: tool(documents=documents, query=f"storm {idx}", top_n=5)
+    raise ValueError(f"Unknown tool: {tool_name}")
+
+
+async def run_tool(
+    tool_name: str,
+    base_url: str,
+    reference_image_path: str,
+    args: argparse.Namespace,
+) -> dict:
+    job = make_jobs(tool_name, base_url, reference_image_path, args)
+    latencies, errors = [], []
+
+    async def run_job(idx: int):
+        start_time = time.monotonic()
+        try:
+            output = await job(idx)
+            if output is None:
+                raise ValueError("the task failed")
+            if args.download and hasattr(output, "asave"):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    await output.asave(os.path.join(tmp_dir, f"{idx}.{output.ext}"))
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        else:
+            latencies.append(time.monotonic() - start_time)
+
+    start_time = time.monotonic()
+    await asyncio.gather(*[run_job(idx) for idx in range(args.jobs)])
+    wall_time = time.monotonic() - start_time
+
+    return {
+        "tool": tool_name,
+        "jobs": args.jobs,
+        "succeeded": len(latencies),
+        "failed": len(errors),
+        "errors": sorted(set(errors))[:5],
+        "wall_seconds": wall_time,
+        "jobs_per_second": len(latencies) / wall_time if wall_time else 0.0,
+        "p50_seconds": percentile(latencies, 0.5),
+        "p95_seconds": percentile(latencies, 0.95),
+        "max_seconds": max(latencies, default=0.0),
+    }
+
+
+def print_report(results: List[dict], connection_stats: dict, server_stats: dict) -> None:
+    print(f"{'tool':<12}{'jobs':>6}{'ok':>6}{'failed':>8}{'wall s':>9}{'jobs/s':>8}{'p50 s':>8}{'p95 s':>8}{'max s':>8}")
+    for result in results:
+        print(
+            f"{result['tool']:<12}{result['jobs']:>6}{result['succeeded']:>6}{result['failed']:>8}"
+            f"{result['wall_seconds']:>9.1f}{result['jobs_per_second']:>8.1f}"
+            f"{result['p50_seconds']:>8.2f}{result['p95_seconds']:>8.2f}{result['max_seconds']:>8.2f}"
+        )
+        for error in result["errors"]:
+            print(f"    {error}")
+    print(
+        f"HTTP pool: {connection_stats['requests']} requests, {connection_stats['connections_created']} connections created, "
+        f"{connection_stats['connections_reused']} reused ({connection_stats['reuse_ratio']:.0%})"
+    )
+    if server_stats:
+        print(f"Server: {server_stats['statuses']} by status, at most {server_stats['max_in_flight']} requests in flight, {server_stats['connections_closed']} connections closed")
+        print(
+            f"Video tasks: {server_stats['jobs']}, queued {server_stats['mean_queue_seconds']:.2f}s on average (max {server_stats['max_queue_seconds']:.2f}s), "
+            f"{server_stats['mean_polls_per_job']:.1f} polls per task (max {server_stats['max_polls_per_job']})"
+        )
+
+
+async def main(args: argparse.Namespace) -> None:
+    configure_http_client_pool(limit=args.pool_limit, limit_per_host=args.pool_limit_per_host)
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        server = make_server(args)
+        base_url = await server.start()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reference_image_path = os.path.join(tmp_dir, "reference.png")
+        Image.new("RGB", (1280, 720), (64, 96, 128)).save(reference_image_path)
+
+        try:
+            results = []
+            for tool_name in args.tools:
+                results.append(await run_tool(tool_name, base_url, reference_image_path, args))
+
+            if server is not None:
+                server_stats = server.stats()
+            else:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(f"{base_url}/_stats") as response:
+                        server_stats = await response.json()
+        finally:
+            await close_http_sessions()
+            if server is not None:
+                await server.stop()
+
+    connection_stats = http_stats()
+    print_report(results, connection_stats, server_stats)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"tools": results, "http": connection_stats, "server": server_stats}, f, ensure_ascii=False, indent=4)
+        print(f"Results saved to {args.output}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the HTTP tools against the mock provider server.")
+    parser.add_argument("--tools", nargs="+", default=["seedance", "veo", "seedream", "rerank"], choices=["seedance", "veo", "seedream", "nanobanana", "rerank"])
+    parser.add_argument("--jobs", type=int, default=200, help="Jobs per tool, all started at once.")
+    parser.add_argument("--rerank-documents", type=int, default=32, help="Documents per rerank request.")
+    parser.add_argument("--download", action="store_true", help="Also download the generated videos and images.")
+    parser.add_argument("--pool-limit", type=int, default=100, help="Connection limit of the shared HTTP pool.")
+    parser.add_argument("--pool-limit-per-host", type=int, default=16, help="Per-host connection limit of the shared HTTP pool.")
+    parser.add_argument("--url", default=None, help="Base URL of a running mock server. If not given, one is started in-process.")
+    parser.add_argument("--output", default=None, help="Path of a JSON file to save the results to.")
+    parser.add_argument("--verbose", action="store_true")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    asyncio.run(main(args))
@@ -0,0 +1,428 @@
+"""
+Local HTTP server that speaks the protocols of the Yunwu and SiliconFlow APIs used by the tools.
+
+Implements:
+    POST /volc/v1/contents/generations/tasks           Seedance: create a video task
+    GET  /volc/v1/contents/generations/tasks/{id}      Seedance: query a video task
+    POST /v1/video/create                              Veo: create a video task
+    GET  /v1/video/query?id={id}                       Veo: query a video task
+    POST /v1/images/generations                        Seedream: generate an image
+    POST /v1beta/models/{model}:generateContent        Nanobanana: generate an image
+    POST /v1/rerank                                    SiliconFlow: rerank documents
+    GET  /files/{name}                                 Generated videos and images
+    GET  /_stats                                       Request, job and polling counts
+
+Video tasks go through the lifecycle of the real providers: they are queued,
+run once one of max_running_jobs slots is free, and then succeed or fail. Task
+creation and image and rerank requests are admitted against the quota and the
+throttle rate of their MockBackend; polls are not, but any request can fail
+with a 500 at error_rate or have its connection closed after the response at
+close_rate, which exercises the retry and connection-pool code of the clients.
+
+Point the tools at it with base_url, e.g.
+VideoGeneratorDoubaoSeedanceYunwuAPI(api_key="mock", base_url="http://127.0.0.1:8089")
+and RerankerBgeSiliconapi(api_key="mock", base_url="http://127.0.0.1:8089/v1").
+
+Usage:
+    python -m benchmarks.mock_http_server --port 8089 --video-rpm 60 --max-running-jobs 20
+"""
+
+import io
+import time
+import uuid
+import base64
+import random
+import asyncio
+import argparse
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from PIL import Image
+
+from benchmarks.mock_providers import (
+    LatencyDistribution,
+    MockBackend,
+    MockProviderError,
+    make_mock_video_bytes,
+)
+
+
+class MockJob:
+    """
+    Asynchronous video generation task of the mock server.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        model: str,
+    ):
+        self.job_id = job_id
+        self.model = model
+        self.status = "queued"
+        self.created_time = time.monotonic()
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+        self.num_polls = 0
+
+
+class MockProviderServer:
+    """
+    aiohttp application serving the mock endpoints. Use make_app() to serve it
+    with your own runner, or start() and stop() to run it on the current loop.
+    """
+
+    def __init__(
+        self,
+        video_backend: MockBackend,
+        image_backend: MockBackend,
+        reranker_backend: MockBackend,
+        max_running_jobs: Optional[int] = None,
+        error_rate: float = 0.0,
+        close_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        """
+        Initialize the mock provider server.
+
+        Args:
+            video_backend: Quota, faults and job duration of the video tasks. Its failure_rate is the
+                           probability that a task ends with status "failed".
+            image_backend: Quota, faults and latency of the image endpoints.
+            reranker_backend: Quota, faults and latency of the rerank endpoint.
+            max_running_jobs: Number of video tasks the provider runs at once; the others stay queued.
+                              If None, every task starts right away.
+            error_rate: Probability that any request fails with a 500 before it is handled.
+            close_rate: Probability that the connection is closed after a response instead of kept alive.
+            seed: Seed of the fault injection, so that runs are repeatable.
+        """
+        self.video_backend = video_backend
+        self.image_backend = image_backend
+        self.reranker_backend = reranker_backend
+        self.max_running_jobs = max_running_jobs
+        self.error_rate = error_rate
+        self.close_rate = close_rate
+        self.rng = random.Random(seed)
+
+        self.jobs: Dict[str, MockJob] = {}
+        self.job_slots: Optional[asyncio.Semaphore] = None
+        self.job_tasks = set()
+        self.files: Dict[str, bytes] = {
+            "video.mp4": make_mock_video_bytes(),
+            "image.png": self._make_png_bytes(),
+        }
+
+        self.runner: Optional[web.AppRunner] = None
+        self.base_url: Optional[str] = None
+
+        self.route_counts = Counter()
+        self.status_counts = Counter()
+        self.num_in_flight = 0
+        self.max_in_flight = 0
+        self.num_connections_closed = 0
+
+    @staticmethod
+    def _make_png_bytes() -> bytes:
+        buffer = io.BytesIO()
+        Image.new("RGB", (160, 90), (96, 128, 160)).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware], client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/volc/v1/contents/generations/tasks", self.create_seedance_task)
+        app.router.add_get("/volc/v1/contents/generations/tasks/{job_id}", self.query_seedance_task)
+        app.router.add_post("/v1/video/create", self.create_veo_task)
+        app.router.add_get("/v1/video/query", self.query_veo_task)
+        app.router.add_post("/v1/images/generations", self.generate_seedream_image)
+        app.router.add_post("/v1beta/models/{model}:generateContent", self.generate_nanobanana_image)
+        app.router.add_post("/v1/rerank", self.rerank)
+        app.router.add_get("/files/{name}", self.get_file)
+        app.router.add_get("/_stats", self.get_stats)
+        app.on_shutdown.append(self._cancel_jobs)
+        return app
+
+    async def start(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> str:
+        """
+        Serve on the running event loop.
+
+        Args:
+            host: Interface to listen on.
+            port: Port to listen on; 0 picks a free one.
+
+        Returns:
+            The base URL of the server.
+        """
+        # Allow a backlog deep enough for hundreds of clients connecting at once
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port, backlog=1024)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def _cancel_jobs(self, app: web.Application) -> None:
+        for task in list(self.job_tasks):
+            task.cancel()
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.route_counts[request.match_info.route.resource.canonical if request.match_info.route.resource else request.path] += 1
+        self.num_in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.num_in_flight)
+        try:
+            if request.path != "/_stats" and not request.path.startswith("/files/"):
+                if not (request.headers.get("Authorization", "").startswith("Bearer ") or "x-goog-api-key" in request.headers):
+                    response = self._error(401, "missing API key")
+                elif self.rng.random() < self.error_rate:
+                    response = self._error(500, "injected server error")
+                else:
+                    response = await handler(request)
+            else:
+                response = await handler(request)
+        except MockProviderError as e:
+            response = self._error(e.code, str(e), headers=e.headers)
+        finally:
+            self.num_in_flight -= 1
+
+        if self.rng.random() < self.close_rate:
+            self.num_connections_closed += 1
+            response.force_close()
+        self.status_counts[response.status] += 1
+        return response
+
+    @staticmethod
+    def _error(
+        status: int,
+        message: str,
+        headers: Optional[dict] = None,
+    ) -> web.Response:
+        return web.json_response({"error": {"code": status, "message": message}}, status=status, headers=headers)
+
+    def _file_url(self, request: web.Request, name: str) -> str:
+        return f"{request.scheme}://{request.host}/files/{name}"
+
+    # Video tasks
+
+    def _create_job(self, model: str) -> MockJob:
+        self.video_backend.admit()
+        if self.job_slots is None and self.max_running_jobs is not None:
+            self.job_slots = asyncio.Semaphore(self.max_running_jobs)
+
+        job = MockJob(job_id=f"mock-{uuid.uuid4().hex}", model=model)
+        self.jobs[job.job_id] = job
+        task = asyncio.create_task(self._run_job(job))
+        self.job_tasks.add(task)
+        task.add_done_callback(self.job_tasks.discard)
+        return job
+
+    async def _run_job(self, job: MockJob) -> None:
+        if self.job_slots is not None:
+            async with self.job_slots:
+                await self._serve_job(job)
+        else:
+            await self._serve_job(job)
+
+    async def _serve_job(self, job: MockJob) -> None:
+        job.status = "running"
+        job.start_time = time.monotonic()
+        failed = await self.video_backend.serve()
+        job.end_time = time.monotonic()
+        job.status = "failed" if failed else "succeeded"
+
+    def _get_job(self, job_id: Optional[str]) -> MockJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise MockProviderError(404, f"task {job_id} not found")
+        job.num_polls += 1
+        return job
+
+    async def create_seedance_task(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        job = self._create_job(payload.get("model", "doubao-seedance"))
+        return web.json_response({"id": job.job_id})
+
+    async def query_seedance_task(self, request: web.Request) -> web.Response:
+        job = self._get_job(request.match_info["job_id"])
+        response = {"id": job.job_id, "model": job.model, "status": job.status}
+        if job.status == "succeeded":
+            response["content"] = {"video_url": self._file_url(request, "video.mp4")}
+        elif job.status == "failed":
+            response["error"] = {"code": "InternalServiceError", "message": "injected task failure"}
+        return web.json_response(response)
+
+    async def create_veo_task(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        job = self._create_job(payload.get("model", "veo"))
+        return web.json_response({"id": job.job_id, "status": "pending"})
+
+    async def query_veo_task(self, request: web.Request) -> web.Response:
+        job = self._get_job(request.query.get("id"))
+        status = {"queued": "pending", "running": "processing", "succeeded": "completed", "failed": "failed"}[job.status]
+        response = {"id": job.job_id, "status": status}
+        if status == "completed":
+            response["video_url"] = self._file_url(request, "video.mp4")
+        return web.json_response(response)
+
+    # Synchronous endpoints
+
+    async def _serve(self, backend: MockBackend) -> None:
+        backend.admit()
+        if await backend.serve():
+            raise MockProviderError(500, f"{backend.name} internal error")
+
+    async def generate_seedream_image(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self._serve(self.image_backend)
+        return web.json_response({
+            "created": int(time.time()),
+            "data": [{"url": self._file_url(request, "image.png")}],
+        })
+
+    async def generate_nanobanana_image(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self._serve(self.image_backend)
+        return web.json_response({
+            "candidates": [{
+                "content": {
+                    "role": "model",
+                    "parts": [{"inlineData": {"mimeType": "image/png", "data": base64.b64encode(self.files["image.png"]).decode("ascii")}}],
+                },
+                "finishReason": "STOP",
+            }],
+            "modelVersion": request.match_info["model"],
+        })
+
+    async def rerank(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        await self._serve(self.reranker_backend)
+
+        query_words = set(payload["query"].lower().split())
+        documents: List[str] = payload["documents"]
+        results = [
+            {
+                "index": idx,
+                "relevance_score": len(query_words & set(document.lower().split())) / (len(query_words) or 1),
+                "document": {"text": document},
+            }
+            for idx, document in enumerate(documents)
+        ]
+        results.sort(key=lambda result: result["relevance_score"], reverse=True)
+        results = results[:payload.get("top_n", len(results))]
+        if not payload.get("return_documents", True):
+            for result in results:
+                del result["document"]
+
+        input_tokens = (len(payload["query"]) + sum(len(document) for document in documents)) // 4
+        return web.json_response({
+            "id": uuid.uuid4().hex,
+            "results": results,
+            "tokens": {"input_tokens": input_tokens, "output_tokens": 0},
+        })
+
+    async def get_file(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        if name not in self.files:
+            raise MockProviderError(404, f"file {name} not found")
+        content_type = "video/mp4" if name.endswith(".mp4") else "image/png"
+        return web.Response(body=self.files[name], content_type=content_type)
+
+    # Statistics
+
+    def stats(self) -> dict:
+        """
+        Summarize the requests and video tasks served so far.
+
+        Returns:
+            Request counts per route and per status, the peak number of requests in flight,
+            the number of connections closed by fault injection, the video tasks per status,
+            and the time tasks spent queued and the polls they received.
+        """
+        jobs = list(self.jobs.values())
+        started_jobs = [job for job in jobs if job.start_time is not None]
+        queue_seconds = [job.start_time - job.created_time for job in started_jobs]
+        polls = [job.num_polls for job in jobs]
+        return {
+            "routes": dict(self.route_counts),
+            "statuses": {str(status): count for status, count in sorted(self.status_counts.items())},
+            "max_in_flight": self.max_in_flight,
+            "connections_closed": self.num_connections_closed,
+            "jobs": dict(Counter(job.status for job in jobs)),
+            "mean_queue_seconds": sum(queue_seconds) / len(queue_seconds) if queue_seconds else 0.0,
+            "max_queue_seconds": max(queue_seconds, default=0.0),
+            "mean_polls_per_job": sum(polls) / len(polls) if polls else 0.0,
+            "max_polls_per_job": max(polls, default=0),
+        }
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the command line arguments of make_server() to a parser.
+    """
+    parser.add_argument("--time-scale", type=float, default=0.05, help="Real seconds per simulated provider second.")
+    parser.add_argument("--latency-distribution", default="lognormal", choices=["lognormal", "uniform", "fixed"])
+    parser.add_argument("--video-latency", type=float, default=90.0, help="Median video task duration in simulated seconds.")
+    parser.add_argument("--image-latency", type=float, default=12.0, help="Median image latency in simulated seconds.")
+    parser.add_argument("--reranker-latency", type=float, default=1.0, help="Median rerank latency in simulated seconds.")
+    parser.add_argument("--video-rpm", type=int, default=None, help="Per-minute quota of video task creation.")
+    parser.add_argument("--image-rpm", type=int, default=None, help="Per-minute quota of the image endpoints.")
+    parser.add_argument("--reranker-rpm", type=int, default=None, help="Per-minute quota of the rerank endpoint.")
+    parser.add_argument("--max-running-jobs", type=int, default=None, help="Video tasks run at once; the others stay queued.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a task or call fails after its service time.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability that a task creation or call is rejected with a 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability that any request fails with a 500.")
+    parser.add_argument("--close-rate", type=float, default=0.0, help="Probability that a connection is closed after a response.")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def make_server(args: argparse.Namespace) -> MockProviderServer:
+    """
+    Create a mock provider server from the arguments added by add_server_arguments().
+    """
+    def make_backend(name: str, median: float, sigma: float, max_requests_per_minute: Optional[int], seed: int) -> MockBackend:
+        spread = median * sigma if args.latency_distribution == "uniform" else sigma
+        return MockBackend(
+            name,
+            LatencyDistribution(args.latency_distribution, median, spread),
+            failure_rate=args.failure_rate,
+            throttle_rate=args.throttle_rate,
+            max_requests_per_minute=max_requests_per_minute,
+            time_scale=args.time_scale,
+            seed=seed,
+        )
+
+    return MockProviderServer(
+        video_backend=make_backend("video", args.video_latency, 0.3, args.video_rpm, args.seed),
+        image_backend=make_backend("image", args.image_latency, 0.4, args.image_rpm, args.seed + 1),
+        reranker_backend=make_backend("reranker", args.reranker_latency, 0.3, args.reranker_rpm, args.seed + 2),
+        max_running_jobs=args.max_running_jobs,
+        error_rate=args.error_rate,
+        close_rate=args.close_rate,
+        seed=args.seed + 3,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve mock Yunwu and SiliconFlow endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args)
+    web.run_app(server.make_app(), host=args.host, port=args.port, backlog=1024, access_log=None)
@@ -0,0 +1,481 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import tempfile
+import zlib
+from collections import deque
+from typing import Any, List, Literal, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from tenacity import retry, retry_if_exception, stop_after_attempt
+
+from interfaces.image_output import ImageOutput
+from interfaces.video_output import VideoOutput
+from utils.retry import after_func
+from utils.rate_limiter import RateLimiter
+from utils.adaptive_concurrency import get_retry_after
+from utils.file_uploads import FileUploadRegistry, InMemoryFileStore
+
+
+class MockProviderError(Exception):
+    """
+    Error returned by a mock backend. A code of 429 carries a Retry-After header,
+    like the throttling errors of the real providers.
+    """
+
+    def __init__(
+        self,
+        code: int,
+        message: str,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.headers = {"Retry-After": f"{retry_after:.3f}"} if retry_after is not None else {}
+
+
+class LatencyDistribution:
+    """
+    Service time of a mock backend, in simulated seconds.
+
+    Args:
+        kind: "fixed" always takes median, "uniform" draws from [median - spread, median + spread],
+              "lognormal" draws a long-tailed time with the given median and sigma = spread.
+        median: Median service time.
+        spread: Half-width of the uniform range, or sigma of the lognormal distribution.
+    """
+
+    def __init__(
+        self,
+        kind: Literal["fixed", "uniform", "lognormal"] = "lognormal",
+        median: float = 1.0,
+        spread: float = 0.5,
+    ):
+        self.kind = kind
+        self.median = median
+        self.spread = spread
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.median
+        if self.kind == "uniform":
+            return max(0.0, rng.uniform(self.median - self.spread, self.median + self.spread))
+        return self.median * math.exp(rng.gauss(0.0, self.spread))
+
+
+class MockBackend:
+    """
+    Simulated provider endpoint shared by the mock clients.
+
+    Every call is admitted against a per-minute quota and answered with a 429
+    once it is used up, fails with a 429 or a 500 at the configured rates, and
+    otherwise takes a service time drawn from the latency distribution. All times
+    are in simulated seconds and multiplied by time_scale, so hours of provider
+    time replay in minutes. The intervals during which the backend was busy are
+    recorded for the utilization report.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        latency: LatencyDistribution,
+        failure_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        max_requests_per_minute: Optional[int] = None,
+        time_scale: float = 1.0,
+        seed: int = 0,
+    ):
+        """
+        Initialize the mock backend.
+
+        Args:
+            name: Name of the backend in the report.
+            latency: Service time of a successful call.
+            failure_rate: Probability that a call fails with a 500 after its service time.
+            throttle_rate: Probability that a call is rejected with a 429 right away.
+            max_requests_per_minute: Quota of accepted calls per simulated minute. If None, there is no quota.
+            time_scale: Real seconds per simulated second.
+            seed: Seed of the random draws, so that runs are repeatable.
+        """
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.max_requests_per_minute = max_requests_per_minute
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+
+        self.window = deque(maxlen=max_requests_per_minute) if max_requests_per_minute else None
+        self.intervals: List[Tuple[float, float]] = []
+        self.num_requests = 0
+        self.num_failures = 0
+        self.num_throttles = 0
+
+    def admit(self) -> None:
+        """
+        Admit one request against the quota and the throttle rate, or raise a 429 MockProviderError.
+        """
+        self.num_requests += 1
+        current_time = time.monotonic()
+
+        if self.window is not None:
+            window_length = 60 * self.time_scale
+            if len(self.window) == self.window.maxlen and self.window[0] + window_length > current_time:
+                self.num_throttles += 1
+                raise MockProviderError(429, f"{self.name} quota exceeded", retry_after=self.window[0] + window_length - current_time)
+            self.window.append(current_time)
+
+        if self.rng.random() < self.throttle_rate:
+            self.num_throttles += 1
+            raise MockProviderError(429, f"{self.name} is overloaded", retry_after=self.rng.uniform(1.0, 5.0) * self.time_scale)
+
+    async def serve(self) -> bool:
+        """
+        Spend the service time of an admitted request.
+
+        Returns:
+            Whether the request failed.
+        """
+        start_time = time.monotonic()
+        duration = self.latency.sample(self.rng) * self.time_scale
+        failed = self.rng.random() < self.failure_rate
+        await asyncio.sleep(duration)
+        self.intervals.append((start_time, time.monotonic()))
+
+        if failed:
+            self.num_failures += 1
+        return failed
+
+    async def call(self) -> None:
+        """
+        Serve one request, or raise a MockProviderError.
+        """
+        self.admit()
+        if await self.serve():
+            raise MockProviderError(500, f"{self.name} internal error")
+
+    def stats(self, start_time: float, end_time: float) -> dict:
+        """
+        Summarize how busy the backend was between start_time and end_time (time.monotonic()).
+
+        Returns:
+            The request, failure and throttle counts, the fraction of the wall-clock time
+            with at least one call in service, the mean number of calls in service, and
+            the idle gaps between the first and the last call.
+        """
+        wall_time = max(end_time - start_time, 1e-9)
+        intervals = sorted(self.intervals)
+
+        busy_time = 0.0
+        gaps = []
+        busy_start, busy_end = None, None
+        for interval_start, interval_end in intervals:
+            if busy_end is None or interval_start > busy_end:
+                if busy_end is not None:
+                    busy_time += busy_end - busy_start
+                    gaps.append(interval_start - busy_end)
+                busy_start, busy_end = interval_start, interval_end
+            else:
+                busy_end = max(busy_end, interval_end)
+        if busy_end is not None:
+            busy_time += busy_end - busy_start
+
+        return {
+            "requests": self.num_requests,
+            "failures": self.num_failures,
+            "throttles": self.num_throttles,
+            "utilization": busy_time / wall_time,
+            "mean_in_service": sum(interval_end - interval_start for interval_start, interval_end in intervals) / wall_time,
+            "idle_gaps": len(gaps),
+            "idle_seconds": sum(gaps),
+            "max_idle_seconds": max(gaps, default=0.0),
+        }
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    return isinstance(exc, MockProviderError)
+
+
+def _wait_retry_after(retry_state) -> float:
+    # Honor the Retry-After of a 429, retry other errors right away
+    return get_retry_after(retry_state.outcome.exception()) or 0.0
+
+
+def _message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "\n".join(part.get("text", "") for part in message.content if isinstance(part, dict))
+
+
+class MockChatModel(BaseChatModel):
+    """
+    Chat model that answers every agent of the pipelines with a well-formed response.
+
+    The agent is recognized by the output schema in its format instructions, and the
+    response is sized by the scenario: num_characters characters, num_scenes scenes
+    and shots_per_scene shots per storyboard, filmed by one camera per shots_per_camera
+    shots. Requests go through the backend like a real client, including its own
+    retries on 429 and 5xx.
+    """
+
+    backend: Any
+    num_characters: int = 3
+    num_scenes: int = 1
+    shots_per_scene: int = 10
+    shots_per_camera: int = 4
+    max_retries: int = 2
+
+    @property
+    def _llm_type(self) -> str:
+        return "mock"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError("MockChatModel only supports async calls.")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.backend.call()
+                break
+            except MockProviderError as e:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(get_retry_after(e) or 0.5 * self.backend.time_scale * 2 ** attempt)
+
+        system_text = "\n".join(_message_text(message) for message in messages if message.type == "system")
+        human_text = "\n".join(_message_text(message) for message in messages if message.type != "system")
+        content = self._respond(system_text, human_text)
+
+        input_tokens = sum(len(_message_text(message)) for message in messages) // 4
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": len(content) // 4,
+                "total_tokens": input_tokens + len(content) // 4,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _respond(self, system_text: str, human_text: str) -> str:
+        if "camera_parent_items" in system_text:
+            return json.dumps(self._camera_tree(human_text))
+        if "ref_image_indices" in system_text:
+            return json.dumps(self._reference_images(human_text))
+        if "storyboard" in system_text and "cam_idx" in system_text:
+            return json.dumps(self._storyboard())
+        if "ff_desc" in system_text and "motion_desc" in system_text:
+            return json.dumps(self._decomposition(human_text))
+        if "Each element is a scene" in system_text:
+            return json.dumps({"script": [f"SCENE {idx}. INT. ROOM - DAY. <Character 0> talks to <Character 1>." for idx in range(self.num_scenes)]})
+        if "static_features" in system_text:
+            return json.dumps({"characters": [self._character(idx) for idx in range(self.num_characters)]})
+        return "A short story about " + " and ".join(f"Character {idx}" for idx in range(self.num_characters)) + "."
+
+    def _character(self, idx: int) -> dict:
+        return {
+            "idx": idx,
+            "identifier_in_scene": f"Character {idx}",
+            "is_visible": True,
+            "static_features": f"Character {idx} is of medium build with short dark hair.",
+            "dynamic_features": f"Wearing a jacket of color {idx}.",
+        }
+
+    def _storyboard(self) -> dict:
+        num_cameras = max(1, math.ceil(self.shots_per_scene / self.shots_per_camera))
+        return {
+            "storyboard": [
+                {
+                    "idx": idx,
+                    "is_last": idx == self.shots_per_scene - 1,
+                    "cam_idx": idx % num_cameras,
+                    "visual_desc": f"Shot {idx}. Medium shot. <Character {idx % self.num_characters}> is on the left, facing right.",
+                    "audio_desc": "[Sound Effect] Ambient sound",
+                }
+                for idx in range(self.shots_per_scene)
+            ]
+        }
+
+    def _decomposition(self, human_text: str) -> dict:
+        # Deterministic per shot: mostly small variations, like real storyboards
+        draw = zlib.crc32(human_text.encode("utf-8")) % 10
+        variation_type = "small" if draw < 6 else "medium" if draw < 9 else "large"
+        vis_char_idxs = [0] if self.num_characters > 0 else []
+        return {
+            "ff_desc": "Medium shot. The character stands on the left, facing right.",
+            "ff_vis_char_idxs": vis_char_idxs,
+            "lf_desc": "Medium shot. The character sits on the right, facing left.",
+            "lf_vis_char_idxs": vis_char_idxs,
+            "motion_desc": "Static camera. The character walks to the right and sits down.",
+            "variation_type": variation_type,
+            "variation_reason": f"The variation is {variation_type}.",
+        }
+
+    def _camera_tree(self, human_text: str) -> dict:
+        cameras = re.findall(r"<CAMERA_(\d+)>\n(.*?)</CAMERA_\1>", human_text, flags=re.S)
+        root_shot_idx = int(re.search(r"Shot (\d+):", cameras[0][1]).group(1)) if cameras else 0
+        items = []
+        for idx, _ in enumerate(cameras):
+            if idx == 0:
+                items.append({"parent_cam_idx": None, "parent_shot_idx": None, "reason": "The first camera establishes the scene."})
+            else:
+                items.append({
+                    "parent_cam_idx": 0,
+                    "parent_shot_idx": root_shot_idx,
+                    "reason": "The parent shot covers the child shot.",
+                    "is_parent_fully_covers_child": False,
+                    "missing_info": "The frontal view of the character.",
+                })
+        return {"camera_parent_items": items}
+
+    def _reference_images(self, human_text: str) -> dict:
+        num_images = len(re.findall(r"^Image \d+:", human_text, flags=re.M))
+        ref_image_indices = list(range(min(num_images, 3)))
+        return {
+            "ref_image_indices": ref_image_indices,
+            "text_prompt": "Create an image following the given description. " + " ".join(f"Image {idx}." for idx in range(len(ref_image_indices))),
+        }
+
+
+class MockImageGenerator:
+    """
+    Image generator with the interface of the tools' image generators, backed by a MockBackend.
+
+    Reference images go through a FileUploadRegistry into an InMemoryFileStore, like
+    the Files API uploads of the Google image generator. Uploaded files expire after
+    file_ttl real seconds, and before each call the store loses all of its files with
+    probability file_loss_rate; a call that finds a file gone invalidates it and
+    uploads it again.
+    """
+
+    def __init__(
+        self,
+        backend: MockBackend,
+        rate_limiter: Optional[RateLimiter] = None,
+        size: Tuple[int, int] = (160, 90),
+        file_ttl: float = 48 * 3600,
+        file_expiry_margin: float = 600,
+        file_loss_rate: float = 0.0,
+    ):
+        self.model = f"mock-{backend.name}"
+        self.backend = backend
+        self.rate_limiter = rate_limiter
+        self.size = size
+        self.file_loss_rate = file_loss_rate
+        self.file_store = InMemoryFileStore(ttl=file_ttl)
+        self.file_uploads = FileUploadRegistry(upload=self.file_store.upload, expiry_margin=file_expiry_margin)
+
+    async def _load_reference_images(self, reference_image_paths: List[str]) -> List[bytes]:
+        if self.file_loss_rate and self.backend.rng.random() < self.file_loss_rate:
+            self.file_store.expire_all()
+
+        uris = await self.file_uploads.get_all(reference_image_paths)
+        try:
+            return [self.file_store.get(uri)[0] for uri in uris]
+        except FileNotFoundError:
+            # The provider deleted an upload before its expiry, upload it again
+            await self.file_uploads.invalidate(reference_image_paths)
+            uris = await self.file_uploads.get_all(reference_image_paths)
+            return [self.file_store.get(uri)[0] for uri in uris]
+
+    @retry(stop=stop_after_attempt(5), retry=retry_if_exception(_is_retryable), wait=_wait_retry_after, after=after_func, reraise=True)
+    async def generate_single_image(
+        self,
+        prompt: str,
+        reference_image_paths: List[str] = [],
+        **kwargs,
+    ) -> ImageOutput:
+        if self.rate_limiter:
+            await self.rate_limiter.acquire()
+        await self._load_reference_images(reference_image_paths)
+        await self.backend.call()
+
+        color = zlib.crc32(prompt.encode("utf-8")) & 0xFFFFFF
+        image = Image.new("RGB", self.size, ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF))
+        return ImageOutput(fmt="pil", ext="png", data=image)
+
+
+def make_mock_video_bytes(
+    size: Tuple[int, int] = (160, 90),
+    fps: int = 8,
+    num_frames: int = 16,
+) -> bytes:
+    """
+    Encode a tiny mp4 whose second half differs sharply from its first, so that
+    scene detection finds a cut in transition videos like it does in real ones.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "mock.mp4")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+        for frame_idx in range(num_frames):
+            value = 32 if frame_idx < num_frames // 2 else 224
+            writer.write(np.full((size[1], size[0], 3), value, dtype=np.uint8))
+        writer.release()
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class MockVideoGenerator:
+    """
+    Video generator with the interface of the tools' video generators, backed by a MockBackend.
+    """
+
+    def __init__(
+        self,
+        backend: MockBackend,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.t2v_model = self.ff2v_model = self.flf2v_model = f"mock-{backend.name}"
+        self.backend = backend
+        self.rate_limiter = rate_limiter
+        self.video_bytes = make_mock_video_bytes()
+
+    @retry(stop=stop_after_attempt(5), retry=retry_if_exception(_is_retryable), wait=_wait_retry_after, after=after_func, reraise=True)
+    async def generate_single_video(
+        self,
+        prompt: str,
+        reference_image_paths: List[str] = [],
+        **kwargs,
+    ) -> VideoOutput:
+        if self.rate_limiter:
+            await self.rate_limiter.acquire()
+        await self.backend.call()
+        return VideoOutput(fmt="bytes", ext="mp4", data=self.video_bytes)
+
+
+class MockReranker:
+    """
+    Reranker with the interface of RerankerBgeSiliconapi, backed by a MockBackend.
+    Documents are scored by the words they share with the query.
+    """
+
+    def __init__(
+        self,
+        backend: MockBackend,
+    ):
+        self.backend = backend
+
+    @retry(stop=stop_after_attempt(3), retry=retry_if_exception(_is_retryable), wait=_wait_retry_after, after=after_func, reraise=True)
+    async def __call__(
+        self,
+        documents: List[str],
+        query: str,
+        top_n: int,
+    ) -> List[Tuple[str, float]]:
+        await self.backend.call()
+        query_words = set(query.lower().split())
+        scored = [
+            (document, len(query_words & set(document.lower().split())) / (len(query_words) or 1))
+            for document in documents
+        ]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:top_n]
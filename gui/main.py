@@ -5,6 +5,7 @@ from PyQt6.QtCore import QCoreApplication
 from qasync import QEventLoop
 from qt_material import apply_stylesheet
 from gui.main_window import MainWindow
+from utils.http import close_http_sessions
 import logging
 
 
@@ -44,6 +45,11 @@ chat_model:
     # Rate limits for chat model API calls
     max_requests_per_minute: 10
     max_requests_per_day: 500
+    # Uncomment to reuse parsed LLM responses across runs
+    # cache:
+    #     path: ~/.cache/vigen/llm_responses.sqlite
+    #     ttl_hours: 168
+    #     max_entries: 100000
 
 image_generator:
     class_path: "tools.ImageGeneratorNanobananaGoogleAPI"
@@ -52,6 +58,25 @@ image_generator:
     # Rate limits for image generation API calls
     max_requests_per_minute: 10
     max_requests_per_day: 500
+    # Uncomment to send a duplicate of an image call that runs longer than the given
+    # percentile of recent latencies; the first result wins, the other is cancelled
+    # hedging:
+    #     percentile: 0.95
+    #     max_hedge_ratio: 0.1
+    #     alternate_generator:
+    #         class_path: "tools.ImageGeneratorNanobananaYunwuAPI"
+    #         init_args:
+    #             api_key: "YOUR_YUNWU_API_KEY"
+    # Uncomment and remove class_path and init_args to route the calls across several backends,
+    # each to the one with the best observed latency and remaining quota, failing over on errors
+    # backends:
+    #     - class_path: "tools.ImageGeneratorNanobananaGoogleAPI"
+    #       init_args:
+    #           api_key: "YOUR_GOOGLE_API_KEY"
+    #       max_requests_per_minute: 10
+    #     - class_path: "tools.ImageGeneratorDoubaoSeedreamYunwuAPI"
+    #       init_args:
+    #           api_key: "YOUR_YUNWU_API_KEY"
 
 video_generator:
     class_path: "tools.VideoGeneratorVeoGoogleAPI"
@@ -60,6 +85,18 @@ video_generator:
     # Rate limits for video generation API calls
     max_requests_per_minute: 2
     max_requests_per_day: 10
+    # Concurrent video jobs: starts at initial_concurrency, grows while requests
+    # succeed and halves when the provider throttles
+    initial_concurrency: 1
+    max_concurrency: 8
+
+# Uncomment to reuse generated images and videos across working directories
+# artifact_cache:
+#     root: ~/.cache/vigen/artifacts
+#     max_size_gb: 20
+
+# Number of scenes generated at the same time. They share the rate limits above.
+max_concurrent_scenes: 2
 
 working_dir: .working_dir/idea2video
 """,
@@ -73,6 +110,11 @@ chat_model:
     # Rate limits for chat model API calls
     max_requests_per_minute: 10
     max_requests_per_day: 500
+    # Uncomment to reuse parsed LLM responses across runs
+    # cache:
+    #     path: ~/.cache/vigen/llm_responses.sqlite
+    #     ttl_hours: 168
+    #     max_entries: 100000
 
 image_generator:
     class_path: "tools.ImageGeneratorNanobananaGoogleAPI"
@@ -81,6 +123,25 @@ image_generator:
     # Rate limits for image generation API calls
     max_requests_per_minute: 10
     max_requests_per_day: 500
+    # Uncomment to send a duplicate of an image call that runs longer than the given
+    # percentile of recent latencies; the first result wins, the other is cancelled
+    # hedging:
+    #     percentile: 0.95
+    #     max_hedge_ratio: 0.1
+    #     alternate_generator:
+    #         class_path: "tools.ImageGeneratorNanobananaYunwuAPI"
+    #         init_args:
+    #             api_key: "YOUR_YUNWU_API_KEY"
+    # Uncomment and remove class_path and init_args to route the calls across several backends,
+    # each to the one with the best observed latency and remaining quota, failing over on errors
+    # backends:
+    #     - class_path: "tools.ImageGeneratorNanobananaGoogleAPI"
+    #       init_args:
+    #           api_key: "YOUR_GOOGLE_API_KEY"
+    #       max_requests_per_minute: 10
+    #     - class_path: "tools.ImageGeneratorDoubaoSeedreamYunwuAPI"
+    #       init_args:
+    #           api_key: "YOUR_YUNWU_API_KEY"
 
 video_generator:
     class_path: "tools.VideoGeneratorVeoGoogleAPI"
@@ -89,6 +150,15 @@ video_generator:
     # Rate limits for video generation API calls
     max_requests_per_minute: 2
     max_requests_per_day: 10
+    # Concurrent video jobs: starts at initial_concurrency, grows while requests
+    # succeed and halves when the provider throttles
+    initial_concurrency: 1
+    max_concurrency: 8
+
+# Uncomment to reuse generated images and videos across working directories
+# artifact_cache:
+#     root: ~/.cache/vigen/artifacts
+#     max_size_gb: 20
 
 working_dir: .working_dir/script2video
 """
@@ -138,6 +208,8 @@ def main():
 
     with loop:
         loop.run_forever()
+        # Close the pooled HTTP connections of the tools before the loop goes away
+        loop.run_until_complete(close_http_sessions())
 
 
 if __name__ == "__main__":
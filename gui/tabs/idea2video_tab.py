@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import os
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QPlainTextEdit,
@@ -8,7 +7,6 @@ from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QPixmap
 from pipelines.idea2video_pipeline import Idea2VideoPipeline
 from qasync import asyncSlot
-from moviepy import VideoFileClip, concatenate_videoclips
 
 
 class Idea2VideoTab(QWidget):
@@ -167,35 +165,27 @@ class Idea2VideoTab(QWidget):
             self.set_progress_label("Writing Script...")
             scene_scripts = await pipeline.write_script_based_on_story(story=story, user_requirement=requirement)
 
-            # Step 5: Generate Scenes
-            from pipelines.script2video_pipeline import Script2VideoPipeline
-
-            all_video_paths = []
+            # Step 5: Generate Scenes, up to max_concurrent_scenes at a time
             total_scenes = len(scene_scripts)
-
-            for idx, scene_script in enumerate(scene_scripts):
-                self.progress_bar.setRange(0, total_scenes)
-                self.progress_bar.setValue(idx)
-                self.set_progress_label(f"Generating Scene {idx+1}/{total_scenes}")
-
-                scene_working_dir = os.path.join(pipeline.working_dir, f"scene_{idx}")
-                os.makedirs(scene_working_dir, exist_ok=True)
-
-                s2v_pipeline = Script2VideoPipeline(
-                    chat_model=pipeline.chat_model,
-                    image_generator=pipeline.image_generator,
-                    video_generator=pipeline.video_generator,
-                    working_dir=scene_working_dir,
-                )
-
-                final_path = await s2v_pipeline(
-                    script=scene_script,
-                    user_requirement=requirement,
-                    style=style,
-                    characters=characters,
-                    character_portraits_registry=registry,
-                )
-                all_video_paths.append(final_path)
+            num_completed_scenes = 0
+            self.progress_bar.setRange(0, total_scenes)
+            self.progress_bar.setValue(0)
+            self.set_progress_label(f"Generating Scenes 0/{total_scenes}")
+
+            def on_scene_completed(idx, final_path):
+                nonlocal num_completed_scenes
+                num_completed_scenes += 1
+                self.progress_bar.setValue(num_completed_scenes)
+                self.set_progress_label(f"Generating Scenes {num_completed_scenes}/{total_scenes}")
+
+            all_video_paths = await pipeline.generate_scene_videos(
+                scene_scripts=scene_scripts,
+                user_requirement=requirement,
+                style=style,
+                characters=characters,
+                character_portraits_registry=registry,
+                on_scene_completed=on_scene_completed,
+            )
 
             self.progress_bar.setValue(total_scenes)
 
@@ -203,17 +193,7 @@ class Idea2VideoTab(QWidget):
             self.set_progress_label("Concatenating Final Video...")
             self.progress_bar.setRange(0, 0)
 
-            final_video_path = os.path.join(pipeline.working_dir, "final_video.mp4")
-
-            def concat_videos():
-                # Use pipelines logic manually since we are outside valid context mostly
-                clips = [VideoFileClip(p) for p in all_video_paths]
-                final = concatenate_videoclips(clips)
-                final.write_videofile(final_video_path)
-                for c in clips:
-                    c.close()
-
-            await asyncio.to_thread(concat_videos)
+            final_video_path = await pipeline.concatenate_scene_videos(all_video_paths)
 
             self.tabs_output.setCurrentIndex(2)
             self.tab_video.setText(f"Video Saved at:\n{final_video_path}")
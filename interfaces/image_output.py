@@ -1,20 +1,25 @@
+import os
+import shutil
+import asyncio
 import base64
 import cv2
 from typing import List, Literal, Optional, Union
 from PIL import Image
 
 from utils.image import download_image
+from utils.download import download_file
+from utils.tracing import span
 
 
 
 class ImageOutput:
-    fmt: Literal["b64", "url", "pil", "np"]
+    fmt: Literal["b64", "url", "pil", "np", "file"]
     ext: str = "png"
     data: Union[str, Image.Image]
 
     def __init__(
         self,
-        fmt: Literal["b64", "url", "pil", "np"],
+        fmt: Literal["b64", "url", "pil", "np", "file"],
         ext: str,
         data: Union[str, Image.Image],
     ):
@@ -56,6 +61,35 @@ class ImageOutput:
         """
         cv2.imencode('.png', self.data)[1].tofile(path)
 
+    def save_file(self, path: str) -> None:
+        """Hard-link a local image file to the specified path, or copy it if linking is not possible.
+
+        Args:
+            path (str): Path where the image will be saved.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.link(self.data, path)
+        except OSError:
+            shutil.copyfile(self.data, path)
+
     def save(self, path: str) -> None:
         save_func = getattr(self, f"save_{self.fmt}")
-        save_func(path)
\ No newline at end of file
+        with span(f"save_{self.fmt}", "save", path=path) as save_span:
+            save_func(path)
+            save_span.add("bytes_out", os.path.getsize(path))
+
+    async def asave(self, path: str) -> None:
+        """Save the image without blocking the event loop. URLs are downloaded with
+        the resumable async downloader, other formats are saved in a worker thread.
+
+        Args:
+            path (str): Path where the image will be saved.
+        """
+        if self.fmt == "url":
+            with span("save_url", "save", path=path) as save_span:
+                await download_file(self.data, path)
+                save_span.add("bytes_out", os.path.getsize(path))
+        else:
+            await asyncio.to_thread(self.save, path)
\ No newline at end of file
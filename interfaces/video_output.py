@@ -1,18 +1,22 @@
+import os
+import shutil
 import asyncio
 from typing import List, Literal, Optional, Union
 from PIL import Image
 
 from utils.video import download_video
+from utils.download import download_file
+from utils.tracing import span
 
 
 class VideoOutput:
-    fmt: Literal["url", "bytes"]
+    fmt: Literal["url", "bytes", "file"]
     ext: str = "mp4"
     data: Union[str, bytes]
 
     def __init__(
         self,
-        fmt: Literal["url", "bytes"],
+        fmt: Literal["url", "bytes", "file"],
         ext: str,
         data: Union[str, bytes],
     ):
@@ -37,7 +41,36 @@ class VideoOutput:
         with open(path, 'wb') as f:
             f.write(self.data)
 
+    def save_file(self, path: str) -> None:
+        """Hard-link a local video file to the specified path, or copy it if linking is not possible.
+
+        Args:
+            path (str): Path where the video will be saved.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.link(self.data, path)
+        except OSError:
+            shutil.copyfile(self.data, path)
+
     def save(self, path: str) -> None:
         save_func = getattr(self, f"save_{self.fmt}")
-        save_func(path)
+        with span(f"save_{self.fmt}", "save", path=path) as save_span:
+            save_func(path)
+            save_span.add("bytes_out", os.path.getsize(path))
+
+    async def asave(self, path: str) -> None:
+        """Save the video without blocking the event loop. URLs are downloaded with
+        the resumable async downloader, other formats are saved in a worker thread.
+
+        Args:
+            path (str): Path where the video will be saved.
+        """
+        if self.fmt == "url":
+            with span("save_url", "save", path=path) as save_span:
+                await download_file(self.data, path)
+                save_span.add("bytes_out", os.path.getsize(path))
+        else:
+            await asyncio.to_thread(self.save, path)
 
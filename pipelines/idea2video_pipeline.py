@@ -3,14 +3,15 @@ import logging
 from agents import Screenwriter, CharacterExtractor, CharacterPortraitsGenerator
 from pipelines.script2video_pipeline import Script2VideoPipeline
 from interfaces import CharacterInScene
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 import asyncio
 import json
-from moviepy import VideoFileClip, concatenate_videoclips
 import yaml
-from langchain.chat_models import init_chat_model
-from utils.rate_limiter import RateLimiter
-import importlib
+from utils.video import concatenate_videos
+from utils.http import close_http_sessions
+from utils.run_manifest import RunManifest, inputs_sha256
+from utils.tracing import trace_run
+from utils.pipeline_config import build_models_from_config
 
 
 class Idea2VideoPipeline:
@@ -20,13 +21,18 @@ class Idea2VideoPipeline:
         image_generator: str,
         video_generator: str,
         working_dir: str,
+        max_concurrent_scenes: int = 1,
     ):
         self.chat_model = chat_model
         self.image_generator = image_generator
         self.video_generator = video_generator
         self.working_dir = working_dir
+        self.max_concurrent_scenes = max_concurrent_scenes
         os.makedirs(self.working_dir, exist_ok=True)
 
+        # Stages and artifacts of the run before the scenes; every scene has its own manifest
+        self.run_manifest = RunManifest(self.working_dir)
+
         self.screenwriter = Screenwriter(chat_model=self.chat_model)
         self.character_extractor = CharacterExtractor(
             chat_model=self.chat_model)
@@ -41,87 +47,30 @@ class Idea2VideoPipeline:
         with open(config_path, "r") as f:
             config = yaml.safe_load(f)
 
-        chat_model_args = config["chat_model"]["init_args"]
-        chat_model = init_chat_model(**chat_model_args)
-
-        # Create separate rate limiters for each service
-        chat_model_rpm = config.get("chat_model", {}).get("max_requests_per_minute", None)
-        chat_model_rpd = config.get("chat_model", {}).get("max_requests_per_day", None)
-        image_generator_rpm = config.get("image_generator", {}).get("max_requests_per_minute", None)
-        image_generator_rpd = config.get("image_generator", {}).get("max_requests_per_day", None)
-        video_generator_rpm = config.get("video_generator", {}).get("max_requests_per_minute", None)
-        video_generator_rpd = config.get("video_generator", {}).get("max_requests_per_day", None)
-
-        chat_model_rate_limiter = RateLimiter(
-            max_requests_per_minute=chat_model_rpm,
-            max_requests_per_day=chat_model_rpd
-        ) if (chat_model_rpm or chat_model_rpd) else None
-
-        image_rate_limiter = RateLimiter(
-            max_requests_per_minute=image_generator_rpm,
-            max_requests_per_day=image_generator_rpd
-        ) if (image_generator_rpm or image_generator_rpd) else None
-
-        video_rate_limiter = RateLimiter(
-            max_requests_per_minute=video_generator_rpm,
-            max_requests_per_day=video_generator_rpd
-        ) if (video_generator_rpm or video_generator_rpd) else None
-
-        # Display rate limiting configuration
-        if chat_model_rate_limiter:
-            limits = []
-            if chat_model_rpm:
-                limits.append(f"{chat_model_rpm} req/min")
-            if chat_model_rpd:
-                limits.append(f"{chat_model_rpd} req/day")
-            print(f"Chat model rate limiting: {', '.join(limits)}")
-
-        if image_rate_limiter:
-            limits = []
-            if image_generator_rpm:
-                limits.append(f"{image_generator_rpm} req/min")
-            if image_generator_rpd:
-                limits.append(f"{image_generator_rpd} req/day")
-            print(f"Image generator rate limiting: {', '.join(limits)}")
-
-        if video_rate_limiter:
-            limits = []
-            if video_generator_rpm:
-                limits.append(f"{video_generator_rpm} req/min")
-            if video_generator_rpd:
-                limits.append(f"{video_generator_rpd} req/day")
-            print(f"Video generator rate limiting: {', '.join(limits)}")
-
-        image_generator_cls_module, image_generator_cls_name = config["image_generator"]["class_path"].rsplit(
-            ".", 1)
-        image_generator_cls = getattr(importlib.import_module(
-            image_generator_cls_module), image_generator_cls_name)
-        image_generator_args = config["image_generator"]["init_args"]
-        image_generator_args["rate_limiter"] = image_rate_limiter
-        image_generator = image_generator_cls(**image_generator_args)
-
-        video_generator_cls_module, video_generator_cls_name = config["video_generator"]["class_path"].rsplit(
-            ".", 1)
-        video_generator_cls = getattr(importlib.import_module(
-            video_generator_cls_module), video_generator_cls_name)
-        video_generator_args = config["video_generator"]["init_args"]
-        video_generator_args["rate_limiter"] = video_rate_limiter
-        video_generator = video_generator_cls(**video_generator_args)
+        chat_model, image_generator, video_generator = build_models_from_config(config)
 
         return cls(
             chat_model=chat_model,
             image_generator=image_generator,
             video_generator=video_generator,
             working_dir=config["working_dir"],
+            max_concurrent_scenes=config.get("max_concurrent_scenes", 1),
         )
 
+    async def close(self):
+        """
+        Close the pooled HTTP connections of the tools. Call it once the pipeline is no longer used.
+        """
+        await close_http_sessions()
+
     async def extract_characters(
         self,
         story: str,
     ):
         save_path = os.path.join(self.working_dir, "characters.json")
+        inputs_hash = inputs_sha256(story)
 
-        if os.path.exists(save_path):
+        if await self.run_manifest.ais_done(save_path, stage="characters", inputs_hash=inputs_hash):
             with open(save_path, "r", encoding="utf-8") as f:
                 characters = json.load(f)
             characters = [CharacterInScene.model_validate(
@@ -129,9 +78,8 @@ class Idea2VideoPipeline:
             print(f"🚀 Loaded {len(characters)} characters from existing file.")
         else:
             characters = await self.character_extractor.extract_characters(story)
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump([character.model_dump()
-                          for character in characters], f, ensure_ascii=False, indent=4)
+            await self.run_manifest.awrite_json(
+                save_path, [character.model_dump() for character in characters], stage="characters", inputs_hash=inputs_hash)
             print(
                 f"✅ Extracted {len(characters)} characters from story and saved to {save_path}.")
 
@@ -145,8 +93,9 @@ class Idea2VideoPipeline:
     ):
         character_portraits_registry_path = os.path.join(
             self.working_dir, "character_portraits_registry.json")
+        inputs_hash = inputs_sha256(style, [character.model_dump() for character in characters])
         if character_portraits_registry is None:
-            if os.path.exists(character_portraits_registry_path):
+            if await self.run_manifest.ais_done(character_portraits_registry_path, stage="portraits", inputs_hash=inputs_hash):
                 with open(character_portraits_registry_path, 'r', encoding='utf-8') as f:
                     character_portraits_registry = json.load(f)
             else:
@@ -158,11 +107,12 @@ class Idea2VideoPipeline:
             if character.identifier_in_scene not in character_portraits_registry
         ]
         if tasks:
+            # The portraits of an interrupted run are found in the run manifest,
+            # so the registry is only written once it is complete
             for future in asyncio.as_completed(tasks):
                 character_portraits_registry.update(await future)
-                with open(character_portraits_registry_path, 'w', encoding='utf-8') as f:
-                    json.dump(character_portraits_registry,
-                              f, ensure_ascii=False, indent=4)
+            await self.run_manifest.awrite_json(
+                character_portraits_registry_path, character_portraits_registry, stage="portraits", inputs_hash=inputs_hash)
 
             print(
                 f"✅ Completed character portrait generation for {len(characters)} characters.")
@@ -178,15 +128,15 @@ class Idea2VideoPipeline:
         user_requirement: str,
     ):
         save_path = os.path.join(self.working_dir, "story.txt")
-        if os.path.exists(save_path):
+        inputs_hash = inputs_sha256(idea, user_requirement)
+        if await self.run_manifest.ais_done(save_path, stage="story", inputs_hash=inputs_hash):
             with open(save_path, "r", encoding="utf-8") as f:
                 story = f.read()
             print(f"🚀 Loaded story from existing file.")
         else:
             print("🧠 Developing story...")
             story = await self.screenwriter.develop_story(idea=idea, user_requirement=user_requirement)
-            with open(save_path, "w", encoding="utf-8") as f:
-                f.write(story)
+            await self.run_manifest.awrite_text(save_path, story, stage="story", inputs_hash=inputs_hash)
             print(f"✅ Developed story and saved to {save_path}.")
 
         return story
@@ -197,15 +147,15 @@ class Idea2VideoPipeline:
         user_requirement: str,
     ):
         save_path = os.path.join(self.working_dir, "script.json")
-        if os.path.exists(save_path):
+        inputs_hash = inputs_sha256(story, user_requirement)
+        if await self.run_manifest.ais_done(save_path, stage="script", inputs_hash=inputs_hash):
             with open(save_path, "r", encoding="utf-8") as f:
                 script = json.load(f)
             print(f"🚀 Loaded script from existing file.")
         else:
             print("🧠 Writing script based on story...")
             script = await self.screenwriter.write_script_based_on_story(story=story, user_requirement=user_requirement)
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump(script, f, ensure_ascii=False, indent=4)
+            await self.run_manifest.awrite_json(save_path, script, stage="script", inputs_hash=inputs_hash)
             print(f"✅ Written script based on story and saved to {save_path}.")
         return script
 
@@ -219,25 +169,32 @@ class Idea2VideoPipeline:
         os.makedirs(character_dir, exist_ok=True)
 
         front_portrait_path = os.path.join(character_dir, "front.png")
-        if os.path.exists(front_portrait_path):
+        inputs_hash = inputs_sha256(character.model_dump(), style)
+        if await self.run_manifest.ais_done(front_portrait_path, stage="portrait", inputs_hash=inputs_hash):
             pass
         else:
-            front_portrait_output = await self.character_portraits_generator.generate_front_portrait(character, style)
-            front_portrait_output.save(front_portrait_path)
+            async with self.run_manifest.awriting(front_portrait_path, stage="portrait", inputs_hash=inputs_hash) as tmp_path:
+                front_portrait_output = await self.character_portraits_generator.generate_front_portrait(character, style)
+                await front_portrait_output.asave(tmp_path)
+
+        # The side and back views are drawn from the front view, so they are redone when it changes
+        inputs_hash = inputs_sha256(character.model_dump(), await self.run_manifest.acontent_hash(front_portrait_path))
 
         side_portrait_path = os.path.join(character_dir, "side.png")
-        if os.path.exists(side_portrait_path):
+        if await self.run_manifest.ais_done(side_portrait_path, stage="portrait", inputs_hash=inputs_hash):
             pass
         else:
-            side_portrait_output = await self.character_portraits_generator.generate_side_portrait(character, front_portrait_path)
-            side_portrait_output.save(side_portrait_path)
+            async with self.run_manifest.awriting(side_portrait_path, stage="portrait", inputs_hash=inputs_hash) as tmp_path:
+                side_portrait_output = await self.character_portraits_generator.generate_side_portrait(character, front_portrait_path)
+                await side_portrait_output.asave(tmp_path)
 
         back_portrait_path = os.path.join(character_dir, "back.png")
-        if os.path.exists(back_portrait_path):
+        if await self.run_manifest.ais_done(back_portrait_path, stage="portrait", inputs_hash=inputs_hash):
             pass
         else:
-            back_portrait_output = await self.character_portraits_generator.generate_back_portrait(character, front_portrait_path)
-            back_portrait_output.save(back_portrait_path)
+            async with self.run_manifest.awriting(back_portrait_path, stage="portrait", inputs_hash=inputs_hash) as tmp_path:
+                back_portrait_output = await self.character_portraits_generator.generate_back_portrait(character, front_portrait_path)
+                await back_portrait_output.asave(tmp_path)
 
         print(
             f"☑️ Completed character portrait generation for {character.identifier_in_scene}.")
@@ -259,6 +216,89 @@ class Idea2VideoPipeline:
             }
         }
 
+    async def generate_scene_videos(
+        self,
+        scene_scripts: List[str],
+        user_requirement: str,
+        style: str,
+        characters: List[CharacterInScene],
+        character_portraits_registry: Dict[str, Dict[str, Dict[str, str]]],
+        on_scene_completed: Optional[Callable[[int, str], None]] = None,
+    ) -> List[str]:
+        """
+        Run a Script2VideoPipeline for every scene, up to max_concurrent_scenes at a time.
+
+        All scenes share this pipeline's chat model, image generator and video generator,
+        so their rate limiters and adaptive concurrency limits apply across scenes, and
+        the provider quota rather than the scene order bounds how much work is in flight.
+
+        Args:
+            on_scene_completed: Called with the scene index and its video path whenever a scene finishes.
+
+        Returns:
+            The video paths of the scenes, in scene order.
+        """
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrent_scenes))
+
+        async def generate_scene_video(idx: int, scene_script: str) -> str:
+            async with semaphore:
+                scene_working_dir = os.path.join(self.working_dir, f"scene_{idx}")
+                os.makedirs(scene_working_dir, exist_ok=True)
+                script2video_pipeline = Script2VideoPipeline(
+                    chat_model=self.chat_model,
+                    image_generator=self.image_generator,
+                    video_generator=self.video_generator,
+                    working_dir=scene_working_dir,
+                )
+                print(f"🎞️ Starting scene {idx}...")
+                final_video_path = await script2video_pipeline(
+                    script=scene_script,
+                    user_requirement=user_requirement,
+                    style=style,
+                    characters=characters,
+                    character_portraits_registry=character_portraits_registry,
+                )
+                print(f"☑️ Completed scene {idx}.")
+
+            if on_scene_completed is not None:
+                on_scene_completed(idx, final_video_path)
+            return final_video_path
+
+        tasks = [
+            asyncio.create_task(generate_scene_video(idx, scene_script))
+            for idx, scene_script in enumerate(scene_scripts)
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def concatenate_scene_videos(
+        self,
+        all_video_paths: List[str],
+    ) -> str:
+        """
+        Concatenate the scene videos into the final video, recorded in the run manifest,
+        so that it is made again whenever one of the scene videos changed.
+
+        Returns:
+            The path of the final video.
+        """
+        final_video_path = os.path.join(self.working_dir, "final_video.mp4")
+        inputs_hash = inputs_sha256(await asyncio.gather(*[self.run_manifest.acontent_hash(video_path) for video_path in all_video_paths]))
+        if await self.run_manifest.ais_done(final_video_path, stage="final_video", inputs_hash=inputs_hash):
+            print(f"🚀 Skipped concatenating videos, already exists.")
+        else:
+            print(f"🎬 Starting concatenating videos...")
+            async with self.run_manifest.awriting(final_video_path, stage="final_video", inputs_hash=inputs_hash) as tmp_path:
+                mode = await asyncio.to_thread(concatenate_videos, all_video_paths, tmp_path)
+            print(f"☑️ Concatenated videos ({mode}), saved to {final_video_path}.")
+        return final_video_path
+
+    @trace_run()
     async def __call__(
         self,
         idea: str,
@@ -278,34 +318,12 @@ class Idea2VideoPipeline:
 
         scene_scripts = await self.write_script_based_on_story(story=story, user_requirement=user_requirement)
 
-        all_video_paths = []
-
-        for idx, scene_script in enumerate(scene_scripts):
-            scene_working_dir = os.path.join(self.working_dir, f"scene_{idx}")
-            os.makedirs(scene_working_dir, exist_ok=True)
-            script2video_pipeline = Script2VideoPipeline(
-                chat_model=self.chat_model,
-                image_generator=self.image_generator,
-                video_generator=self.video_generator,
-                working_dir=scene_working_dir,
-            )
-            final_video_path = await script2video_pipeline(
-                script=scene_script,
-                user_requirement=user_requirement,
-                style=style,
-                characters=characters,
-                character_portraits_registry=character_portraits_registry,
-            )
-            all_video_paths.append(final_video_path)
+        all_video_paths = await self.generate_scene_videos(
+            scene_scripts=scene_scripts,
+            user_requirement=user_requirement,
+            style=style,
+            characters=characters,
+            character_portraits_registry=character_portraits_registry,
+        )
 
-        final_video_path = os.path.join(self.working_dir, "final_video.mp4")
-        if os.path.exists(final_video_path):
-            print(f"🚀 Skipped concatenating videos, already exists.")
-        else:
-            print(f"🎬 Starting concatenating videos...")
-            video_clips = [VideoFileClip(final_video_path)
-                           for final_video_path in all_video_paths]
-            final_video = concatenate_videoclips(video_clips)
-            final_video.write_videofile(final_video_path)
-            print(f"☑️ Concatenated videos, saved to {final_video_path}.")
-        return final_video_path
+        return await self.concatenate_scene_videos(all_video_paths)
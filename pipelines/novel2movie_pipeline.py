@@ -2,15 +2,14 @@
 
 import os
 import shutil
+import hashlib
 import yaml
 import json
 import importlib
 import asyncio
-from typing import List, Dict
+from typing import List, Dict, Optional
 from langchain.embeddings import CacheBackedEmbeddings
 from langchain.storage import LocalFileStore
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
 from PIL import Image
 
 from components.event import Event
@@ -18,14 +17,25 @@ from components.scene import Scene
 from components.character import CharacterInScene, CharacterInNovel, CharacterInEvent
 from pipelines.base import BasePipeline
 from tenacity import retry
+from utils.knowledge_base import PersistentKnowledgeBase
+from utils.tracing import trace_run
 
 class Novel2MoviePipeline(BasePipeline):
 
+    @trace_run()
     async def __call__(
         self,
-        novel_text: str,
+        novel_text: Optional[str],
         style: str,
+        novel_path: Optional[str] = None,
     ):
+        """
+        Args:
+            novel_text: Text of the novel. Pass None and set novel_path instead for a large novel,
+                        which is then streamed from the file rather than held in memory.
+            style: Visual style of the movie.
+            novel_path: Path of a UTF-8 text file with the novel, used when novel_text is None.
+        """
         print("🎬 Novel to Movie Pipeline Started".center(80, "="))
 
         # Step 1: Compress the novel text
@@ -34,64 +44,101 @@ class Novel2MoviePipeline(BasePipeline):
 
         working_dir_novel_compressor = os.path.join(self.working_dir, "novel")
         os.makedirs(working_dir_novel_compressor, exist_ok=True)
-        with open(os.path.join(working_dir_novel_compressor, "novel.txt"), "w", encoding="utf-8") as f:
-            f.write(novel_text)
+        working_novel_path = os.path.join(working_dir_novel_compressor, "novel.txt")
+        if novel_text is not None:
+            with open(working_novel_path, "w", encoding="utf-8") as f:
+                f.write(novel_text)
+        elif os.path.abspath(novel_path) != os.path.abspath(working_novel_path):
+            shutil.copyfile(novel_path, working_novel_path)
+        # Later steps read the novel from the working directory again when they need it
         print(f"🗂️ Working directory: {working_dir_novel_compressor}")
 
-        print("🔖 Splitting the novel into chunks...")
-        novel_chunks = self.novel_compressor.split(novel_text)
-        for idx, novel_chunk in enumerate(novel_chunks):
-            with open(os.path.join(working_dir_novel_compressor, f"novel_chunk_{idx}.txt"), "w", encoding="utf-8") as f:
-                f.write(novel_chunk)
-        print(f"🔖 Split the novel into {len(novel_chunks)} chunks, all saved to {working_dir_novel_compressor}.")
+        # Chunks are read lazily from the file, and compression starts on the first ones
+        # while the later ones are still being read
+        print("🔖 Splitting and compressing the novel chunks...")
+        # Compressed chunks are keyed by the hash of their text rather than by their position,
+        # so that after an edit only the chunks whose text changed are compressed again
+        working_dir_compressed_chunks = os.path.join(working_dir_novel_compressor, "compressed_chunks")
+        os.makedirs(working_dir_compressed_chunks, exist_ok=True)
+        manifest_path = os.path.join(working_dir_novel_compressor, "chunks.json")
+        previous_manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                previous_manifest = json.load(f)
 
+        sem = asyncio.Semaphore(5)
+        chunk_hashes = {}
+        reused_chunk_indices = []
 
-        print()
-        print("🔖 Compressing the novel chunks...")
-        compressed_novel_chunks = [None] * len(novel_chunks)
-        index_chunk_pairs_unfinished = []
-        for index, novel_chunk in enumerate(novel_chunks):
-            path = os.path.join(working_dir_novel_compressor, f"novel_chunk_{index}_compressed.txt")
+        async def compress_chunk(index: int, novel_chunk: str) -> str:
+            with open(os.path.join(working_dir_novel_compressor, f"novel_chunk_{index}.txt"), "w", encoding="utf-8") as f:
+                f.write(novel_chunk)
+
+            chunk_hash = hashlib.sha256(novel_chunk.encode("utf-8")).hexdigest()
+            chunk_hashes[index] = chunk_hash
+            path = os.path.join(working_dir_compressed_chunks, f"{chunk_hash}.txt")
             if os.path.exists(path):
-                compressed_novel_chunks[index] = open(path, "r", encoding="utf-8").read()
-                print(f"⏭️ Skipping compression for chunk {index} as it already exists.")
-            else:
-                index_chunk_pairs_unfinished.append((index, novel_chunk))
+                reused_chunk_indices.append(index)
+                with open(path, "r", encoding="utf-8") as f:
+                    return f.read()
 
-        sem = asyncio.Semaphore(5)
-        tasks = [
-            self.novel_compressor.compress_single_novel_chunk(sem, index, novel_chunk)
-            for index, novel_chunk in index_chunk_pairs_unfinished
-        ]
-        task_outputs = await asyncio.gather(*tasks)
-        for index, novel_chunk_compressed in task_outputs:
-            save_path = os.path.join(working_dir_novel_compressor, f"novel_chunk_{index}_compressed.txt")
-            with open(save_path, "w", encoding="utf-8") as f:
+            _, novel_chunk_compressed = await self.novel_compressor.compress_single_novel_chunk(sem, index, novel_chunk)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
                 f.write(novel_chunk_compressed)
-            print(f"✅ Compressed chunk {index}, saved to {save_path}")
-            compressed_novel_chunks[index] = novel_chunk_compressed
-        print("🔖 Compressed all novel chunks.")
+            os.replace(path + ".tmp", path)
+            print(f"✅ Compressed chunk {index}, saved to {path}")
+            return novel_chunk_compressed
+
+        compressed_novel_chunks = await self.novel_compressor.compress_stream(
+            self.novel_compressor.split_stream(working_novel_path),
+            compress_chunk,
+            max_concurrent_tasks=5,
+        )
+        novel_length = self.novel_compressor.num_chars_read
+        print(f"🔖 Split the novel into {len(compressed_novel_chunks)} chunks: {len(reused_chunk_indices)} reused, "
+              f"{len(compressed_novel_chunks) - len(reused_chunk_indices)} compressed, saved to {working_dir_compressed_chunks}.")
+
+        compressed_inputs_hash = hashlib.sha256("\0".join(chunk_hashes[index] for index in range(len(compressed_novel_chunks))).encode("utf-8")).hexdigest()
+        manifest = {
+            "chunks": [
+                {"index": index, "sha256": chunk_hashes[index]}
+                for index in range(len(compressed_novel_chunks))
+            ],
+            "compressed_novel_inputs_sha256": previous_manifest.get("compressed_novel_inputs_sha256"),
+        }
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=4)
 
 
         print()
         print("🔖 Merging the compressed novel chunks...")
         path = os.path.join(working_dir_novel_compressor, "novel_compressed.txt")
-        if os.path.exists(path):
+        if os.path.exists(path) and manifest["compressed_novel_inputs_sha256"] == compressed_inputs_hash:
             compressed_novel = open(path, "r", encoding="utf-8").read()
-            print(f"⏭️ Skipping merging as {path} already exists.")
+            print(f"⏭️ Skipping merging as {path} already exists for the same chunks.")
         else:
-            compressed_novel = self.novel_compressor.aggregate(compressed_novel_chunks)
+            if self.novel_compressor.aggregate_mode == "hierarchical":
+                compressed_novel = await self.novel_compressor.aggregate_hierarchical(
+                    compressed_novel_chunks,
+                    checkpoint_dir=os.path.join(working_dir_novel_compressor, "aggregate"),
+                )
+            else:
+                compressed_novel = self.novel_compressor.aggregate(compressed_novel_chunks)
             with open(path, "w", encoding="utf-8") as f:
                 f.write(compressed_novel)
+            manifest["compressed_novel_inputs_sha256"] = compressed_inputs_hash
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=4)
             print(f"✅ Merged the compressed novel chunks, saved to {path}")
         print(f"🔖 Merging completed.")
 
         # summary
         print()
         print("📌 Summary:")
-        print(f"📌 Before Compression: {len(novel_text)} characters")
+        print(f"📌 Before Compression: {novel_length} characters")
         print(f"📌 After Compression: {len(compressed_novel)} characters")
-        print(f"📌 Compression Ratio: {len(compressed_novel) / len(novel_text):.2%}")
+        print(f"📌 Compression Ratio: {len(compressed_novel) / novel_length:.2%}")
+        print(f"📌 Chunks Reused: {len(reused_chunk_indices)} of {len(compressed_novel_chunks)}")
 
         print("📋 Step 1: Compress the novel text".center(80, "-"))
 
@@ -120,6 +167,19 @@ class Novel2MoviePipeline(BasePipeline):
         else:
             print("🔖 Starting event extraction ...")
 
+        if self.event_extractor.mode == "windowed" and (len(extracted_events) == 0 or not extracted_events[-1].is_last):
+            # Windows are extracted all at once, so a partial sequential run is redone from scratch
+            extracted_events = await self.event_extractor.extract_events_windowed(compressed_novel)
+            # The windows may yield fewer events than an earlier run, whose extra files would be loaded on resume
+            for event_json_fname in os.listdir(working_dir_event_extractor):
+                if event_json_fname.startswith("event_") and event_json_fname.endswith(".json"):
+                    os.remove(os.path.join(working_dir_event_extractor, event_json_fname))
+            for event in extracted_events:
+                event_json_path = os.path.join(working_dir_event_extractor, f"event_{event.index}.json")
+                with open(event_json_path, "w", encoding="utf-8") as f:
+                    json.dump(event.model_dump(), f, ensure_ascii=False, indent=4)
+            print(f"✅ Extracted {len(extracted_events)} events from overlapping windows, saved to {working_dir_event_extractor}")
+
         while len(extracted_events) == 0 or not extracted_events[-1].is_last:
             next_event = self.event_extractor.extract_next_event(
                 novel_text=compressed_novel,
@@ -136,6 +196,10 @@ class Novel2MoviePipeline(BasePipeline):
         print()
         print("📌 Summary:")
         print(f"📌 Extracted a total of {len(extracted_events)} events.")
+        savings = self.event_extractor.stats().get("windowed_savings")
+        if savings is not None:
+            print(f"📌 Windowed extraction: {savings['windowed_input_tokens']} input tokens instead of ~{savings['estimated_sequential_input_tokens']} sequentially, "
+                  f"~{savings['seconds_saved']:.0f}s saved, {savings['duplicates_merged']} boundary duplicates merged")
 
         print("📋 Step 2: Extract events from the compressed novel".center(80, "-"))
 
@@ -158,22 +222,29 @@ class Novel2MoviePipeline(BasePipeline):
             namespace=self.embeddings.model,
             key_encoder="sha256",
         )
-        novel_splitter = RecursiveCharacterTextSplitter(
+        # The index is saved next to the embedding cache, and only chunks with a new hash are embedded
+        persistent_knowledge_base = PersistentKnowledgeBase(
+            root_dir=working_dir_knowledge_base,
+            embeddings=embeddings,
+            namespace=self.embeddings.model,
             chunk_size=512,
             chunk_overlap=128,
         )
-        novel_chunks = novel_splitter.split_text(novel_text)
-        knowledge_base = FAISS.from_texts(texts=novel_chunks, embedding=embeddings)
-        print(f"🔖 Constructed knowledge base with {len(novel_chunks)} chunks, saved to {working_dir_knowledge_base}")
+        # The novel is hashed and split block by block, so it is never held in memory as a whole
+        knowledge_base = persistent_knowledge_base.load_file(working_novel_path)
+        knowledge_base_stats = persistent_knowledge_base.stats()
+        print(
+            f"🔖 Knowledge base {knowledge_base_stats['mode']} in {knowledge_base_stats['seconds']:.1f}s: {knowledge_base_stats['chunks']} chunks, "
+            f"{knowledge_base_stats['embedded']} embedded, {knowledge_base_stats['reused']} reused, {knowledge_base_stats['removed']} removed, saved to {working_dir_knowledge_base}"
+        )
 
 
         print("🔖 Retrieving relevant chunks for each event...")
-        async def retrieve_relevant_chunks(sem, knowledge_base, event):
+        async def retrieve_relevant_chunks(sem, process_chunks, event):
             async with sem:
                 relevant_chunk_score_dict = {}
-                for process in event.process_chain:
-                    chunks = knowledge_base.similarity_search(process, k=10)
-                    chunks = [chunk.page_content for chunk in chunks if chunk.page_content not in relevant_chunk_score_dict]
+                for process, chunks in zip(event.process_chain, process_chunks):
+                    chunks = [chunk for chunk in chunks if chunk not in relevant_chunk_score_dict]
 
                     chunk_score_pairs = await self.rerank_model(
                         documents=chunks,
@@ -195,6 +266,7 @@ class Novel2MoviePipeline(BasePipeline):
 
         sem = asyncio.Semaphore(10)
         tasks = []
+        unfinished_events = []
         for event in extracted_events:
             chunks_dir = os.path.join(working_dir_retrieve, f"event_{event.index}")
             if os.path.exists(chunks_dir) and len(os.listdir(chunks_dir)) > 0:
@@ -208,7 +280,18 @@ class Novel2MoviePipeline(BasePipeline):
                 event_idx_to_relevant_chunk_score_dict[event.index] = relevant_chunk_score_dict
                 print(f"⏭️ Skipping retrieval for event {event.index} as it already exists.")
             else:
-                tasks.append(retrieve_relevant_chunks(sem, knowledge_base, event))
+                unfinished_events.append(event)
+
+        # Embed the processes of all events at once and search them in one batch, off the event loop
+        processes = [process for event in unfinished_events for process in event.process_chain]
+        process_chunks = await asyncio.to_thread(persistent_knowledge_base.search_batch, processes, 10)
+        offset = 0
+        for event in unfinished_events:
+            tasks.append(retrieve_relevant_chunks(sem, process_chunks[offset:offset + len(event.process_chain)], event))
+            offset += len(event.process_chain)
+        if len(processes) > 0:
+            knowledge_base_stats = persistent_knowledge_base.stats()
+            print(f"🔖 Searched {len(processes)} processes in one batch ({knowledge_base_stats['queries_embedded']} embedded) in {knowledge_base_stats['search_seconds']:.1f}s")
 
         if len(tasks) > 0:
             for task in asyncio.as_completed(tasks):
@@ -223,6 +306,10 @@ class Novel2MoviePipeline(BasePipeline):
                 print(f"✅ Retrieved {len(relevant_chunk_score_dict)} relevant chunks for event {event_index}, saved to {chunks_dir}")
 
         print("🔖 Retrieved relevant chunks for all events.")
+        if hasattr(self.rerank_model, "stats"):
+            rerank_stats = self.rerank_model.stats()
+            print(f"🔖 Reranking: {rerank_stats['documents_sent']} of {rerank_stats['documents_requested']} documents sent in {rerank_stats['requests']} requests, "
+                  f"{rerank_stats['memory_hits'] + rerank_stats['cache_hits']} scores reused, {rerank_stats['in_flight_merged']} merged with requests in flight")
         print("📋 Step 3: Retrieve relevant chunks for each event".center(80, "-"))
 
 
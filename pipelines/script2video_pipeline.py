@@ -5,24 +5,24 @@ import logging
 import asyncio
 import time
 from typing import Optional, Dict, List, Tuple, Literal
-from moviepy import VideoFileClip, concatenate_videoclips
 from PIL import Image
 from agents import *
 import yaml
 from interfaces import *
-from langchain.chat_models import init_chat_model
 from utils.timer import Timer
-from utils.rate_limiter import RateLimiter
-import importlib
+from utils.video import concatenate_videos
+from utils.image import prepared_image_cache
+from utils.http import close_http_sessions, http_stats
+from utils.llm_cache import get_llm_response_cache
+from utils.task_graph import TaskGraph
+from utils.run_manifest import RunManifest, inputs_sha256
+import functools
+from utils.tracing import trace_run
+from utils.pipeline_config import build_models_from_config
 
 
 class Script2VideoPipeline:
 
-    # events
-    character_portrait_events = {}
-    shot_desc_events = {}
-    frame_events = {}
-
     def __init__(
         self,
         chat_model: str,
@@ -44,6 +44,16 @@ class Script2VideoPipeline:
         self.working_dir = working_dir
         os.makedirs(self.working_dir, exist_ok=True)
 
+        # Status, content hash, inputs hash and timing of every stage and artifact of the run
+        self.run_manifest = RunManifest(self.working_dir)
+
+        # events, per instance so that pipelines of concurrently running scenes do not share them
+        self.character_portrait_events = {}
+        self.shot_desc_events = {}
+        self.frame_events = {}
+        # errors of failed frame nodes, by shot, so that their waiters fail instead of blocking
+        self.frame_errors = {}
+
     @classmethod
     def init_from_config(
         cls,
@@ -52,68 +62,7 @@ class Script2VideoPipeline:
         with open(config_path, "r") as f:
             config = yaml.safe_load(f)
 
-        chat_model_args = config["chat_model"]["init_args"]
-        chat_model = init_chat_model(**chat_model_args)
-
-        # Create separate rate limiters for each service
-        chat_model_rpm = config.get("chat_model", {}).get("max_requests_per_minute", None)
-        chat_model_rpd = config.get("chat_model", {}).get("max_requests_per_day", None)
-        image_generator_rpm = config.get("image_generator", {}).get("max_requests_per_minute", None)
-        image_generator_rpd = config.get("image_generator", {}).get("max_requests_per_day", None)
-        video_generator_rpm = config.get("video_generator", {}).get("max_requests_per_minute", None)
-        video_generator_rpd = config.get("video_generator", {}).get("max_requests_per_day", None)
-
-        chat_model_rate_limiter = RateLimiter(
-            max_requests_per_minute=chat_model_rpm,
-            max_requests_per_day=chat_model_rpd
-        ) if (chat_model_rpm or chat_model_rpd) else None
-
-        image_rate_limiter = RateLimiter(
-            max_requests_per_minute=image_generator_rpm,
-            max_requests_per_day=image_generator_rpd
-        ) if (image_generator_rpm or image_generator_rpd) else None
-
-        video_rate_limiter = RateLimiter(
-            max_requests_per_minute=video_generator_rpm,
-            max_requests_per_day=video_generator_rpd
-        ) if (video_generator_rpm or video_generator_rpd) else None
-
-        # Display rate limiting configuration
-        if chat_model_rate_limiter:
-            limits = []
-            if chat_model_rpm:
-                limits.append(f"{chat_model_rpm} req/min")
-            if chat_model_rpd:
-                limits.append(f"{chat_model_rpd} req/day")
-            print(f"Chat model rate limiting: {', '.join(limits)}")
-
-        if image_rate_limiter:
-            limits = []
-            if image_generator_rpm:
-                limits.append(f"{image_generator_rpm} req/min")
-            if image_generator_rpd:
-                limits.append(f"{image_generator_rpd} req/day")
-            print(f"Image generator rate limiting: {', '.join(limits)}")
-
-        if video_rate_limiter:
-            limits = []
-            if video_generator_rpm:
-                limits.append(f"{video_generator_rpm} req/min")
-            if video_generator_rpd:
-                limits.append(f"{video_generator_rpd} req/day")
-            print(f"Video generator rate limiting: {', '.join(limits)}")
-
-        image_generator_cls_module, image_generator_cls_name = config["image_generator"]["class_path"].rsplit(".", 1)
-        image_generator_cls = getattr(importlib.import_module(image_generator_cls_module), image_generator_cls_name)
-        image_generator_args = config["image_generator"]["init_args"]
-        image_generator_args["rate_limiter"] = image_rate_limiter
-        image_generator = image_generator_cls(**image_generator_args)
-
-        video_generator_cls_module, video_generator_cls_name = config["video_generator"]["class_path"].rsplit(".", 1)
-        video_generator_cls = getattr(importlib.import_module(video_generator_cls_module), video_generator_cls_name)
-        video_generator_args = config["video_generator"]["init_args"]
-        video_generator_args["rate_limiter"] = video_rate_limiter
-        video_generator = video_generator_cls(**video_generator_args)
+        chat_model, image_generator, video_generator = build_models_from_config(config)
 
         return cls(
             chat_model=chat_model,
@@ -122,6 +71,13 @@ class Script2VideoPipeline:
             working_dir=config["working_dir"],
         )
 
+    async def close(self):
+        """
+        Close the pooled HTTP connections of the tools. Call it once the pipeline is no longer used.
+        """
+        await close_http_sessions()
+
+    @trace_run()
     async def __call__(
         self,
         script: str,
@@ -130,99 +86,167 @@ class Script2VideoPipeline:
         characters: List[CharacterInScene] = None,
         character_portraits_registry: Optional[Dict[str, Dict[str, Dict[str, str]]]] = None,
     ):
-        if characters is None:
-            characters = await self.extract_characters(script=script)
-
-            # characters_path = os.path.join(self.working_dir, "characters.json")
-            # if os.path.exists(characters_path):
-            #     with open(characters_path, "r", encoding="utf-8") as f:
-            #         characters = [CharacterInScene.model_validate(c) for c in json.load(f)]
-            #     print(f"🚀 Loaded {len(characters)} characters from existing file.")
-            # else:
-            #     print(f"🔍 Extracting characters from script...")
-            #     characters = await self.extract_characters(script=script)
-            #     with open(characters_path, "w", encoding="utf-8") as f:
-            #         json.dump([c.model_dump() for c in characters], f, ensure_ascii=False, indent=4)
-            #     print(f"☑️ Extracted {len(characters)} characters from script and saved to {characters_path}.")
+        graph = TaskGraph()
+
+        async def characters_step():
+            if characters is not None:
+                return characters
+            return await self.extract_characters(script=script)
+
+        async def portraits_step():
+            if character_portraits_registry is not None:
+                return character_portraits_registry
 
-        if character_portraits_registry is None:
             character_portraits_registry_path = os.path.join(self.working_dir, "character_portraits_registry.json")
-            if os.path.exists(character_portraits_registry_path):
+            inputs_hash = inputs_sha256(style, [character.model_dump() for character in graph.results["characters"]])
+            if await self.run_manifest.ais_done(character_portraits_registry_path, stage="portraits", inputs_hash=inputs_hash):
                 with open(character_portraits_registry_path, "r", encoding="utf-8") as f:
-                    character_portraits_registry = json.load(f)
-                print(f"🚀 Loaded {len(character_portraits_registry)} character portraits from existing file.")
+                    registry = json.load(f)
+                print(f"🚀 Loaded {len(registry)} character portraits from existing file.")
             else:
                 print(f"🔍 Generating character portraits...")
-                character_portraits_registry = await self.generate_character_portraits(
-                    characters=characters,
+                registry = await self.generate_character_portraits(
+                    characters=graph.results["characters"],
                     character_portraits_registry=None,
                     style=style,
                 )
 
-                with open(character_portraits_registry_path, "w", encoding="utf-8") as f:
-                    json.dump(character_portraits_registry, f, ensure_ascii=False, indent=4)
-                print(f"☑️ Generated {len(character_portraits_registry)} character portraits and saved to {character_portraits_registry_path}.")
+                await self.run_manifest.awrite_json(character_portraits_registry_path, registry, stage="portraits", inputs_hash=inputs_hash)
+                print(f"☑️ Generated {len(registry)} character portraits and saved to {character_portraits_registry_path}.")
+            return registry
 
         # design shots
-        storyboard = await self.design_storyboard(
-            script=script,
-            characters=characters,
-            user_requirement=user_requirement,
-        )
+        async def storyboard_step():
+            return await self.design_storyboard(
+                script=script,
+                characters=graph.results["characters"],
+                user_requirement=user_requirement,
+            )
 
         # decompose visual descriptions of shots
-        shot_descriptions = await self.decompose_visual_descriptions(
-            shot_brief_descriptions=storyboard,
-            characters=characters,
-        )
-
-        # construct camera tree
-        camera_tree = await self.construct_camera_tree(
-            shot_descriptions=shot_descriptions,
-        )
+        async def shot_descriptions_step():
+            return await self.decompose_visual_descriptions(
+                shot_brief_descriptions=graph.results["storyboard"],
+                characters=graph.results["characters"],
+            )
 
-        priority_shot_idxs = [camera.parent_cam_idx for camera in camera_tree if camera.parent_cam_idx is not None]
-        tasks = [
-            self.generate_frames_for_single_camera(
-                camera=camera,
+        # construct camera tree, then schedule the frame and video nodes that depend on it
+        async def camera_tree_step():
+            shot_descriptions = graph.results["shot_descriptions"]
+            camera_tree = await self.construct_camera_tree(
                 shot_descriptions=shot_descriptions,
-                characters=characters,
-                character_portraits_registry=character_portraits_registry,
-                priority_shot_idxs=priority_shot_idxs,
             )
-            for camera in camera_tree
-        ]
 
-        video_tasks = [
-            self.generate_video_for_single_shot(
-                shot_description=shot_description,
-            )
-            for shot_description in shot_descriptions
-        ]
-        # Run frame generation tasks first (concurrently)
-        print(f"🖼️ Running {len(tasks)} frame generation tasks...")
-        await asyncio.gather(*tasks)
-
-        # Run video generation tasks sequentially to respect strict rate limits (Test 2 RPM)
-        print(f"🎬 Running {len(video_tasks)} video generation tasks sequentially...")
-        for i, video_task in enumerate(video_tasks):
-            print(f"▶️ Starting video task {i+1}/{len(video_tasks)}...")
-            await video_task
-            # Add a small buffer between sequential requests just in case
-            await asyncio.sleep(2)
+            priority_shot_idxs = [camera.parent_cam_idx for camera in camera_tree if camera.parent_cam_idx is not None]
+
+            # The portraits may still be generating, so they are only looked up once the node runs
+            async def frames_step(camera: Camera):
+                try:
+                    return await self.generate_frames_for_single_camera(
+                        camera=camera,
+                        shot_descriptions=shot_descriptions,
+                        characters=graph.results["characters"],
+                        character_portraits_registry=graph.results["portraits"],
+                        priority_shot_idxs=priority_shot_idxs,
+                    )
+                except Exception as e:
+                    # Wake the video nodes and child cameras waiting on these frames, so they fail too
+                    for shot_idx in camera.active_shot_idxs:
+                        self.frame_errors[shot_idx] = e
+                        for event in self.frame_events[shot_idx].values():
+                            event.set()
+                    raise
+
+            for camera in camera_tree:
+                graph.add_node(
+                    f"frames_camera_{camera.idx}",
+                    functools.partial(frames_step, camera),
+                    deps=["portraits"],
+                )
+
+            # A video node starts as soon as the frames of its own shot are ready,
+            # so video generation overlaps with frame generation of later shots.
+            # How many of them run at once is up to the video generator's concurrency limiter.
+            for shot_description in shot_descriptions:
+                graph.add_node(
+                    f"video_shot_{shot_description.idx}",
+                    functools.partial(
+                        self.generate_video_for_single_shot,
+                        shot_description=shot_description,
+                    ),
+                    events=self.frame_events[shot_description.idx].values(),
+                )
+
+            print(f"🖼️ Scheduled {len(camera_tree)} frame generation tasks and {len(shot_descriptions)} video generation tasks.")
+            return camera_tree
+
+        graph.add_node("characters", characters_step)
+        graph.add_node("portraits", portraits_step, deps=["characters"])
+        graph.add_node("storyboard", storyboard_step, deps=["characters"])
+        graph.add_node("shot_descriptions", shot_descriptions_step, deps=["storyboard"])
+        graph.add_node("camera_tree", camera_tree_step, deps=["shot_descriptions"])
+        await graph.run()
+
+        shot_descriptions = graph.results["shot_descriptions"]
 
         final_video_path = os.path.join(self.working_dir, "final_video.mp4")
-        if os.path.exists(final_video_path):
+        video_paths = [
+            os.path.join(self.working_dir, "shots", f"{shot_description.idx}", "video.mp4")
+            for shot_description in shot_descriptions
+        ]
+        # Concatenated again whenever one of the shot videos was regenerated
+        inputs_hash = inputs_sha256([await self.run_manifest.acontent_hash(video_path) for video_path in video_paths])
+        if await self.run_manifest.ais_done(final_video_path, stage="final_video", inputs_hash=inputs_hash):
             print(f"🚀 Skipped concatenating videos, already exists.")
         else:
             print(f"🎬 Starting concatenating videos...")
-            video_clips = [
-                VideoFileClip(os.path.join(self.working_dir, "shots", f"{shot_description.idx}", "video.mp4"))
-                for shot_description in shot_descriptions
-            ]
-            final_video = concatenate_videoclips(video_clips)
-            final_video.write_videofile(final_video_path, codec="libx264", preset="medium")
-            print(f"☑️ Concatenated videos, saved to {final_video_path}.")
+            async with self.run_manifest.awriting(final_video_path, stage="final_video", inputs_hash=inputs_hash) as tmp_path:
+                mode = await asyncio.to_thread(concatenate_videos, video_paths, tmp_path)
+            print(f"☑️ Concatenated videos ({mode}), saved to {final_video_path}.")
+
+        for generator in [self.image_generator, self.video_generator]:
+            # The limiter may be wrapped by a hedging proxy, which forwards the attribute
+            limiter = getattr(generator, "limiter", None)
+            if limiter is not None:
+                stats = limiter.stats()
+                print(f"📈 {limiter.name} concurrency converged to {stats['concurrency']} (peak {stats['peak_in_flight']} in flight, {stats['successes']} succeeded, {stats['throttles']} throttled).")
+
+        for generator in [self.image_generator, self.video_generator]:
+            for backend in getattr(generator, "backends", None) or []:
+                stats = backend.stats()
+                latency = f"{stats['latency']:.1f}s" if stats["latency"] is not None else "unknown"
+                print(f"🧭 Backend {backend.name}: {stats['successes']} of {stats['calls']} calls succeeded, latency {latency}, success rate {stats['success_rate']:.0%}" + ("" if stats["available"] else ", unavailable") + ".")
+
+        hedger = getattr(self.image_generator, "hedger", None)
+        if hedger is not None:
+            stats = hedger.stats()
+            print(f"⏱️ {hedger.name} hedging: {stats['hedges']} of {stats['calls']} calls hedged, {stats['hedge_wins']} won by the hedged request, {stats['primary_wins']} by the original one, {stats['budget_denied']} not hedged for lack of budget.")
+
+        artifact_cache = getattr(self.video_generator, "artifact_cache", None) or getattr(self.image_generator, "artifact_cache", None)
+        if artifact_cache is not None:
+            stats = artifact_cache.stats()
+            print(f"🗃️ Artifact cache: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes_saved'] / 1024 ** 2:.1f} MB of generation reused.")
+
+        llm_response_cache = get_llm_response_cache()
+        if llm_response_cache is not None:
+            stats = llm_response_cache.stats()
+            print(f"🗃️ LLM response cache: {stats['hits']} hits, {stats['misses']} misses, {stats['seconds_saved']:.1f}s of LLM latency saved.")
+
+        stats = prepared_image_cache.stats()
+        if stats["original_bytes"]:
+            print(f"🖼️ Reference images: uploaded {stats['prepared_bytes'] / 1024 ** 2:.1f} MB instead of {stats['original_bytes'] / 1024 ** 2:.1f} MB ({stats['saved_bytes'] / stats['original_bytes']:.0%} saved, {stats['hits']} encodes reused).")
+
+        file_uploads = getattr(self.image_generator, "file_uploads", None)
+        if file_uploads is not None:
+            stats = file_uploads.stats()
+            print(f"📤 Reference image uploads: {stats['uploads']} uploaded, {stats['hits']} reused by URI ({stats['bytes_skipped'] / 1024 ** 2:.1f} MB not resent), {stats['expired'] + stats['invalidated']} re-uploaded.")
+
+        stats = http_stats()
+        if stats["requests"]:
+            print(f"🔌 HTTP: {stats['requests']} requests over {stats['connections_created']} new connections, {stats['connections_reused']} reused ({stats['reuse_ratio']:.0%}).")
+
+        stats = self.run_manifest.stats()
+        print(f"🗂️ Run manifest: {stats['written']} artifacts written, {stats['reused'] + stats['adopted']} reused ({stats['adopted']} adopted from earlier runs), {stats['stale']} redone because their inputs changed.")
 
         return final_video_path
 
@@ -238,47 +262,71 @@ class Script2VideoPipeline:
         first_shot_idx = camera.active_shot_idxs[0]
         first_shot_ff_path = os.path.join(self.working_dir, "shots", f"{first_shot_idx}", "first_frame.png")
 
-        if os.path.exists(first_shot_ff_path):
+        available_image_path_and_text_pairs = []
+        for character_idx in shot_descriptions[first_shot_idx].ff_vis_char_idxs:
+            identifier_in_scene = characters[character_idx].identifier_in_scene
+            registry_item = character_portraits_registry[identifier_in_scene]
+            for view, item in registry_item.items():
+                available_image_path_and_text_pairs.append((item["path"], item["description"]))
+
+        # The first frame is made from the portraits and, for a child camera, from the first frame of its parent,
+        # so their content hashes are part of its inputs and a regenerated portrait or parent frame makes it stale
+        ff_inputs = [
+            shot_descriptions[first_shot_idx].ff_desc,
+            available_image_path_and_text_pairs,
+            await self.reference_image_hashes(available_image_path_and_text_pairs),
+        ]
+        if camera.parent_shot_idx is not None:
+            parent_shot_idx = camera.parent_shot_idx
+            await self.wait_for_frame(parent_shot_idx, "first_frame")
+            parent_shot_ff_path = os.path.join(self.working_dir, "shots", f"{parent_shot_idx}", "first_frame.png")
+            ff_inputs += [
+                shot_descriptions[parent_shot_idx].visual_desc,
+                shot_descriptions[first_shot_idx].visual_desc,
+                camera.missing_info,
+                await self.run_manifest.acontent_hash(parent_shot_ff_path),
+            ]
+        ff_inputs_hash = inputs_sha256(*ff_inputs)
+
+        if await self.run_manifest.ais_done(first_shot_ff_path, stage="frame", inputs_hash=ff_inputs_hash):
             print(f"🚀 Skipped generating first_frame for shot {first_shot_idx}, already exists.")
             self.frame_events[first_shot_idx]["first_frame"].set()
 
         else:
             print(f"🖼️ Starting first_frame generation for shot {first_shot_idx}...")
-            available_image_path_and_text_pairs = []
-
-            for character_idx in shot_descriptions[first_shot_idx].ff_vis_char_idxs:
-                identifier_in_scene = characters[character_idx].identifier_in_scene
-                registry_item = character_portraits_registry[identifier_in_scene]
-                for view, item in registry_item.items():
-                    available_image_path_and_text_pairs.append((item["path"], item["description"]))
 
             # generate the first_frame based on the shot_description.ff_desc
             if camera.parent_shot_idx is not None:
                 # generate the first_frame based on the transition video
-                parent_shot_idx = camera.parent_shot_idx
-                await self.frame_events[parent_shot_idx]["first_frame"].wait()
-                parent_shot_ff_path = os.path.join(self.working_dir, "shots", f"{parent_shot_idx}", "first_frame.png")
                 transition_video_path = os.path.join(self.working_dir, "shots", f"{first_shot_idx}", f"transition_video_from_shot_{parent_shot_idx}.mp4")
 
-                if os.path.exists(transition_video_path):
+                transition_inputs_hash = inputs_sha256(
+                    shot_descriptions[parent_shot_idx].visual_desc,
+                    shot_descriptions[first_shot_idx].visual_desc,
+                    await self.run_manifest.acontent_hash(parent_shot_ff_path),
+                )
+                if await self.run_manifest.ais_done(transition_video_path, stage="transition_video", inputs_hash=transition_inputs_hash):
                     print(f"🚀 Skipped generating transition video for shot {first_shot_idx} from shot {parent_shot_idx}, already exists.")
                 else:
                     print(f"🖼️ Starting transition video generation for shot {first_shot_idx} from shot {parent_shot_idx}...")
-                    transition_video_output = await self.camera_image_generator.generate_transition_video(
-                        first_shot_visual_desc=shot_descriptions[parent_shot_idx].visual_desc,
-                        second_shot_visual_desc=shot_descriptions[first_shot_idx].visual_desc,
-                        first_shot_ff_path=parent_shot_ff_path,
-                    )
-                    transition_video_output.save(transition_video_path)
+                    async with self.run_manifest.awriting(transition_video_path, stage="transition_video", inputs_hash=transition_inputs_hash) as tmp_path:
+                        transition_video_output = await self.camera_image_generator.generate_transition_video(
+                            first_shot_visual_desc=shot_descriptions[parent_shot_idx].visual_desc,
+                            second_shot_visual_desc=shot_descriptions[first_shot_idx].visual_desc,
+                            first_shot_ff_path=parent_shot_ff_path,
+                        )
+                        await transition_video_output.asave(tmp_path)
                     print(f"☑️ Generated transition video for shot {first_shot_idx} from shot {parent_shot_idx}, saved to {transition_video_path}.")
 
                 new_camera_image_path = os.path.join(self.working_dir, "shots", f"{first_shot_idx}", f"new_camera_{camera.idx}.png")
-                if os.path.exists(new_camera_image_path):
+                new_camera_inputs_hash = inputs_sha256(await self.run_manifest.acontent_hash(transition_video_path))
+                if await self.run_manifest.ais_done(new_camera_image_path, stage="new_camera_image", inputs_hash=new_camera_inputs_hash):
                     print(f"🚀 Skipped generating new camera image for shot {first_shot_idx}, already exists.")
                 else:
                     print(f"🖼️ Starting new camera image generation for shot {first_shot_idx}...")
-                    new_camera_image = self.camera_image_generator.get_new_camera_image(transition_video_path)
-                    new_camera_image.save(new_camera_image_path)
+                    async with self.run_manifest.awriting(new_camera_image_path, stage="new_camera_image", inputs_hash=new_camera_inputs_hash) as tmp_path:
+                        new_camera_image = self.camera_image_generator.get_new_camera_image(transition_video_path)
+                        await new_camera_image.asave(tmp_path)
                     print(f"☑️ Generated new camera image for shot {first_shot_idx} (not completed), saved to {new_camera_image_path}.")
 
                     available_image_path_and_text_pairs.append(
@@ -291,7 +339,12 @@ class Script2VideoPipeline:
             # 如果子镜头缺少信息，则需要选择参考图像生成
             if camera.parent_shot_idx is None or camera.missing_info is not None:
                 ff_selector_output_path = os.path.join(self.working_dir, "shots", f"{first_shot_idx}", "first_frame_selector_output.json")
-                if os.path.exists(ff_selector_output_path):
+                ff_selector_inputs_hash = inputs_sha256(
+                    available_image_path_and_text_pairs,
+                    await self.reference_image_hashes(available_image_path_and_text_pairs),
+                    shot_descriptions[first_shot_idx].ff_desc,
+                )
+                if await self.run_manifest.ais_done(ff_selector_output_path, stage="reference_selection", inputs_hash=ff_selector_inputs_hash):
                     with open(ff_selector_output_path, 'r', encoding='utf-8') as f:
                         ff_selector_output = json.load(f)
                     print(f"🚀 Loaded existing reference image selection and prompt for first_frame of shot {first_shot_idx} from {ff_selector_output_path}.")
@@ -301,8 +354,7 @@ class Script2VideoPipeline:
                         available_image_path_and_text_pairs=available_image_path_and_text_pairs,
                         frame_description=shot_descriptions[first_shot_idx].ff_desc
                     )
-                    with open(ff_selector_output_path, 'w', encoding='utf-8') as f:
-                        json.dump(ff_selector_output, f, ensure_ascii=False, indent=4)
+                    await self.run_manifest.awrite_json(ff_selector_output_path, ff_selector_output, stage="reference_selection", inputs_hash=ff_selector_inputs_hash)
 
                     print(f"☑️ Selected reference images and generated prompt for first_frame of shot {first_shot_idx}, saved to {ff_selector_output_path}.")
 
@@ -312,16 +364,18 @@ class Script2VideoPipeline:
                     prefix_prompt += f"Image {i}: {text}\n"
                 prompt = f"{prefix_prompt}\n{prompt}"
                 reference_image_paths = [item[0] for item in reference_image_path_and_text_pairs]
-                ff_image: ImageOutput = await self.image_generator.generate_single_image(
-                    prompt=prompt,
-                    reference_image_paths=reference_image_paths,
-                    size="1600x900",
-                )
-                ff_image.save(first_shot_ff_path)
+                async with self.run_manifest.awriting(first_shot_ff_path, stage="frame", inputs_hash=ff_inputs_hash) as tmp_path:
+                    ff_image: ImageOutput = await self.image_generator.generate_single_image(
+                        prompt=prompt,
+                        reference_image_paths=reference_image_paths,
+                        size="1600x900",
+                    )
+                    await ff_image.asave(tmp_path)
                 self.frame_events[first_shot_idx]["first_frame"].set()
                 print(f"☑️ Generated first_frame for shot {first_shot_idx}, saved to {first_shot_ff_path}.")
             else:
-                shutil.copy(new_camera_image_path, first_shot_ff_path)
+                async with self.run_manifest.awriting(first_shot_ff_path, stage="frame", inputs_hash=ff_inputs_hash) as tmp_path:
+                    shutil.copy(new_camera_image_path, tmp_path)
                 self.frame_events[first_shot_idx]["first_frame"].set()
                 print(f"☑️ Generated first_frame for shot {first_shot_idx}, saved to {first_shot_ff_path}.")
 
@@ -368,29 +422,58 @@ class Script2VideoPipeline:
         await asyncio.gather(*priority_tasks)
         await asyncio.gather(*normal_tasks)
 
+    async def reference_image_hashes(
+        self,
+        image_path_and_text_pairs: List[Tuple[str, str]],
+    ) -> List[Optional[str]]:
+        """
+        Get the content hashes of candidate reference images, to make them part of the inputs hash of a frame.
+        """
+        return list(await asyncio.gather(*[self.run_manifest.acontent_hash(path) for path, _ in image_path_and_text_pairs]))
+
+    async def wait_for_frame(
+        self,
+        shot_idx: int,
+        frame_type: str,
+    ) -> None:
+        """
+        Wait until a frame of a shot is ready.
+
+        Raises:
+            RuntimeError: If the frame node that makes the frame failed.
+        """
+        await self.frame_events[shot_idx][frame_type].wait()
+        if shot_idx in self.frame_errors:
+            raise RuntimeError(f"The {frame_type} of shot {shot_idx} was not generated.") from self.frame_errors[shot_idx]
+
     async def generate_video_for_single_shot(
         self,
         shot_description: ShotDescription,
     ):
         video_path = os.path.join(self.working_dir, "shots", f"{shot_description.idx}", "video.mp4")
-        if os.path.exists(video_path):
-            print(f"🚀 Skipped generating video for shot {shot_description.idx}, already exists.")
-        else:
-            await self.frame_events[shot_description.idx]["first_frame"].wait()
-            if shot_description.variation_type in ["medium", "large"]:
-                await self.frame_events[shot_description.idx]["last_frame"].wait()
 
-            frame_paths = []
-            frame_paths.append(os.path.join(self.working_dir, "shots", f"{shot_description.idx}", "first_frame.png"))
-            if shot_description.variation_type in ["medium", "large"]:
-                frame_paths.append(os.path.join(self.working_dir, "shots", f"{shot_description.idx}", "last_frame.png"))
+        # The frames are part of the inputs, so the video is only checked once they are ready
+        await self.wait_for_frame(shot_description.idx, "first_frame")
+        if shot_description.variation_type in ["medium", "large"]:
+            await self.wait_for_frame(shot_description.idx, "last_frame")
+
+        frame_paths = []
+        frame_paths.append(os.path.join(self.working_dir, "shots", f"{shot_description.idx}", "first_frame.png"))
+        if shot_description.variation_type in ["medium", "large"]:
+            frame_paths.append(os.path.join(self.working_dir, "shots", f"{shot_description.idx}", "last_frame.png"))
 
+        prompt = shot_description.motion_desc + "\n" + shot_description.audio_desc
+        inputs_hash = inputs_sha256(prompt, [await self.run_manifest.acontent_hash(frame_path) for frame_path in frame_paths])
+        if await self.run_manifest.ais_done(video_path, stage="video", inputs_hash=inputs_hash):
+            print(f"🚀 Skipped generating video for shot {shot_description.idx}, already exists.")
+        else:
             print(f"🎬 Starting video generation for shot {shot_description.idx}...")
-            video_output = await self.video_generator.generate_single_video(
-                prompt=shot_description.motion_desc + "\n" + shot_description.audio_desc,
-                reference_image_paths=frame_paths,
-            )
-            video_output.save(video_path)
+            async with self.run_manifest.awriting(video_path, stage="video", inputs_hash=inputs_hash) as tmp_path:
+                video_output = await self.video_generator.generate_single_video(
+                    prompt=prompt,
+                    reference_image_paths=frame_paths,
+                )
+                await video_output.asave(tmp_path)
             print(f"☑️ Generated video for shot {shot_description.idx}, saved to {video_path}.")
 
     async def generate_frame_for_single_shot(
@@ -405,22 +488,35 @@ class Script2VideoPipeline:
 
         frame_image_path = os.path.join(self.working_dir, "shots", f"{shot_idx}", f"{frame_type}.png")
 
-        if os.path.exists(frame_image_path):
+        available_image_path_and_text_pairs = []
+        for visible_character in visible_characters:
+            identifier_in_scene = visible_character.identifier_in_scene
+            registry_item = character_portraits_registry[identifier_in_scene]
+            for view, item in registry_item.items():
+                available_image_path_and_text_pairs.append((item["path"], item["description"]))
+
+        available_image_path_and_text_pairs.append(first_shot_ff_path_and_text_pair)
+
+        # The reference images are chosen from these candidates, so a frame is stale once any of them changed
+        frame_inputs_hash = inputs_sha256(
+            frame_desc,
+            available_image_path_and_text_pairs,
+            await self.reference_image_hashes(available_image_path_and_text_pairs),
+        )
+
+        if await self.run_manifest.ais_done(frame_image_path, stage="frame", inputs_hash=frame_inputs_hash):
             print(f"🚀 Skipped generating {frame_type} for shot {shot_idx}, already exists.")
 
         else:
             print(f"🖼️ Starting {frame_type} generation for shot {shot_idx}...")
-            available_image_path_and_text_pairs = []
-            for visible_character in visible_characters:
-                identifier_in_scene = visible_character.identifier_in_scene
-                registry_item = character_portraits_registry[identifier_in_scene]
-                for view, item in registry_item.items():
-                    available_image_path_and_text_pairs.append((item["path"], item["description"]))
-
-            available_image_path_and_text_pairs.append(first_shot_ff_path_and_text_pair)
 
             selector_output_path = os.path.join(self.working_dir, "shots", f"{shot_idx}", f"{frame_type}_selector_output.json")
-            if os.path.exists(selector_output_path):
+            selector_inputs_hash = inputs_sha256(
+                available_image_path_and_text_pairs,
+                await self.reference_image_hashes(available_image_path_and_text_pairs),
+                frame_desc,
+            )
+            if await self.run_manifest.ais_done(selector_output_path, stage="reference_selection", inputs_hash=selector_inputs_hash):
                 with open(selector_output_path, 'r', encoding='utf-8') as f:
                     selector_output = json.load(f)
                 print(f"🚀 Loaded existing reference image selection and prompt for {frame_type} frame of shot {shot_idx} from {selector_output_path}.")
@@ -430,8 +526,7 @@ class Script2VideoPipeline:
                     available_image_path_and_text_pairs=available_image_path_and_text_pairs,
                     frame_description=frame_desc
                 )
-                with open(selector_output_path, 'w', encoding='utf-8') as f:
-                    json.dump(selector_output, f, ensure_ascii=False, indent=4)
+                await self.run_manifest.awrite_json(selector_output_path, selector_output, stage="reference_selection", inputs_hash=selector_inputs_hash)
                 print(f"☑️ Selected reference images and generated prompt for {frame_type} frame of shot {shot_idx}, saved to {selector_output_path}.")
 
             reference_image_path_and_text_pairs, prompt = selector_output["reference_image_path_and_text_pairs"], selector_output["text_prompt"]
@@ -441,12 +536,13 @@ class Script2VideoPipeline:
             prompt = f"{prefix_prompt}\n{prompt}"
             reference_image_paths = [item[0] for item in reference_image_path_and_text_pairs]
 
-            frame_image: ImageOutput = await self.image_generator.generate_single_image(
-                prompt=prompt,
-                reference_image_paths=reference_image_paths,
-                size="1600x900",
-            )
-            frame_image.save(frame_image_path)
+            async with self.run_manifest.awriting(frame_image_path, stage="frame", inputs_hash=frame_inputs_hash) as tmp_path:
+                frame_image: ImageOutput = await self.image_generator.generate_single_image(
+                    prompt=prompt,
+                    reference_image_paths=reference_image_paths,
+                    size="1600x900",
+                )
+                await frame_image.asave(tmp_path)
             print(f"☑️ Generated {frame_type} frame for shot {shot_idx}, saved to {frame_image_path}.")
 
         self.frame_events[shot_idx][frame_type].set()
@@ -457,8 +553,9 @@ class Script2VideoPipeline:
         shot_descriptions: List[ShotDescription],
     ):
         camera_tree_path = os.path.join(self.working_dir, "camera_tree.json")
+        inputs_hash = inputs_sha256([shot_description.model_dump() for shot_description in shot_descriptions])
 
-        if os.path.exists(camera_tree_path):
+        if await self.run_manifest.ais_done(camera_tree_path, stage="camera_tree", inputs_hash=inputs_hash):
             with open(camera_tree_path, "r", encoding="utf-8") as f:
                 camera_tree = json.load(f)
             camera_tree = [Camera.model_validate(camera) for camera in camera_tree]
@@ -473,8 +570,7 @@ class Script2VideoPipeline:
                 cameras[shot_description.cam_idx].active_shot_idxs.append(shot_description.idx)
 
         camera_tree = await self.camera_image_generator.construct_camera_tree(cameras=cameras, shot_descs=shot_descriptions)
-        with open(camera_tree_path, "w", encoding="utf-8") as f:
-            json.dump([camera.model_dump() for camera in camera_tree], f, ensure_ascii=False, indent=4)
+        await self.run_manifest.awrite_json(camera_tree_path, [camera.model_dump() for camera in camera_tree], stage="camera_tree", inputs_hash=inputs_hash)
         print(f"✅ Constructed camera tree and saved to {camera_tree_path}.")
         return camera_tree
 
@@ -483,16 +579,16 @@ class Script2VideoPipeline:
         script: str,
     ):
         save_path = os.path.join(self.working_dir, "characters.json")
+        inputs_hash = inputs_sha256(script)
 
-        if os.path.exists(save_path):
+        if await self.run_manifest.ais_done(save_path, stage="characters", inputs_hash=inputs_hash):
             with open(save_path, "r", encoding="utf-8") as f:
                 characters = json.load(f)
             characters = [CharacterInScene.model_validate(character) for character in characters]
             print(f"🚀 Loaded {len(characters)} characters from existing file.")
         else:
             characters = await self.character_extractor.extract_characters(script)
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump([character.model_dump() for character in characters], f, ensure_ascii=False, indent=4)
+            await self.run_manifest.awrite_json(save_path, [character.model_dump() for character in characters], stage="characters", inputs_hash=inputs_hash)
             print(f"✅ Extracted {len(characters)} characters from script and saved to {save_path}.")
 
         for character in characters:
@@ -506,13 +602,10 @@ class Script2VideoPipeline:
         character_portraits_registry: Optional[Dict[str, Dict[str, Dict[str, str]]]],
         style: str,
     ):
-        character_portraits_registry_path = os.path.join(self.working_dir, "character_portraits_registry.json")
+        # The portraits of an interrupted run are found in the run manifest, so the registry
+        # is only written once it is complete
         if character_portraits_registry is None:
-            if os.path.exists(character_portraits_registry_path):
-                with open(character_portraits_registry_path, 'r', encoding='utf-8') as f:
-                    character_portraits_registry = json.load(f)
-            else:
-                character_portraits_registry = {}
+            character_portraits_registry = {}
 
         tasks = [
             self.generate_portraits_for_single_character(character, style)
@@ -522,8 +615,6 @@ class Script2VideoPipeline:
         if tasks:
             for future in asyncio.as_completed(tasks):
                 character_portraits_registry.update(await future)
-                with open(character_portraits_registry_path, 'w', encoding='utf-8') as f:
-                    json.dump(character_portraits_registry, f, ensure_ascii=False, indent=4)
 
             print(f"✅ Completed character portrait generation for {len(characters)} characters.")
         else:
@@ -539,25 +630,32 @@ class Script2VideoPipeline:
         os.makedirs(character_dir, exist_ok=True)
 
         front_portrait_path = os.path.join(character_dir, "front.png")
-        if os.path.exists(front_portrait_path):
+        inputs_hash = inputs_sha256(character.model_dump(), style)
+        if await self.run_manifest.ais_done(front_portrait_path, stage="portrait", inputs_hash=inputs_hash):
             pass
         else:
-            front_portrait_output = await self.character_portraits_generator.generate_front_portrait(character, style)
-            front_portrait_output.save(front_portrait_path)
+            async with self.run_manifest.awriting(front_portrait_path, stage="portrait", inputs_hash=inputs_hash) as tmp_path:
+                front_portrait_output = await self.character_portraits_generator.generate_front_portrait(character, style)
+                await front_portrait_output.asave(tmp_path)
+
+        # The side and back views are drawn from the front view, so they are redone when it changes
+        inputs_hash = inputs_sha256(character.model_dump(), await self.run_manifest.acontent_hash(front_portrait_path))
 
         side_portrait_path = os.path.join(character_dir, "side.png")
-        if os.path.exists(side_portrait_path):
+        if await self.run_manifest.ais_done(side_portrait_path, stage="portrait", inputs_hash=inputs_hash):
             pass
         else:
-            side_portrait_output = await self.character_portraits_generator.generate_side_portrait(character, front_portrait_path)
-            side_portrait_output.save(side_portrait_path)
+            async with self.run_manifest.awriting(side_portrait_path, stage="portrait", inputs_hash=inputs_hash) as tmp_path:
+                side_portrait_output = await self.character_portraits_generator.generate_side_portrait(character, front_portrait_path)
+                await side_portrait_output.asave(tmp_path)
 
         back_portrait_path = os.path.join(character_dir, "back.png")
-        if os.path.exists(back_portrait_path):
+        if await self.run_manifest.ais_done(back_portrait_path, stage="portrait", inputs_hash=inputs_hash):
             pass
         else:
-            back_portrait_output = await self.character_portraits_generator.generate_back_portrait(character, front_portrait_path)
-            back_portrait_output.save(back_portrait_path)
+            async with self.run_manifest.awriting(back_portrait_path, stage="portrait", inputs_hash=inputs_hash) as tmp_path:
+                back_portrait_output = await self.character_portraits_generator.generate_back_portrait(character, front_portrait_path)
+                await back_portrait_output.asave(tmp_path)
 
         self.character_portrait_events[character.idx].set()
 
@@ -587,7 +685,8 @@ class Script2VideoPipeline:
         user_requirement: str,
     ):
         storyboard_path = os.path.join(self.working_dir, "storyboard.json")
-        if os.path.exists(storyboard_path):
+        inputs_hash = inputs_sha256(script, user_requirement, [character.model_dump() for character in characters])
+        if await self.run_manifest.ais_done(storyboard_path, stage="storyboard", inputs_hash=inputs_hash):
             with open(storyboard_path, 'r', encoding='utf-8') as f:
                 storyboard = json.load(f)
             storyboard = [ShotBriefDescription.model_validate(shot) for shot in storyboard]
@@ -600,8 +699,7 @@ class Script2VideoPipeline:
                 user_requirement=user_requirement,
                 retry_timeout=150,
             )
-            with open(storyboard_path, 'w', encoding='utf-8') as f:
-                json.dump([shot.model_dump() for shot in storyboard], f, ensure_ascii=False, indent=4)
+            await self.run_manifest.awrite_json(storyboard_path, [shot.model_dump() for shot in storyboard], stage="storyboard", inputs_hash=inputs_hash)
             print(f"✅ Designed storyboard and saved to {storyboard_path}.")
 
         for shot_brief_description in storyboard:
@@ -629,8 +727,9 @@ class Script2VideoPipeline:
     ):
         shot_description_path = os.path.join(self.working_dir, "shots", f"{shot_brief_description.idx}", "shot_description.json")
         os.makedirs(os.path.dirname(shot_description_path), exist_ok=True)
+        inputs_hash = inputs_sha256(shot_brief_description.model_dump(), [character.model_dump() for character in characters])
 
-        if os.path.exists(shot_description_path):
+        if await self.run_manifest.ais_done(shot_description_path, stage="shot_description", inputs_hash=inputs_hash):
             with open(shot_description_path, 'r', encoding='utf-8') as f:
                 shot_description = ShotDescription.model_validate(json.load(f))
             print(f"🚀 Loaded shot {shot_brief_description.idx} description from existing file.")
@@ -640,8 +739,7 @@ class Script2VideoPipeline:
                 characters=characters,
                 retry_timeout=120,
             )
-            with open(shot_description_path, 'w', encoding='utf-8') as f:
-                json.dump(shot_description.model_dump(), f, ensure_ascii=False, indent=4)
+            await self.run_manifest.awrite_json(shot_description_path, shot_description.model_dump(), stage="shot_description", inputs_hash=inputs_hash)
             print(f"✅ Decomposed visual description for shot {shot_brief_description.idx} and saved to {shot_description_path}.")
 
         self.shot_desc_events[shot_brief_description.idx].set()
@@ -1,12 +1,14 @@
 # https://yunwu.apifox.cn/api-347960869
 
 import logging
-import aiohttp
+from utils.http import get_http_session
 from typing import List, Optional
 from tenacity import retry, stop_after_attempt
 from utils.retry import after_func
-from utils.image import image_path_to_b64
+from utils.image import prepare_image_b64
 from interfaces.image_output import ImageOutput
+from utils.artifact_cache import ArtifactCache, artifact_cached
+from utils.tracing import traced
 
 
 class ImageGeneratorDoubaoSeedreamYunwuAPI:
@@ -14,13 +16,17 @@ class ImageGeneratorDoubaoSeedreamYunwuAPI:
         self,
         api_key: str,
         model: str = "doubao-seedream-4-0-250828",
-
+        artifact_cache: Optional[ArtifactCache] = None,
+        base_url: str = "https://yunwu.ai",
     ):
         self.api_key = api_key
-        self.base_url = "https://yunwu.ai/v1/images/generations"
+        self.base_url = base_url
         self.model = model
+        self.artifact_cache = artifact_cache
 
 
+    @traced("tool")
+    @artifact_cached(ImageOutput)
     @retry(stop=stop_after_attempt(3), after=after_func)
     async def generate_single_image(
         self,
@@ -36,7 +42,7 @@ class ImageGeneratorDoubaoSeedreamYunwuAPI:
         logging.info(f"Calling {self.model} to generate image...")
 
         image = [
-            image_path_to_b64(path, mime=True) for path in reference_image_paths
+            prepare_image_b64(path, max_side=2048, quality=95) for path in reference_image_paths
         ]
 
         payload = {
@@ -58,9 +64,9 @@ class ImageGeneratorDoubaoSeedreamYunwuAPI:
         }
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, json=payload, headers=headers) as response:
-                    response_json = await response.json()
+            session = get_http_session()
+            async with session.post(f"{self.base_url}/v1/images/generations", json=payload, headers=headers) as response:
+                response_json = await response.json()
         except Exception as e:
             logging.error(f"Error occurred while generating image: {e}")
             raise e
@@ -11,6 +11,10 @@ from tenacity import retry, stop_after_attempt
 from interfaces.image_output import ImageOutput
 from utils.retry import after_func
 from utils.rate_limiter import RateLimiter
+from utils.artifact_cache import ArtifactCache, artifact_cached
+from utils.file_uploads import FileUploadRegistry, UploadedFile
+from utils.tracing import traced
+from utils.adaptive_concurrency import report_throttling
 
 
 class ImageGeneratorNanobananaGoogleAPI:
@@ -18,13 +22,30 @@ class ImageGeneratorNanobananaGoogleAPI:
         self,
         api_key: str,
         rate_limiter: Optional[RateLimiter] = None,
+        artifact_cache: Optional[ArtifactCache] = None,
+        upload_reference_images: bool = True,
     ):
         self.model = "gemini-2.5-flash-image"
         self.rate_limiter = rate_limiter
+        self.artifact_cache = artifact_cache
         self.client = genai.Client(
             api_key=api_key,
         )
+        # Reference images go to the Files API once and are referenced by URI afterwards
+        self.file_uploads = FileUploadRegistry(upload=self._upload_reference_image) if upload_reference_images else None
 
+    async def _upload_reference_image(self, path: str) -> UploadedFile:
+        file = await self.client.aio.files.upload(file=path)
+        expire_time = file.expiration_time.timestamp() if file.expiration_time else None
+        return UploadedFile(handle=file, expire_time=expire_time)
+
+    async def _load_reference_images(self, reference_image_paths: List[str]) -> list:
+        if self.file_uploads is None:
+            return [Image.open(path) for path in reference_image_paths]
+        return await self.file_uploads.get_all(reference_image_paths)
+
+    @traced("tool")
+    @artifact_cached(ImageOutput)
     @retry(stop=stop_after_attempt(3), after=after_func)
     async def generate_single_image(
         self,
@@ -43,7 +64,7 @@ class ImageGeneratorNanobananaGoogleAPI:
         if self.rate_limiter:
             await self.rate_limiter.acquire()
 
-        reference_images = [Image.open(path) for path in reference_image_paths]
+        reference_images = await self._load_reference_images(reference_image_paths)
 
         # Retry logic for rate limit errors
         max_retries = 3
@@ -63,7 +84,13 @@ class ImageGeneratorNanobananaGoogleAPI:
                 )
                 break
             except ClientError as e:
-                if e.code == 429 and attempt < max_retries - 1:
+                if e.code in (403, 404) and self.file_uploads is not None and reference_image_paths and attempt < max_retries - 1:
+                    # An uploaded reference image was deleted before its expiry, upload it again
+                    logging.warning(f"Uploaded reference image is no longer available ({e.code}), uploading again... (attempt {attempt + 1}/{max_retries})")
+                    await self.file_uploads.invalidate(reference_image_paths)
+                    reference_images = await self._load_reference_images(reference_image_paths)
+                elif e.code == 429 and attempt < max_retries - 1:
+                    report_throttling(e)
                     wait_time = retry_delay * (2 ** attempt)
                     logging.warning(f"Rate limit hit (429), retrying in {wait_time}s... (attempt {attempt + 1}/{max_retries})")
                     await asyncio.sleep(wait_time)
@@ -8,6 +8,8 @@ from google.genai import types
 from tenacity import retry, stop_after_attempt
 from interfaces.image_output import ImageOutput
 from utils.retry import after_func
+from utils.artifact_cache import ArtifactCache, artifact_cached
+from utils.tracing import traced
 
 
 class ImageGeneratorNanobananaYunwuAPI:
@@ -15,17 +17,22 @@ class ImageGeneratorNanobananaYunwuAPI:
         self,
         api_key: str,
         model: str = "gemini-2.5-flash-image-preview",
+        artifact_cache: Optional[ArtifactCache] = None,
+        base_url: str = "https://yunwu.ai",
     ):
         self.client = genai.Client(
             api_key=api_key,
             http_options=types.HttpOptions(
-                base_url="https://yunwu.ai",
+                base_url=base_url,
                 api_version="v1beta",
             ),
         )
         self.model = model
+        self.artifact_cache = artifact_cache
 
 
+    @traced("tool")
+    @artifact_cached(ImageOutput)
     @retry(stop=stop_after_attempt(3), after=after_func)
     async def generate_single_image(
         self,
@@ -1,65 +1,244 @@
-import requests
-from typing import List
-import aiohttp
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+from utils.http import get_http_session
 import asyncio
 from tenacity import retry, stop_after_attempt
 import logging
+from utils.rerank_cache import RerankScoreCache, text_sha256
+from utils.tracing import traced
 
 
 class RerankerBgeSiliconapi:
+    """
+    Reranker on the SiliconFlow rerank API.
+
+    Every (query, document) score is remembered, in a bounded in-memory LRU and
+    optionally in a persistent RerankScoreCache, so only documents that were never scored against
+    the query are sent. They are packed into requests of at most
+    max_documents_per_request documents and max_request_chars characters, sent
+    concurrently, and a pair that is already in flight for another caller is
+    awaited instead of being sent twice.
+    """
+
     def __init__(
         self,
         api_key: str,
         base_url: str,
         model: str = "BAAI/bge-reranker-v2-m3",
+        score_cache: Optional[Union[RerankScoreCache, str]] = None,
+        max_documents_per_request: int = 64,
+        max_request_chars: int = 100000,
+        max_concurrent_requests: int = 8,
+        max_memory_scores: int = 100000,
     ):
+        """
+        Initialize the reranker.
+
+        Args:
+            api_key: SiliconFlow API key.
+            base_url: Base URL of the API, e.g. https://api.siliconflow.cn/v1.
+            model: Reranker model.
+            score_cache: Persistent cache of the scores, or the path of its database, so that it can be
+                         set in init_args. If None, scores are only remembered in memory.
+            max_documents_per_request: Maximum number of documents sent in one request.
+            max_request_chars: Maximum number of characters of the query and the documents of one request.
+                               A single longer document is still sent, alone.
+            max_concurrent_requests: Maximum number of requests in flight at the same time.
+            max_memory_scores: Maximum number of scores remembered in memory; the least recently used are
+                               forgotten first, and are still found in the persistent cache if there is one.
+        """
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
-        # return_documents: bool = True,
+        self.score_cache = RerankScoreCache(os.path.expanduser(score_cache)) if isinstance(score_cache, str) else score_cache
+        self.max_documents_per_request = max_documents_per_request
+        self.max_request_chars = max_request_chars
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_memory_scores = max_memory_scores
+
+        self.scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.num_requests = 0
+        self.num_documents_requested = 0
+        self.num_documents_sent = 0
+        self.num_memory_hits = 0
+        self.num_cache_hits = 0
+        self.num_in_flight_merged = 0
+
+
+    @traced("tool")
+    async def __call__(
+        self,
+        documents: List[str],
+        query: str,
+        top_n: int,
+    ) -> List[Tuple[str, float]]:
+        """
+        Rerank the documents by relevance to the query.
+
+        Returns:
+            The top_n (document, relevance score) pairs, most relevant first.
+        """
+        scores = await self.score(documents, query)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_n]
+
+
+    async def score(
+        self,
+        documents: List[str],
+        query: str,
+    ) -> Dict[str, float]:
+        """
+        Get the relevance score of every document for the query.
+
+        Returns:
+            The scores keyed by document; repeated documents appear once.
+        """
+        query_hash = text_sha256(query)
+        document_hashes = {document: text_sha256(document) for document in documents}
+        self.num_documents_requested += len(document_hashes)
+
+        scores, waiting, missing = {}, {}, {}
+        for document, document_hash in document_hashes.items():
+            key = (query_hash, document_hash)
+            if key in self.scores:
+                self.scores.move_to_end(key)
+                scores[document] = self.scores[key]
+                self.num_memory_hits += 1
+            elif key in self.in_flight:
+                waiting[document] = self.in_flight[key]
+                self.num_in_flight_merged += 1
+            else:
+                missing[document] = document_hash
+
+        if missing:
+            # Claimed before the first await, so that concurrent callers merge into these pairs
+            loop = asyncio.get_running_loop()
+            futures = {}
+            for document, document_hash in missing.items():
+                futures[document] = self.in_flight[(query_hash, document_hash)] = loop.create_future()
+            try:
+                if self.score_cache is not None:
+                    cached_scores = await asyncio.to_thread(self.score_cache.get_many, self.model, query_hash, list(missing.values()))
+                    for document, document_hash in missing.items():
+                        if document_hash in cached_scores:
+                            scores[document] = cached_scores[document_hash]
+                            self._remember((query_hash, document_hash), cached_scores[document_hash])
+                            futures[document].set_result(cached_scores[document_hash])
+                            self.num_cache_hits += 1
+
+                unscored = [document for document in missing if document not in scores]
+                if unscored:
+                    if self.semaphore_loop is not loop:
+                        self.semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+                        self.semaphore_loop = loop
+
+                    batch_results = await asyncio.gather(*[
+                        self._score_batch(query, batch)
+                        for batch in self._make_batches(query, unscored)
+                    ])
+
+                    new_scores = {}
+                    for batch_scores in batch_results:
+                        for document, score in batch_scores.items():
+                            scores[document] = score
+                            self._remember((query_hash, missing[document]), score)
+                            new_scores[missing[document]] = score
+                            futures[document].set_result(score)
+                    if self.score_cache is not None:
+                        await asyncio.to_thread(self.score_cache.put_many, self.model, query_hash, new_scores)
+            except BaseException as e:
+                for future in futures.values():
+                    if not future.done():
+                        future.set_exception(e)
+                        # Mark it retrieved, callers that merged into it get the error themselves
+                        future.exception()
+                raise
+            finally:
+                for document, document_hash in missing.items():
+                    self.in_flight.pop((query_hash, document_hash), None)
+                    # Never leave a caller that merged into this request waiting
+                    if not futures[document].done():
+                        futures[document].set_exception(RuntimeError("The reranker returned no score for the document"))
+                        futures[document].exception()
+
+        for document, future in waiting.items():
+            scores[document] = await future
+
+        return scores
+
+
+    def _remember(
+        self,
+        key: Tuple[str, str],
+        score: float,
+    ) -> None:
+        self.scores[key] = score
+        self.scores.move_to_end(key)
+        while len(self.scores) > self.max_memory_scores:
+            self.scores.popitem(last=False)
+
+
+    def _make_batches(
+        self,
+        query: str,
+        documents: List[str],
+    ) -> List[List[str]]:
+        batches, batch, batch_chars = [], [], len(query)
+        for document in documents:
+            if batch and (len(batch) >= self.max_documents_per_request or batch_chars + len(document) > self.max_request_chars):
+                batches.append(batch)
+                batch, batch_chars = [], len(query)
+            batch.append(document)
+            batch_chars += len(document)
+        if batch:
+            batches.append(batch)
+        return batches
 
 
     @retry(
         stop=stop_after_attempt(3),
         after=lambda retry_state: logging.warning(f"Retrying SiliconReranker due to error: {retry_state.outcome.exception()}"),
     )
-    async def __call__(
+    async def _score_batch(
         self,
-        documents: List[str],
         query: str,
-        top_n: int,
-    ) -> List[str]:
-        
+        documents: List[str],
+    ) -> Dict[str, float]:
         url = f"{self.base_url}/rerank"
 
+        # Score every document, so that all of them can be cached; the caller picks the top ones
         payload = {
             "model": self.model,
             "query": query,
             "documents": documents,
-            "top_n": top_n,
-            "return_documents": True,
+            "top_n": len(documents),
+            "return_documents": False,
         }
 
-
         headers = {
             'Accept': 'application/json',
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
         }
 
-        async with aiohttp.ClientSession() as session:
+        async with self.semaphore:
+            session = get_http_session()
             async with session.post(url, json=payload, headers=headers) as resp:
                 response = await resp.json()
-
+            self.num_requests += 1
+            self.num_documents_sent += len(documents)
 
         """
         {
             "id": "<string>",
             "results": [
                 {
-                "document": {
-                    "text": "<string>"
-                },
                 "index": 123,
                 "relevance_score": 123
                 }
@@ -68,12 +247,25 @@ class RerankerBgeSiliconapi:
                 "input_tokens": 123,
                 "output_tokens": 123
             }
-        } 
+        }
         """
 
-        results = []
+        scores = {
+            documents[result["index"]]: result["relevance_score"]
+            for result in response["results"]
+        }
+        if len(scores) < len(documents):
+            # Retried like any other failed request
+            raise ValueError(f"The rerank response scored {len(scores)} of {len(documents)} documents")
+        return scores
 
-        for result in response["results"]:
-            results.append((result["document"]["text"], result["relevance_score"]))
 
-        return results
\ No newline at end of file
+    def stats(self) -> dict:
+        return {
+            "requests": self.num_requests,
+            "documents_requested": self.num_documents_requested,
+            "documents_sent": self.num_documents_sent,
+            "memory_hits": self.num_memory_hits,
+            "cache_hits": self.num_cache_hits,
+            "in_flight_merged": self.num_in_flight_merged,
+        }
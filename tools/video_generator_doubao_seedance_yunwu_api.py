@@ -1,9 +1,11 @@
 import logging
-from typing import List, Literal
+from typing import List, Literal, Optional
 import asyncio
-import aiohttp
+from utils.http import get_http_session
 from interfaces.video_output import VideoOutput
-from utils.image import image_path_to_b64
+from utils.image import prepare_image_b64
+from utils.artifact_cache import ArtifactCache, artifact_cached
+from utils.tracing import traced
 
 
 class VideoGeneratorDoubaoSeedanceYunwuAPI:
@@ -13,13 +15,18 @@ class VideoGeneratorDoubaoSeedanceYunwuAPI:
         t2v_model: str = "doubao-seedance-1-0-lite-t2v-250428",
         ff2v_model: str = "doubao-seedance-1-0-lite-i2v-250428",
         flf2v_model: str = "doubao-seedance-1-0-lite-i2v-250428",
+        artifact_cache: Optional[ArtifactCache] = None,
+        base_url: str = "https://yunwu.ai",
     ):
         self.api_key = api_key
+        self.base_url = base_url
         self.t2v_model = t2v_model
         self.ff2v_model = ff2v_model
         self.flf2v_model = flf2v_model
+        self.artifact_cache = artifact_cache
 
 
+    @traced("tool")
     async def create_video_generation_task(
         self,
         prompt: str,
@@ -50,7 +57,7 @@ class VideoGeneratorDoubaoSeedanceYunwuAPI:
 
         logging.info(f"Calling {model} to generate video...")
 
-        url = "https://yunwu.ai/volc/v1/contents/generations/tasks"
+        url = f"{self.base_url}/volc/v1/contents/generations/tasks"
 
 
         content = [
@@ -59,12 +66,13 @@ class VideoGeneratorDoubaoSeedanceYunwuAPI:
                 "text": prompt + f" --rs {resolution} --rt {aspect_ratio} --dur {duration}  --fps {fps}  --wm false --seed -1 --cf false"
             }
         ]
+        # Frames are sent as high-quality JPEG rather than full-size PNG, which the output resolution does not need
         if len(reference_image_paths) >= 1:
             content.append(
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": image_path_to_b64(reference_image_paths[0])
+                        "url": prepare_image_b64(reference_image_paths[0], max_side=2048, quality=95)
                     },
                     "role": "first_frame",
                 }
@@ -74,7 +82,7 @@ class VideoGeneratorDoubaoSeedanceYunwuAPI:
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": image_path_to_b64(reference_image_paths[1])
+                        "url": prepare_image_b64(reference_image_paths[1], max_side=2048, quality=95)
                     },
                     "role": "last_frame",
                 }
@@ -92,11 +100,11 @@ class VideoGeneratorDoubaoSeedanceYunwuAPI:
 
         while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, headers=headers, json=payload) as response:
-                        response_json = await response.json()
-                        logging.debug(f"Response: {response_json}")
-                        task_id = response_json["id"]
+                session = get_http_session()
+                async with session.post(url, headers=headers, json=payload) as response:
+                    response_json = await response.json()
+                    logging.debug(f"Response: {response_json}")
+                    task_id = response_json["id"]
             except Exception as e:
                 logging.error(f"Error occurred while creating video generation task.\nRetrying in 1 seconds...")
                 await asyncio.sleep(1)
@@ -106,6 +114,7 @@ class VideoGeneratorDoubaoSeedanceYunwuAPI:
         logging.info(f"Video generation task created successfully. Task ID: {task_id}")
         return task_id
 
+    @traced("tool")
     async def query_video_generation_task(
         self,
         task_id: str,
@@ -119,23 +128,22 @@ class VideoGeneratorDoubaoSeedanceYunwuAPI:
         Returns:
             Video URL string
         """
-        url = f"https://yunwu.ai/volc/v1/contents/generations/tasks/{task_id}"
+        url = f"{self.base_url}/volc/v1/contents/generations/tasks/{task_id}"
         headers = {
             'Authorization': f'Bearer {self.api_key}',
         }
 
         while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=headers) as response:
-                        response_json = await response.json()
-
+                session = get_http_session()
+                async with session.get(url, headers=headers) as response:
+                    response_json = await response.json()
+                    status = response_json["status"]
             except Exception as e:
                 logging.error(f"Error occurred while querying video generation task: {e}. Retrying in 1 seconds...")
                 await asyncio.sleep(1)
                 continue
 
-            status = response_json["status"]
             if status == "succeeded":
                 video_url = response_json["content"]["video_url"]
                 logging.info(f"Video generation completed successfully. Video URL: {video_url}")
@@ -150,6 +158,8 @@ class VideoGeneratorDoubaoSeedanceYunwuAPI:
 
         return video_url
 
+    @traced("tool")
+    @artifact_cached(VideoOutput)
     async def generate_single_video(
         self,
         prompt: str,
@@ -4,9 +4,13 @@ import asyncio
 from google import genai
 from google.genai import types
 from google.genai.errors import ClientError
-from httpx import RemoteProtocolError, ConnectError, TimeoutException
 from interfaces.video_output import VideoOutput
 from utils.rate_limiter import RateLimiter
+from utils.operation_poller import OperationPoller
+from utils.artifact_cache import ArtifactCache, artifact_cached
+from utils.file_uploads import FileUploadRegistry, UploadedFile
+from utils.tracing import traced
+from utils.adaptive_concurrency import report_throttling
 
 # https://ai.google.dev/gemini-api/docs/video-generation?hl=zh-cn
 
@@ -19,17 +23,32 @@ class VideoGeneratorVeoGoogleAPI:
         ff2v_model: str = "veo-3.1-generate-preview",
         flf2v_model: str = "veo-3.1-generate-preview",
         rate_limiter: Optional[RateLimiter] = None,
+        artifact_cache: Optional[ArtifactCache] = None,
     ):
         self.api_key = api_key
         self.t2v_model = t2v_model
         self.ff2v_model = ff2v_model
         self.flf2v_model = flf2v_model
         self.rate_limiter = rate_limiter
+        self.artifact_cache = artifact_cache
 
         self.client = genai.Client(
             api_key=api_key,
         )
+        # All outstanding generations of this client are polled by one background task
+        self.operation_poller = OperationPoller(
+            get_operation=lambda operation: self.client.aio.operations.get(operation),
+        )
+        # Veo on the Gemini API takes reference images inline only (gcs_uri requires Vertex AI),
+        # so the registry just keeps each loaded image per content hash instead of uploading it
+        self.reference_images = FileUploadRegistry(upload=self._load_reference_image, max_entries=64)
+
+    async def _load_reference_image(self, path: str) -> UploadedFile:
+        image = await asyncio.to_thread(types.Image.from_file, location=path)
+        return UploadedFile(handle=image)
 
+    @traced("tool")
+    @artifact_cached(VideoOutput)
     async def generate_single_video(
         self,
         prompt: str,
@@ -51,11 +70,10 @@ class VideoGeneratorVeoGoogleAPI:
             params["model"] = self.t2v_model
         elif len(reference_image_paths) == 1:
             params["model"] = self.ff2v_model
-            params["image"] = types.Image.from_file(location=reference_image_paths[0])
+            params["image"] = await self.reference_images.get(reference_image_paths[0])
         elif len(reference_image_paths) == 2:
             params["model"] = self.flf2v_model
-            params["image"] = types.Image.from_file(location=reference_image_paths[0])
-            config_params["last_frame"] = types.Image.from_file(location=reference_image_paths[1])
+            params["image"], config_params["last_frame"] = await self.reference_images.get_all(reference_image_paths)
         else:
             raise ValueError("The number of reference images must be no more than 2")
 
@@ -71,39 +89,22 @@ class VideoGeneratorVeoGoogleAPI:
 
         for attempt in range(max_retries):
             try:
-                operation = self.client.models.generate_videos(
+                operation = await self.client.aio.models.generate_videos(
                     **params,
                     config=types.GenerateVideosConfig(**config_params),
                 )
                 break
             except ClientError as e:
                 if e.code == 429 and attempt < max_retries - 1:
+                    report_throttling(e)
                     wait_time = retry_delay * (2 ** attempt)
                     logging.warning(f"Rate limit hit (429), retrying in {wait_time}s... (attempt {attempt + 1}/{max_retries})")
                     await asyncio.sleep(wait_time)
                 else:
                     raise
 
-        # Poll operation status with retry logic for network errors
-        poll_max_retries = 5
-        poll_retry_delay = 2
-
-        while not operation.done:
-            await asyncio.sleep(2)
-
-            for poll_attempt in range(poll_max_retries):
-                try:
-                    operation = self.client.operations.get(operation)
-                    logging.info(f"Video generation not completed, waiting 2 seconds...")
-                    break
-                except (RemoteProtocolError, ConnectError, TimeoutException, Exception) as e:
-                    if poll_attempt < poll_max_retries - 1:
-                        wait_time = poll_retry_delay * (2 ** poll_attempt)
-                        logging.warning(f"Network error while polling operation: {e}. Retrying in {wait_time}s... (attempt {poll_attempt + 1}/{poll_max_retries})")
-                        await asyncio.sleep(wait_time)
-                    else:
-                        logging.error(f"Failed to poll operation status after {poll_max_retries} retries")
-                        raise
+        # Wait for the operation without blocking the event loop; network errors are retried by the poller
+        operation = await self.operation_poller.wait(operation)
 
         # Check if operation completed successfully
         if operation.error:
@@ -136,11 +137,11 @@ class VideoGeneratorVeoGoogleAPI:
             raise RuntimeError(error_msg)
 
         generated_video = response.generated_videos[0]
-        self.client.files.download(file=generated_video.video)
+        video_bytes = await self.client.aio.files.download(file=generated_video.video)
 
         video_output = VideoOutput(
             fmt="bytes",
             ext="mp4",
-            data=generated_video.video.video_bytes,
+            data=video_bytes,
         )
         return video_output
@@ -2,9 +2,11 @@ import logging
 from typing import List, Optional
 from PIL import Image
 import asyncio
-import aiohttp
+from utils.http import get_http_session
 from interfaces.video_output import VideoOutput
-from utils.image import image_path_to_b64
+from utils.image import prepare_image_b64
+from utils.artifact_cache import ArtifactCache, artifact_cached
+from utils.tracing import traced
 
 
 class VideoGeneratorVeoYunwuAPI:
@@ -14,6 +16,8 @@ class VideoGeneratorVeoYunwuAPI:
         t2v_model: str = "veo3.1-fast",  # text to video
         ff2v_model: str = "veo3.1-fast",   # first frame to video
         flf2v_model: str = "veo2-fast-frames",  # first and last frame to video
+        artifact_cache: Optional[ArtifactCache] = None,
+        base_url: str = "https://yunwu.ai",
     ):
         """
         all models:
@@ -31,12 +35,15 @@ class VideoGeneratorVeoYunwuAPI:
 
         NOTE: veo3 does not support first and last frame to video generation.
         """
-        self.base_url = "https://yunwu.ai"
+        self.base_url = base_url
         self.api_key = api_key
         self.t2v_model = t2v_model
         self.ff2v_model = ff2v_model
         self.flf2v_model = flf2v_model
+        self.artifact_cache = artifact_cache
 
+    @traced("tool")
+    @artifact_cached(VideoOutput)
     async def generate_single_video(
         self,
         prompt: str = "",
@@ -59,7 +66,7 @@ class VideoGeneratorVeoYunwuAPI:
         payload = {
             "prompt": prompt,
             "model": model,
-            "images": [image_path_to_b64(image_path, mime=True) for image_path in reference_image_paths],
+            "images": [prepare_image_b64(image_path, max_side=2048, quality=95) for image_path in reference_image_paths],
             "enhance_prompt": True,
         }
         # only veo3 supports aspect ratio setting
@@ -73,15 +80,15 @@ class VideoGeneratorVeoYunwuAPI:
         }
 
 
-        url = f"https://yunwu.ai/v1/video/create"
+        url = f"{self.base_url}/v1/video/create"
         while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, headers=headers, json=payload) as response:
-                        response = await response.json()
-                        logging.debug(f"Response: {response}")
-                        task_id = response["id"]
-                        logging.info(f"Video generation task created successfully. Task ID: {task_id}")
+                session = get_http_session()
+                async with session.post(url, headers=headers, json=payload) as response:
+                    response = await response.json()
+                    logging.debug(f"Response: {response}")
+                    task_id = response["id"]
+                    logging.info(f"Video generation task created successfully. Task ID: {task_id}")
             except Exception as e:
                 logging.error(f"Error occurred while creating video generation task: {e}. Retrying in 1 second...")
                 await asyncio.sleep(1)
@@ -97,11 +104,11 @@ class VideoGeneratorVeoYunwuAPI:
 
         while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(f"{self.base_url}/v1/video/query?id={task_id}", headers=headers) as response:
-                        payload = await response.json()
-                        logging.debug(f"Response: {payload}")
-                        status = payload["status"]
+                session = get_http_session()
+                async with session.get(f"{self.base_url}/v1/video/query?id={task_id}", headers=headers) as response:
+                    payload = await response.json()
+                    logging.debug(f"Response: {payload}")
+                    status = payload["status"]
             except Exception as e:
                 logging.error(f"Error occurred while querying video generation task: {e}. Retrying in 1 second...")
                 await asyncio.sleep(1)
@@ -0,0 +1,240 @@
+import asyncio
+import contextvars
+import email.utils
+import logging
+import re
+import time
+from functools import wraps
+from typing import Any, Optional
+from utils.tracing import span
+
+
+def get_retry_after(exc: BaseException) -> Optional[float]:
+    """
+    Extract the number of seconds a provider asked us to wait from an exception.
+
+    Looks at the Retry-After header of the underlying HTTP response and at the
+    retryDelay of Google API error details.
+    """
+    headers = getattr(exc, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+
+    if headers is not None:
+        value = headers.get("Retry-After")
+        if value is not None:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                try:
+                    return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+
+    details = getattr(exc, "details", None)
+    if details is not None:
+        match = re.search(r"'retryDelay': '(\d+(?:\.\d+)?)s'", str(details))
+        if match:
+            return float(match.group(1))
+
+    return None
+
+
+def is_throttling_error(exc: BaseException) -> bool:
+    """
+    Whether an exception means the provider is rejecting our request rate or is
+    overloaded, i.e. an HTTP 429 or 503, or a google.genai APIError with the status
+    RESOURCE_EXHAUSTED or UNAVAILABLE. Other client errors, e.g. a 400 for a rejected
+    prompt, are not.
+    """
+    status = getattr(exc, "code", None) or getattr(exc, "status", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return status in (429, 503, "RESOURCE_EXHAUSTED", "UNAVAILABLE")
+
+
+def unwrap_retry_error(exc: BaseException) -> BaseException:
+    """
+    Get the exception of the last attempt if exc is a tenacity RetryError.
+    """
+    last_attempt = getattr(exc, "last_attempt", None)
+    if last_attempt is not None and last_attempt.failed:
+        return last_attempt.exception()
+    return exc
+
+
+# The limiter, epoch and reported exceptions of the call a limiter is running in this context
+_current_call = contextvars.ContextVar("adaptive_concurrency_call", default=None)
+
+
+def report_throttling(exc: BaseException) -> None:
+    """
+    Report an error that a tool retries by itself to the limiter of the call in
+    progress, if it is a throttling error, so that the limiter backs off right away
+    instead of only once the tool's retries are exhausted.
+    """
+    call = _current_call.get()
+    if call is None:
+        return
+    limiter, epoch, reported = call
+    exc = unwrap_retry_error(exc)
+    if is_throttling_error(exc) and not any(exc is reported_exc for reported_exc in reported):
+        reported.append(exc)
+        limiter.throttled(epoch, exc)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Adaptive concurrency limit using additive increase / multiplicative decrease (AIMD).
+
+    Every successful call raises the limit by 1 / limit, i.e. by one for every
+    limit consecutive successes. A throttling error (HTTP 429 or 503) halves the limit, and a Retry-After hint pauses new calls until it has passed. Calls that
+    were already in flight when the limit was halved do not halve it again. The limit
+    settles around the number of concurrent jobs the provider actually accepts.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_concurrency: int = 1,
+        min_concurrency: int = 1,
+        max_concurrency: int = 8,
+    ):
+        """
+        Initialize the adaptive concurrency limiter.
+
+        Args:
+            name: Name of the limited service, used in logs.
+            initial_concurrency: Number of concurrent calls allowed at the start.
+            min_concurrency: The limit never drops below this value.
+            max_concurrency: The limit never grows beyond this value.
+        """
+        self.name = name
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        # Incremented on every decrease, so that a burst of throttled calls halves the limit only once
+        self.epoch = 0
+        self.condition = asyncio.Condition()
+
+        self.num_successes = 0
+        self.num_throttles = 0
+        self.peak_in_flight = 0
+
+    @property
+    def concurrency(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> int:
+        async with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout=pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if self.in_flight < self.concurrency:
+                    break
+                await self.condition.wait()
+
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return self.epoch
+
+    def throttled(
+        self,
+        epoch: int,
+        exc: BaseException,
+    ) -> None:
+        """
+        Halve the limit, unless it was already halved since the call acquired its slot
+        at the given epoch, and pause new calls for the Retry-After hint of exc.
+        """
+        self.num_throttles += 1
+
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+        if epoch == self.epoch:
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self.epoch += 1
+            logging.warning(f"{self.name} is throttled ({repr(exc)}), concurrency reduced to {self.concurrency}" + (f", pausing {retry_after:.1f}s" if retry_after else ""))
+
+    async def release(
+        self,
+        epoch: int,
+        exc: Optional[BaseException] = None,
+        reported: Optional[list] = None,
+    ):
+        async with self.condition:
+            self.in_flight -= 1
+
+            if exc is None:
+                self.num_successes += 1
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+            else:
+                exc = unwrap_retry_error(exc)
+                # An error the tool already reported through report_throttling() is not counted twice
+                if is_throttling_error(exc) and not any(exc is reported_exc for reported_exc in reported or []):
+                    self.throttled(epoch, exc)
+
+            self.condition.notify_all()
+
+    async def run(self, func, *args, **kwargs) -> Any:
+        """
+        Run an async function once a concurrency slot is available, and adapt the
+        limit to its outcome.
+        """
+        with span("concurrency_wait", "wait", limiter=self.name):
+            epoch = await self.acquire()
+        reported = []
+        token = _current_call.set((self, epoch, reported))
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as e:
+            await self.release(epoch, e, reported)
+            raise
+        finally:
+            _current_call.reset(token)
+        await self.release(epoch)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "peak_in_flight": self.peak_in_flight,
+            "successes": self.num_successes,
+            "throttles": self.num_throttles,
+        }
+
+
+class AdaptiveConcurrencyProxy:
+    """
+    Wrap an image or video generator so that its generate_single_* calls go through
+    an AdaptiveConcurrencyLimiter. All other attributes are forwarded unchanged.
+    """
+
+    def __init__(
+        self,
+        generator,
+        limiter: AdaptiveConcurrencyLimiter,
+    ):
+        self.generator = generator
+        self.limiter = limiter
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.generator, name)
+        if not name.startswith("generate_single_"):
+            return attr
+
+        @wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self.limiter.run(attr, *args, **kwargs)
+
+        return wrapper
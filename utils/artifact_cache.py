@@ -0,0 +1,275 @@
+import os
+import json
+import asyncio
+import time
+import uuid
+import sqlite3
+import hashlib
+import inspect
+import logging
+import threading
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_sha256(path: str) -> str:
+    """
+    Get the SHA-256 of a file's content. Results are memoized per (path, mtime, size).
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if memo_key not in _file_hashes:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+        _file_hashes[memo_key] = sha256.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def make_artifact_key(
+    provider: str,
+    models: Dict[str, str],
+    params: Dict,
+    reference_image_paths: List[str],
+) -> str:
+    """
+    Build the content address of a generated artifact.
+
+    Args:
+        provider: Class name of the generator.
+        models: The model names configured on the generator.
+        params: The generation parameters, e.g. prompt, size, aspect ratio or duration.
+        reference_image_paths: Reference images, which are keyed by content instead of by path.
+    """
+    key_data = {
+        "provider": provider,
+        "models": models,
+        "params": params,
+        "reference_images": [file_sha256(path) for path in reference_image_paths],
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """
+    Content-addressed store of generated images and videos shared by all working directories.
+
+    Artifacts are stored under root by their key and hard-linked into the working
+    directory on a hit. The total size is bounded by max_size_bytes; the least
+    recently used artifacts are evicted first.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_size_bytes: int = 20 * 1024 ** 3,
+    ):
+        """
+        Initialize the artifact cache.
+
+        Args:
+            root: Directory of the store. It can be shared by several projects.
+            max_size_bytes: Maximum total size of the stored artifacts.
+        """
+        self.root = os.path.expanduser(root)
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+
+        self.db_path = os.path.join(self.root, "index.sqlite")
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "key TEXT PRIMARY KEY, ext TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS artifacts_last_access ON artifacts (last_access)")
+
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+        self.bytes_saved = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _object_path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, "objects", key[:2], f"{key}.{ext}")
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """
+        Look up an artifact.
+
+        Returns:
+            The stored path and extension of the artifact, or None on a miss.
+        """
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT ext, size FROM artifacts WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                ext, size = row
+                path = self._object_path(key, ext)
+                if os.path.exists(path):
+                    conn.execute("UPDATE artifacts SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self.num_hits += 1
+                    self.bytes_saved += size
+                    return path, ext
+                # The file was removed behind our back
+                conn.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+
+            self.num_misses += 1
+            return None
+
+    def invalidate(self, key: str) -> bool:
+        """
+        Remove an artifact, e.g. a bad generation that should not be served again.
+
+        Returns:
+            Whether the artifact was stored.
+        """
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT ext FROM artifacts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False
+            path = self._object_path(key, row[0])
+            if os.path.exists(path):
+                os.remove(path)
+            conn.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+            return True
+
+    def put_output(self, key: str, output) -> str:
+        """
+        Store an ImageOutput or VideoOutput.
+
+        Returns:
+            The stored path of the artifact.
+        """
+        tmp_path = self._make_tmp_path(key, output.ext)
+        try:
+            output.save(tmp_path)
+            return self._commit(key, output.ext, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def aput_output(self, key: str, output) -> str:
+        """
+        Store an ImageOutput or VideoOutput without blocking the event loop.
+
+        Returns:
+            The stored path of the artifact.
+        """
+        tmp_path = self._make_tmp_path(key, output.ext)
+        try:
+            await output.asave(tmp_path)
+            return await asyncio.to_thread(self._commit, key, output.ext, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _make_tmp_path(self, key: str, ext: str) -> str:
+        # Save next to the final location first, so readers never see a partial file.
+        # The temp file keeps the extension because PIL picks the format from it.
+        path = self._object_path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return os.path.join(os.path.dirname(path), f".{key}.{uuid.uuid4().hex}.{ext}")
+
+    def _commit(self, key: str, ext: str, tmp_path: str) -> str:
+        path = self._object_path(key, ext)
+        os.replace(tmp_path, path)
+
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (key, ext, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, ext, os.path.getsize(path), time.time()),
+            )
+            self._evict(conn, keep_key=key)
+
+        return path
+
+    def _evict(self, conn: sqlite3.Connection, keep_key: str) -> None:
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+
+        for key, ext, size in conn.execute("SELECT key, ext, size FROM artifacts ORDER BY last_access").fetchall():
+            if total_size <= self.max_size_bytes:
+                break
+            if key == keep_key:
+                continue
+            path = self._object_path(key, ext)
+            if os.path.exists(path):
+                os.remove(path)
+            conn.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+            total_size -= size
+            self.num_evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock, self._connect() as conn:
+            num_artifacts, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+        return {
+            "hits": self.num_hits,
+            "misses": self.num_misses,
+            "evictions": self.num_evictions,
+            "bytes_saved": self.bytes_saved,
+            "artifacts": num_artifacts,
+            "size_bytes": total_size,
+        }
+
+
+def artifact_cached(output_cls):
+    """
+    Decorate a generate_single_image / generate_single_video method so that it checks
+    the generator's artifact_cache first.
+
+    The key covers the generator class, its model names, every generation parameter
+    and the content of the reference images. Both hits and fresh results are returned
+    as a local file output, which hard-links the stored artifact into place on save.
+
+    Passing force_regenerate=True skips the lookup and replaces the stored artifact
+    with the fresh result. Hashing the reference images and the index lookups run in
+    a worker thread, off the event loop.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        self_name = next(iter(signature.parameters))
+        var_keyword_name = next((name for name, param in signature.parameters.items() if param.kind is param.VAR_KEYWORD), None)
+
+        @wraps(func)
+        async def wrapper(self, *args, force_regenerate: bool = False, **kwargs):
+            artifact_cache: Optional[ArtifactCache] = getattr(self, "artifact_cache", None)
+            if artifact_cache is None:
+                return await func(self, *args, **kwargs)
+
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            arguments.pop(self_name)
+            reference_image_paths = arguments.pop("reference_image_paths", None) or []
+            if var_keyword_name is not None:
+                arguments.update(arguments.pop(var_keyword_name, {}))
+
+            models = {
+                attr: getattr(self, attr)
+                for attr in ["model", "t2v_model", "ff2v_model", "flf2v_model"]
+                if hasattr(self, attr)
+            }
+            key = await asyncio.to_thread(make_artifact_key, type(self).__name__, models, arguments, reference_image_paths)
+
+            hit = None if force_regenerate else await asyncio.to_thread(artifact_cache.get, key)
+            if hit is not None:
+                path, ext = hit
+                logging.info(f"Artifact cache hit for {type(self).__name__}: {path}")
+                return output_cls(fmt="file", ext=ext, data=path)
+
+            output = await func(self, *args, **kwargs)
+            if output is None:
+                return output
+            path = await artifact_cache.aput_output(key, output)
+            return output_cls(fmt="file", ext=output.ext, data=path)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,35 @@
+import time
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from utils.rate_limiter import RateLimiter
+
+
+class ChatModelRateLimiter(BaseRateLimiter):
+    """
+    Adapter that lets a LangChain chat model draw its requests from a RateLimiter.
+
+    Pass it as the rate_limiter of the chat model, e.g.
+    init_chat_model(..., rate_limiter=ChatModelRateLimiter(rate_limiter)), so that every
+    agent and every concurrently running scene shares the same chat quota.
+    """
+
+    def __init__(
+        self,
+        rate_limiter: RateLimiter,
+    ):
+        self.rate_limiter = rate_limiter
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        if not blocking and self.rate_limiter.next_available_at() > time.time():
+            return False
+        wait_time, _ = self.rate_limiter.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        if not blocking and self.rate_limiter.next_available_at() > time.time():
+            return False
+        await self.rate_limiter.acquire()
+        return True
@@ -0,0 +1,111 @@
+import os
+import glob
+import asyncio
+import hashlib
+import logging
+from typing import Dict
+
+import aiohttp
+
+from utils.http import get_http_session
+
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_CONCURRENT_DOWNLOADS = 8
+
+_download_semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+
+def _get_download_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _download_semaphores.get(loop)
+    if semaphore is None:
+        for closed_loop in [other for other in _download_semaphores if other.is_closed()]:
+            del _download_semaphores[closed_loop]
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+        _download_semaphores[loop] = semaphore
+    return semaphore
+
+
+async def _download_to_part_file(
+    url: str,
+    part_path: str,
+) -> None:
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+
+    session = get_http_session()
+    # No total timeout, a large video may take a while; a stalled transfer is caught by sock_read
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+    async with session.get(url, headers=headers, timeout=timeout) as response:
+        if response.status == 416 and offset > 0:
+            # The part file already holds the whole content
+            return
+        response.raise_for_status()
+
+        if offset > 0 and response.status != 206:
+            logging.info(f"Server ignored the range request for {url}, restarting from byte 0")
+            offset = 0
+
+        with open(part_path, "ab" if offset > 0 else "wb") as f:
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+
+        if response.content_length is not None:
+            expected_size = offset + response.content_length
+            if os.path.getsize(part_path) < expected_size:
+                raise aiohttp.ClientPayloadError(f"Transfer of {url} ended after {os.path.getsize(part_path)} of {expected_size} bytes")
+
+
+async def download_file(
+    url: str,
+    save_path: str,
+    max_attempts: int = 5,
+    retry_delay: float = 1.0,
+) -> None:
+    """
+    Download a URL to a file without blocking the event loop.
+
+    The content is streamed to a ".part" file next to save_path in large chunks and
+    renamed into place once complete, so save_path never holds a partial file. An
+    interrupted transfer resumes from the bytes already received with an HTTP Range
+    request, also across runs. At most MAX_CONCURRENT_DOWNLOADS downloads run at the same
+    time; the others wait in line.
+
+    Args:
+        url: URL to download.
+        save_path: Path where the file will be saved.
+        max_attempts: Number of attempts before the last error is raised.
+        retry_delay: Seconds to wait before the first retry, doubled on every retry.
+    """
+    # The part file is keyed by URL, so a transfer only ever resumes with the same content
+    part_path = f"{save_path}.{hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]}.part"
+    save_dir = os.path.dirname(save_path)
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+    for stale_part_path in glob.glob(glob.escape(save_path) + ".*.part"):
+        if stale_part_path != part_path:
+            os.remove(stale_part_path)
+
+    async with _get_download_semaphore():
+        logging.info(f"Downloading {url} to {save_path}")
+        for attempt in range(max_attempts):
+            try:
+                await _download_to_part_file(url, part_path)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == max_attempts - 1:
+                    logging.error(f"Error downloading {url}: {e}")
+                    raise
+                status = getattr(e, "status", None)
+                if status is not None and 400 <= status < 500 and status not in (408, 429):
+                    # e.g. an expired link, retrying will not help
+                    logging.error(f"Error downloading {url}: {e}")
+                    raise
+                wait_time = retry_delay * (2 ** attempt)
+                received = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                logging.warning(f"Download of {url} interrupted after {received} bytes: {e}. Resuming in {wait_time:.0f}s... (attempt {attempt + 1}/{max_attempts})")
+                await asyncio.sleep(wait_time)
+
+    os.replace(part_path, save_path)
+    logging.info(f"Downloaded {url} to {save_path}")
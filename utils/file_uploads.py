@@ -0,0 +1,171 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import mimetypes
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from utils.artifact_cache import file_sha256
+
+
+class UploadedFile:
+    """
+    Handle of a file in a provider's file store.
+
+    Args:
+        handle: What the provider expects in place of the file, e.g. a google.genai File.
+        expire_time: Unix time at which the provider deletes the file. None if it never expires.
+    """
+
+    def __init__(
+        self,
+        handle: Any,
+        expire_time: Optional[float] = None,
+    ):
+        self.handle = handle
+        self.expire_time = expire_time
+
+
+class FileUploadRegistry:
+    """
+    Uploads every reference image to a provider's file store once per content hash.
+
+    Later calls with the same image, under any path, get the handle of the earlier
+    upload instead of sending the pixels again. Handles that are about to expire are
+    uploaded again, and concurrent requests for the same image share one upload.
+    When the provider reports that a file is gone before its expiry, call
+    invalidate() and ask for the handle again.
+    """
+
+    def __init__(
+        self,
+        upload: Callable[[str], Awaitable[UploadedFile]],
+        expiry_margin: float = 600,
+        max_entries: int = 1024,
+    ):
+        """
+        Initialize the file upload registry.
+
+        Args:
+            upload: Coroutine function that uploads the file at a path and returns its handle.
+            expiry_margin: Seconds before its expiry from which a handle is no longer handed out,
+                           so that it cannot expire while a request using it is in flight.
+            max_entries: Maximum number of handles kept; the oldest uploads are forgotten first.
+        """
+        self.upload = upload
+        self.expiry_margin = expiry_margin
+        self.max_entries = max_entries
+
+        self.entries: Dict[str, UploadedFile] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+        self.num_hits = 0
+        self.num_uploads = 0
+        self.num_expired = 0
+        self.num_invalidated = 0
+        self.bytes_skipped = 0
+
+    def _is_valid(self, uploaded_file: UploadedFile) -> bool:
+        if uploaded_file.expire_time is None:
+            return True
+        return uploaded_file.expire_time - self.expiry_margin > time.time()
+
+    async def get(self, path: str) -> Any:
+        """
+        Get the provider handle of a file, uploading it if needed.
+        """
+        content_hash = await asyncio.to_thread(file_sha256, path)
+        lock = self.locks.setdefault(content_hash, asyncio.Lock())
+        async with lock:
+            uploaded_file = self.entries.get(content_hash)
+            if uploaded_file is not None:
+                if self._is_valid(uploaded_file):
+                    self.num_hits += 1
+                    self.bytes_skipped += os.path.getsize(path)
+                    return uploaded_file.handle
+                self.num_expired += 1
+                del self.entries[content_hash]
+
+            logging.info(f"Uploading {path} to the provider's file store...")
+            uploaded_file = await self.upload(path)
+            self.num_uploads += 1
+
+            self.entries[content_hash] = uploaded_file
+            while len(self.entries) > self.max_entries:
+                evicted_hash = next(iter(self.entries))
+                del self.entries[evicted_hash]
+                self._forget_lock(evicted_hash)
+            return uploaded_file.handle
+
+    async def get_all(self, paths: List[str]) -> List[Any]:
+        return list(await asyncio.gather(*[self.get(path) for path in paths]))
+
+    async def invalidate(self, paths: List[str]) -> None:
+        """
+        Forget the handles of files, so that the next get() uploads them again.
+        """
+        content_hashes = await asyncio.gather(*[asyncio.to_thread(file_sha256, path) for path in paths])
+        for content_hash in content_hashes:
+            if self.entries.pop(content_hash, None) is not None:
+                self.num_invalidated += 1
+                self._forget_lock(content_hash)
+
+    def _forget_lock(self, content_hash: str) -> None:
+        # A lock that is held or awaited is still needed; it is dropped when its file is forgotten again
+        lock = self.locks.get(content_hash)
+        if lock is not None and not lock.locked():
+            del self.locks[content_hash]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.num_hits,
+            "uploads": self.num_uploads,
+            "expired": self.num_expired,
+            "invalidated": self.num_invalidated,
+            "bytes_skipped": self.bytes_skipped,
+        }
+
+
+class InMemoryFileStore:
+    """
+    In-memory stand-in for a provider's file store, for exercising FileUploadRegistry
+    without network access.
+
+    upload() can be passed to FileUploadRegistry directly. Files expire after ttl
+    seconds, and expire_all() drops every file early to simulate a provider that
+    deleted them.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 48 * 3600,
+    ):
+        self.ttl = ttl
+        self.files: Dict[str, Tuple[bytes, str, float]] = {}
+        self.num_uploads = 0
+
+    async def upload(self, path: str) -> UploadedFile:
+        with open(path, "rb") as f:
+            data = f.read()
+        mime_type, _ = mimetypes.guess_type(path)
+        expire_time = time.time() + self.ttl
+
+        uri = f"local://files/{uuid.uuid4().hex}"
+        self.files[uri] = (data, mime_type or "application/octet-stream", expire_time)
+        self.num_uploads += 1
+        return UploadedFile(handle=uri, expire_time=expire_time)
+
+    def get(self, uri: str) -> Tuple[bytes, str]:
+        """
+        Get the content and mime type of an uploaded file.
+
+        Raises:
+            FileNotFoundError: If the file was never uploaded or has expired.
+        """
+        data, mime_type, expire_time = self.files.get(uri, (None, None, 0.0))
+        if data is None or expire_time <= time.time():
+            raise FileNotFoundError(f"File {uri} does not exist or has expired")
+        return data, mime_type
+
+    def expire_all(self) -> None:
+        self.files.clear()
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from functools import wraps
+from typing import Any, Callable, Optional
+
+
+class RequestHedger:
+    """
+    Hedged requests against tail latency.
+
+    The latencies of recent successful calls are tracked, and a call still running
+    after their hedge_percentile is duplicated, on the same generator or on an
+    alternate one. The first successful result wins and the other call is
+    cancelled. Duplicates are capped at max_hedge_ratio of all calls, so a provider
+    that is slow across the board is not sent twice the load.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        hedge_percentile: float = 0.95,
+        min_samples: int = 20,
+        window: int = 200,
+        max_hedge_ratio: float = 0.1,
+        min_hedge_delay: float = 1.0,
+    ):
+        """
+        Initialize the request hedger.
+
+        Args:
+            name: Name of the hedged service, used in logs.
+            hedge_percentile: A call is duplicated once it runs longer than this percentile of the recent latencies.
+            min_samples: Number of latencies needed before any call is hedged.
+            window: Number of recent latencies the percentile is computed from.
+            max_hedge_ratio: Maximum number of duplicates, as a fraction of the number of calls.
+            min_hedge_delay: A call is never duplicated before it ran this many seconds.
+        """
+        self.name = name
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_hedge_delay = min_hedge_delay
+        self.latencies = deque(maxlen=window)
+
+        self.num_calls = 0
+        self.num_hedges = 0
+        self.num_hedge_wins = 0
+        self.num_primary_wins = 0
+        self.num_budget_denied = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Get the number of seconds after which a call is duplicated.
+
+        Returns:
+            The delay, or None while too few latencies are known.
+        """
+        if len(self.latencies) < self.min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        percentile = latencies[min(len(latencies) - 1, int(self.hedge_percentile * len(latencies)))]
+        return max(self.min_hedge_delay, percentile)
+
+    def _take_budget(self) -> bool:
+        if self.num_hedges + 1 > self.max_hedge_ratio * self.num_calls:
+            self.num_budget_denied += 1
+            return False
+        self.num_hedges += 1
+        return True
+
+    async def run(
+        self,
+        func: Callable,
+        hedge_func: Callable,
+        *args,
+        **kwargs,
+    ) -> Any:
+        """
+        Run an async function, and run hedge_func with the same arguments as well if
+        it takes longer than the hedge delay.
+
+        Returns:
+            The result of whichever call succeeds first.
+        """
+        self.num_calls += 1
+        start_time = time.monotonic()
+        primary = asyncio.ensure_future(func(*args, **kwargs))
+        tasks = {primary}
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+            if primary.done() or delay is None or not self._take_budget():
+                result = await primary
+                self.latencies.append(time.monotonic() - start_time)
+                return result
+
+            logging.info(f"{self.name} call is still running after {delay:.1f}s, sending a hedged request")
+            hedge = asyncio.ensure_future(hedge_func(*args, **kwargs))
+            tasks.add(hedge)
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is not None:
+                        # The other call may still succeed; report the error of the original call otherwise
+                        if error is None or task is primary:
+                            error = task.exception()
+                        continue
+
+                    # When the hedge wins, the original call took at least as long, so this stays a lower bound
+                    self.latencies.append(time.monotonic() - start_time)
+                    if task is hedge:
+                        self.num_hedge_wins += 1
+                    else:
+                        self.num_primary_wins += 1
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.num_calls,
+            "hedges": self.num_hedges,
+            "hedge_wins": self.num_hedge_wins,
+            "primary_wins": self.num_primary_wins,
+            "budget_denied": self.num_budget_denied,
+            "hedge_delay": self.hedge_delay(),
+        }
+
+
+class HedgedRequestProxy:
+    """
+    Wrap an image or video generator so that its generate_single_* calls go through
+    a RequestHedger. Hedged requests go to the alternate generator if one is given,
+    otherwise to the same one. Hedged requests to the alternate generator first draw
+    from alternate_rate_limiter, for alternate tools that take no rate limiter of
+    their own. All other attributes are forwarded unchanged.
+    """
+
+    def __init__(
+        self,
+        generator,
+        hedger: RequestHedger,
+        alternate_generator=None,
+        alternate_rate_limiter=None,
+    ):
+        self.generator = generator
+        self.hedger = hedger
+        self.alternate_generator = alternate_generator
+        self.alternate_rate_limiter = alternate_rate_limiter
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.generator, name)
+        if not name.startswith("generate_single_"):
+            return attr
+
+        hedge_attr = attr
+        if self.alternate_generator is not None:
+            alternate_attr = getattr(self.alternate_generator, name)
+
+            async def hedge_attr(*args, **kwargs):
+                if self.alternate_rate_limiter is not None:
+                    await self.alternate_rate_limiter.acquire()
+                return await alternate_attr(*args, **kwargs)
+
+        @wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self.hedger.run(attr, hedge_attr, *args, **kwargs)
+
+        return wrapper
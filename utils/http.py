@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from utils.tracing import current_span
+
+
+class ConnectionStats:
+    """
+    Counts how many requests were sent over a new connection and how many over a pooled one.
+    """
+
+    def __init__(self):
+        self.num_requests = 0
+        self.num_connections_created = 0
+        self.num_connections_reused = 0
+
+    def make_trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.num_requests += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.num_connections_created += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.num_connections_reused += 1
+
+        # Request and response bodies are counted on the span of the calling tool
+        async def on_request_chunk_sent(session, context, params):
+            current_span().add("bytes_out", len(params.chunk))
+
+        async def on_response_chunk_received(session, context, params):
+            current_span().add("bytes_in", len(params.chunk))
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+        trace_config.on_response_chunk_received.append(on_response_chunk_received)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def stats(self) -> dict:
+        num_connections = self.num_connections_created + self.num_connections_reused
+        return {
+            "requests": self.num_requests,
+            "connections_created": self.num_connections_created,
+            "connections_reused": self.num_connections_reused,
+            "reuse_ratio": self.num_connections_reused / num_connections if num_connections else 0.0,
+        }
+
+
+class HTTPClientPool:
+    """
+    Long-lived HTTP sessions shared by all tools.
+
+    One aiohttp.ClientSession is kept per event loop, because a session cannot be
+    used from another loop. Its connector bounds the number of connections in total
+    and per host, keeps idle connections alive and caches DNS lookups, so that
+    repeated calls to the same provider skip the TCP and TLS handshakes. Blocking
+    callers get a pooled requests.Session instead.
+
+    aiohttp only speaks HTTP/1.1; keep-alive connection reuse is what removes the
+    per-call handshake here.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 16,
+        keepalive_timeout: float = 60,
+        ttl_dns_cache: int = 300,
+    ):
+        """
+        Initialize the HTTP client pool.
+
+        Args:
+            limit: Maximum number of simultaneous connections of a session.
+            limit_per_host: Maximum number of simultaneous connections to the same host.
+            keepalive_timeout: Seconds an idle connection is kept open for reuse.
+            ttl_dns_cache: Seconds a DNS lookup is cached.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+
+        self.sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self.connection_stats = ConnectionStats()
+
+        self.lock = threading.Lock()
+        self.requests_session: Optional[requests.Session] = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the session of the running event loop, creating it on first use.
+        """
+        loop = asyncio.get_running_loop()
+        session = self.sessions.get(loop)
+        if session is None or session.closed:
+            # Forget sessions of loops that have been closed since
+            for closed_loop in [other for other in self.sessions if other.is_closed()]:
+                del self.sessions[closed_loop]
+
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.ttl_dns_cache,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[self.connection_stats.make_trace_config()],
+            )
+            self.sessions[loop] = session
+            logging.debug(f"Created pooled HTTP session (limit {self.limit}, {self.limit_per_host} per host).")
+        return session
+
+    def get_requests_session(self) -> requests.Session:
+        """
+        Get the pooled session for blocking requests, creating it on first use.
+        """
+        with self.lock:
+            if self.requests_session is None:
+                adapter = HTTPAdapter(pool_connections=self.limit_per_host, pool_maxsize=self.limit)
+                self.requests_session = requests.Session()
+                self.requests_session.mount("http://", adapter)
+                self.requests_session.mount("https://", adapter)
+            return self.requests_session
+
+    async def close(self) -> None:
+        """
+        Close the session of the running event loop and the blocking session.
+        """
+        session = self.sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+        with self.lock:
+            if self.requests_session is not None:
+                self.requests_session.close()
+                self.requests_session = None
+
+    def stats(self) -> dict:
+        return self.connection_stats.stats()
+
+
+http_client_pool = HTTPClientPool()
+
+
+def configure_http_client_pool(**kwargs) -> None:
+    """
+    Replace the shared pool with one using the given HTTPClientPool arguments. Call it
+    before the first request is made.
+    """
+    global http_client_pool
+    http_client_pool = HTTPClientPool(**kwargs)
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Get the shared aiohttp session of the running event loop. Do not close it; call
+    close_http_sessions() on shutdown instead.
+    """
+    return http_client_pool.get_session()
+
+
+def get_requests_session() -> requests.Session:
+    """
+    Get the shared requests session for blocking calls.
+    """
+    return http_client_pool.get_requests_session()
+
+
+async def close_http_sessions() -> None:
+    """
+    Close the shared sessions. They are recreated if a tool makes another request.
+    """
+    await http_client_pool.close()
+
+
+def http_stats() -> dict:
+    """
+    Get the request and connection reuse counts of the shared aiohttp sessions.
+    """
+    return http_client_pool.stats()
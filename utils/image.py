@@ -1,10 +1,15 @@
+import os
 import logging
-import requests
+import threading
+from collections import OrderedDict
+from typing import Literal, Optional
+from utils.http import get_requests_session
 import base64
 import mimetypes
 from tenacity import retry
 from io import BytesIO
 import cv2
+from PIL import Image
 
 
 @retry
@@ -12,12 +17,13 @@ def download_image(url, save_path):
     try:
         logging.info(f"Downloading image from {url} to {save_path}")
 
-        response = requests.get(url, stream=True)
-        response.raise_for_status() # Check for HTTP errors
+        # The pooled session keeps the connection to the image host alive between downloads
+        with get_requests_session().get(url, stream=True) as response:
+            response.raise_for_status() # Check for HTTP errors
 
-        with open(save_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=1024):
-                file.write(chunk)
+            with open(save_path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=1024):
+                    file.write(chunk)
         logging.info(f"Image downloaded successfully to {save_path}")
 
     except Exception as e:
@@ -38,6 +44,112 @@ def image_path_to_b64(image_path, mime: bool = True) -> str:
     return b64
 
 
+class PreparedImageCache:
+    """
+    In-process LRU of base64 image payloads, keyed by (path, mtime, max side, format, quality).
+
+    Every reference image is read and encoded once per consumer setting instead of on
+    every request. Counts how many bytes the prepared payloads save compared to
+    sending the original files.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+    ):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, str]" = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.num_hits = 0
+        self.num_misses = 0
+        self.original_bytes = 0
+        self.prepared_bytes = 0
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self.lock:
+            payload = self.entries.get(key)
+            if payload is not None:
+                self.entries.move_to_end(key)
+                self.num_hits += 1
+            else:
+                self.num_misses += 1
+            return payload
+
+    def put(self, key: tuple, payload: str) -> None:
+        with self.lock:
+            self.entries[key] = payload
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def record(self, original_size: int, payload: str) -> None:
+        with self.lock:
+            # base64 inflates the original file by 4/3, as image_path_to_b64 would have sent it
+            self.original_bytes += (original_size + 2) // 3 * 4
+            self.prepared_bytes += len(payload)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.num_hits,
+                "misses": self.num_misses,
+                "original_bytes": self.original_bytes,
+                "prepared_bytes": self.prepared_bytes,
+                "saved_bytes": self.original_bytes - self.prepared_bytes,
+            }
+
+
+prepared_image_cache = PreparedImageCache()
+
+
+def prepare_image_b64(
+    image_path: str,
+    max_side: Optional[int] = None,
+    fmt: Optional[Literal["JPEG", "WEBP"]] = "JPEG",
+    quality: int = 85,
+    mime: bool = True,
+) -> str:
+    """
+    Get the base64 payload of an image, downscaled and re-encoded for its consumer.
+
+    Args:
+        image_path: Path of the image.
+        max_side: The longer side is downscaled to at most this many pixels. If None, the size is kept.
+        fmt: Format to re-encode to. If None, the original file is sent as is.
+        quality: Encoder quality for JPEG and WebP.
+        mime: Whether to return a data URL rather than the bare base64 string.
+    """
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, max_side, fmt, quality, mime)
+
+    payload = prepared_image_cache.get(key)
+    if payload is None:
+        if fmt is None:
+            payload = image_path_to_b64(image_path, mime=mime)
+        else:
+            with Image.open(image_path) as image:
+                if image.mode in ("RGBA", "LA", "P"):
+                    image = image.convert("RGBA")
+                    background = Image.new("RGB", image.size, (255, 255, 255))
+                    background.paste(image, mask=image.getchannel("A"))
+                    image = background
+                elif image.mode != "RGB":
+                    image = image.convert("RGB")
+                if max_side is not None and max(image.size) > max_side:
+                    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+                buffered = BytesIO()
+                image.save(buffered, format=fmt, quality=quality)
+
+            b64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+            payload = f"data:image/{fmt.lower()};base64,{b64}" if mime else b64
+        prepared_image_cache.put(key, payload)
+
+    prepared_image_cache.record(stat.st_size, payload)
+    return payload
+
+
 def pil_to_b64(image, mime: bool = True) -> str:
     buffered = BytesIO()
     image.save(buffered, format="PNG")
@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.text_stream import StreamingTextSplitter
+
+
+class PersistentKnowledgeBase:
+    """
+    FAISS index of the chunks of a text, persisted in a directory and updated in place.
+
+    The text is split into chunks identified by the SHA-256 of their content. The
+    index, the chunk texts and their offsets are saved next to each other, so that
+    a later run on the same text memory-maps the index instead of rebuilding it,
+    and a run on an edited text embeds only the chunks whose hash is new and
+    removes those that disappeared. When text is only appended, the chunks before
+    the last saved one are reused without splitting the text again.
+
+    load_file() does the same for a text file without reading it into memory: the
+    file is hashed and split block by block, so only the chunks are held.
+    """
+
+    index_filename = "index.faiss"
+    manifest_filename = "chunks.json"
+
+    def __init__(
+        self,
+        root_dir: str,
+        embeddings: Embeddings,
+        namespace: str = "",
+        chunk_size: int = 512,
+        chunk_overlap: int = 128,
+    ):
+        """
+        Initialize the persistent knowledge base.
+
+        Args:
+            root_dir: Directory of the index and the chunk manifest.
+            embeddings: Embeddings of the chunks and the queries.
+            namespace: Name of the embedding model. An index built with another one is rebuilt.
+            chunk_size: Characters per chunk.
+            chunk_overlap: Characters shared by two adjacent chunks.
+        """
+        self.root_dir = root_dir
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            add_start_index=True,
+        )
+        self.stream_splitter = StreamingTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+        )
+
+        self.num_chunks = 0
+        self.num_chunks_embedded = 0
+        self.num_chunks_reused = 0
+        self.num_chunks_removed = 0
+        self.load_mode: Optional[str] = None
+        self.seconds = 0.0
+
+        self.vectorstore: Optional[FAISS] = None
+        self.num_queries = 0
+        self.num_queries_embedded = 0
+        self.search_seconds = 0.0
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _read_manifest(self) -> Optional[dict]:
+        path = os.path.join(self.root_dir, self.manifest_filename)
+        if not os.path.exists(path) or not os.path.exists(os.path.join(self.root_dir, self.index_filename)):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable knowledge base manifest {path}: {e}")
+            return None
+
+        settings = [manifest.get("namespace"), manifest.get("chunk_size"), manifest.get("chunk_overlap")]
+        if settings != [self.namespace, self.chunk_size, self.chunk_overlap]:
+            logging.info("The knowledge base was built with other settings, rebuilding it.")
+            return None
+        return manifest
+
+    def _write(
+        self,
+        index: faiss.Index,
+        manifest: dict,
+    ) -> None:
+        # Write to temporary files first, so that an interrupted run never leaves a torn index behind
+        os.makedirs(self.root_dir, exist_ok=True)
+        index_path = os.path.join(self.root_dir, self.index_filename)
+        manifest_path = os.path.join(self.root_dir, self.manifest_filename)
+        faiss.write_index(index, index_path + ".tmp")
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _split(
+        self,
+        text: str,
+        manifest: Optional[dict],
+    ) -> List[Tuple[int, str]]:
+        """
+        Split the text into (start offset, chunk) pairs, reusing the chunks of the
+        manifest when the text only grew at the end.
+        """
+        if manifest is not None and manifest["chunks"]:
+            last_start = manifest["chunks"][-1]["start"]
+            prefix_length = manifest["text_length"]
+            if len(text) >= prefix_length and self._hash(text[:prefix_length]) == manifest["text_sha256"]:
+                # Every chunk before the last one ends before the old end of the text, so only
+                # the text from the start of the last chunk on has to be split again
+                kept = [(chunk["start"], manifest["texts"][chunk["id"]]) for chunk in manifest["chunks"][:-1]]
+                tail = self.splitter.create_documents([text[last_start:]])
+                return kept + [(last_start + document.metadata["start_index"], document.page_content) for document in tail]
+
+        documents = self.splitter.create_documents([text])
+        return [(document.metadata["start_index"], document.page_content) for document in documents]
+
+    def _make_vectorstore(
+        self,
+        index: faiss.Index,
+        index_ids: List[str],
+        texts: Dict[str, str],
+    ) -> FAISS:
+        docstore = InMemoryDocstore({chunk_id: Document(page_content=texts[chunk_id], id=chunk_id) for chunk_id in index_ids})
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=dict(enumerate(index_ids)),
+        )
+
+    def _map(
+        self,
+        manifest: dict,
+        start_time: float,
+    ) -> FAISS:
+        # Unchanged text: map the saved index instead of reading it into memory
+        index = faiss.read_index(os.path.join(self.root_dir, self.index_filename), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        self.vectorstore = self._make_vectorstore(index, manifest["index_ids"], manifest["texts"])
+        self.num_chunks = len(manifest["chunks"])
+        self.num_chunks_reused = len(manifest["index_ids"])
+        self.load_mode = "mmap"
+        self.seconds += time.monotonic() - start_time
+        return self.vectorstore
+
+    def load(
+        self,
+        text: str,
+    ) -> FAISS:
+        """
+        Get the vector store of the chunks of the text, loading, updating or building
+        the persisted index as needed.
+
+        Returns:
+            A FAISS vector store whose documents are the chunks of the text.
+        """
+        start_time = time.monotonic()
+        manifest = self._read_manifest()
+        text_sha256 = self._hash(text)
+
+        if manifest is not None and manifest["text_sha256"] == text_sha256 and manifest["text_length"] == len(text):
+            return self._map(manifest, start_time)
+
+        chunks = self._split(text, manifest)
+        return self._update(chunks, manifest, text_sha256, len(text), start_time)
+
+    def _hash_file(
+        self,
+        path: str,
+        prefix_length: Optional[int],
+        block_size: int,
+    ) -> Tuple[str, int, Optional[str]]:
+        """
+        Hash the text of a file block by block.
+
+        Returns:
+            The SHA-256 and the length of the text, and the SHA-256 of its first prefix_length
+            characters, or None if it is shorter.
+        """
+        digest = hashlib.sha256()
+        length = 0
+        prefix_sha256 = None
+        with open(path, "r", encoding="utf-8") as f:
+            while True:
+                block = f.read(block_size)
+                if prefix_sha256 is None and prefix_length is not None and length + len(block) >= prefix_length:
+                    prefix_digest = digest.copy()
+                    prefix_digest.update(block[:prefix_length - length].encode("utf-8"))
+                    prefix_sha256 = prefix_digest.hexdigest()
+                if not block:
+                    break
+                digest.update(block.encode("utf-8"))
+                length += len(block)
+        return digest.hexdigest(), length, prefix_sha256
+
+    def load_file(
+        self,
+        path: str,
+        block_size: int = 1 << 20,
+    ) -> FAISS:
+        """
+        Like load(), for the text of a UTF-8 file, which is hashed and split block by
+        block instead of being read into memory.
+
+        Returns:
+            A FAISS vector store whose documents are the chunks of the text.
+        """
+        start_time = time.monotonic()
+        manifest = self._read_manifest()
+        prefix_length = manifest["text_length"] if manifest is not None else None
+        text_sha256, text_length, prefix_sha256 = self._hash_file(path, prefix_length, block_size)
+
+        if manifest is not None and manifest["text_sha256"] == text_sha256 and manifest["text_length"] == text_length:
+            return self._map(manifest, start_time)
+
+        if manifest is not None and manifest["chunks"] and prefix_sha256 == manifest["text_sha256"]:
+            # The text only grew at the end, so only the text from the start of the last chunk on is split again
+            last_start = manifest["chunks"][-1]["start"]
+            chunks = [(chunk["start"], manifest["texts"][chunk["id"]]) for chunk in manifest["chunks"][:-1]]
+            chunks.extend(self.stream_splitter.split_file(path, start=last_start, block_size=block_size))
+        else:
+            chunks = list(self.stream_splitter.split_file(path, block_size=block_size))
+        return self._update(chunks, manifest, text_sha256, text_length, start_time)
+
+    def _update(
+        self,
+        chunks: List[Tuple[int, str]],
+        manifest: Optional[dict],
+        text_sha256: str,
+        text_length: int,
+        start_time: float,
+    ) -> FAISS:
+        """
+        Bring the persisted index in line with the chunks of a changed text, embedding only the new chunks.
+        """
+        texts = {self._hash(chunk): chunk for _, chunk in chunks}
+
+        if manifest is not None:
+            index = faiss.read_index(os.path.join(self.root_dir, self.index_filename))
+            index_ids = list(manifest["index_ids"])
+            self.load_mode = "updated"
+        else:
+            index = None
+            index_ids = []
+            self.load_mode = "built"
+
+        # Remove the chunks that are gone, then embed and add only the new ones
+        removed_positions = [position for position, chunk_id in enumerate(index_ids) if chunk_id not in texts]
+        if removed_positions:
+            index.remove_ids(np.array(removed_positions, dtype=np.int64))
+            removed = set(removed_positions)
+            index_ids = [chunk_id for position, chunk_id in enumerate(index_ids) if position not in removed]
+
+        existing_ids = set(index_ids)
+        new_ids = [chunk_id for chunk_id in texts if chunk_id not in existing_ids]
+        if new_ids:
+            vectors = np.array(self.embeddings.embed_documents([texts[chunk_id] for chunk_id in new_ids]), dtype=np.float32)
+            if index is None:
+                index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+            index_ids.extend(new_ids)
+        elif index is None:
+            raise ValueError("Cannot build a knowledge base from an empty text.")
+
+        self._write(index, {
+            "namespace": self.namespace,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "text_sha256": text_sha256,
+            "text_length": text_length,
+            "chunks": [{"id": self._hash(chunk), "start": start} for start, chunk in chunks],
+            "index_ids": index_ids,
+            "texts": {chunk_id: texts[chunk_id] for chunk_id in index_ids},
+        })
+
+        self.num_chunks = len(chunks)
+        self.num_chunks_embedded = len(new_ids)
+        self.num_chunks_reused = len(index_ids) - len(new_ids)
+        self.num_chunks_removed = len(removed_positions)
+        self.seconds += time.monotonic() - start_time
+        self.vectorstore = self._make_vectorstore(index, index_ids, {chunk_id: texts[chunk_id] for chunk_id in index_ids})
+        return self.vectorstore
+
+    def search_batch(
+        self,
+        queries: List[str],
+        k: int = 10,
+    ) -> List[List[str]]:
+        """
+        Find the k nearest chunks of every query with one embedding call and one
+        matrix search, instead of one similarity_search per query. It blocks, so
+        call it through asyncio.to_thread from a coroutine.
+
+        Returns:
+            For every query, the texts of its nearest chunks, nearest first.
+        """
+        if self.vectorstore is None:
+            raise RuntimeError("Call load() before searching the knowledge base.")
+        if not queries:
+            return []
+
+        start_time = time.monotonic()
+        unique_queries = list(dict.fromkeys(queries))
+        vectors = np.array(self.embeddings.embed_documents(unique_queries), dtype=np.float32)
+        _, positions = self.vectorstore.index.search(vectors, min(k, self.vectorstore.index.ntotal))
+
+        index_to_docstore_id = self.vectorstore.index_to_docstore_id
+        docstore = self.vectorstore.docstore
+        results = {
+            query: [docstore.search(index_to_docstore_id[position]).page_content for position in row if position != -1]
+            for query, row in zip(unique_queries, positions)
+        }
+
+        self.num_queries += len(queries)
+        self.num_queries_embedded += len(unique_queries)
+        self.search_seconds += time.monotonic() - start_time
+        return [results[query] for query in queries]
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.load_mode,
+            "chunks": self.num_chunks,
+            "embedded": self.num_chunks_embedded,
+            "reused": self.num_chunks_reused,
+            "removed": self.num_chunks_removed,
+            "seconds": self.seconds,
+            "queries": self.num_queries,
+            "queries_embedded": self.num_queries_embedded,
+            "search_seconds": self.search_seconds,
+        }
@@ -0,0 +1,223 @@
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Optional
+
+from pydantic import BaseModel
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage, convert_to_messages, messages_from_dict, messages_to_dict
+from langchain_core.prompts import BasePromptTemplate
+from langchain_core.runnables import RunnableSequence
+from utils.tracing import Span, span, TokenUsageCallbackHandler
+
+
+class LLMResponseCache:
+    """
+    Persistent cache of parsed LLM responses.
+
+    Responses are keyed by the chat model, the output parser and the normalized
+    input messages, in which inline images are replaced by the hash of their
+    content. Entries expire after ttl_seconds, and the least recently used entries
+    are evicted once there are more than max_entries of them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = 100000,
+    ):
+        """
+        Initialize the LLM response cache.
+
+        Args:
+            path: Path of the SQLite database. It can be shared by several working directories.
+            ttl_seconds: Entries older than this are treated as misses. If None, entries never expire.
+            max_entries: Maximum number of cached responses. If None, the cache is not bounded.
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, duration REAL NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+        self.num_hits = 0
+        self.num_misses = 0
+        self.seconds_saved = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a response.
+
+        Returns:
+            The stored JSON value, or None on a miss.
+        """
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT value, duration, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value, duration, created_at = row
+                if self.ttl_seconds is None or created_at + self.ttl_seconds > time.time():
+                    conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self.num_hits += 1
+                    self.seconds_saved += duration
+                    return json.loads(value)
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+            self.num_misses += 1
+            return None
+
+    def put(self, key: str, value: Any, duration: float) -> None:
+        """
+        Store a response.
+
+        Args:
+            key: The cache key.
+            value: A JSON-serializable value.
+            duration: Seconds the LLM took to produce it, reported as saved on every hit.
+        """
+        current_time = time.time()
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, duration, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), duration, current_time, current_time),
+            )
+            if self.ttl_seconds is not None:
+                conn.execute("DELETE FROM responses WHERE created_at <= ?", (current_time - self.ttl_seconds,))
+            if self.max_entries is not None:
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def stats(self) -> dict:
+        with self.lock, self._connect() as conn:
+            num_entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.num_hits,
+            "misses": self.num_misses,
+            "seconds_saved": self.seconds_saved,
+            "entries": num_entries,
+        }
+
+
+_llm_response_cache: Optional[LLMResponseCache] = None
+
+
+def set_llm_response_cache(cache: Optional[LLMResponseCache]) -> None:
+    """
+    Set the cache used by cached_ainvoke. Pass None to disable caching.
+    """
+    global _llm_response_cache
+    _llm_response_cache = cache
+
+
+def get_llm_response_cache() -> Optional[LLMResponseCache]:
+    return _llm_response_cache
+
+
+def _normalize_content(content: Any) -> Any:
+    if isinstance(content, str):
+        # Inline images are keyed by content, the base64 payload itself is not needed
+        if content.startswith("data:"):
+            return "sha256:" + hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return content.strip()
+    if isinstance(content, list):
+        return [_normalize_content(item) for item in content]
+    if isinstance(content, dict):
+        return {key: _normalize_content(value) for key, value in content.items()}
+    return content
+
+
+def _make_key(runnable, input: Any) -> Optional[str]:
+    steps = runnable.steps if isinstance(runnable, RunnableSequence) else [runnable]
+
+    if isinstance(steps[0], BasePromptTemplate):
+        messages = steps[0].invoke(input).to_messages()
+        steps = steps[1:]
+    else:
+        messages = convert_to_messages(input)
+
+    chat_model = next((step for step in steps if isinstance(step, BaseLanguageModel)), None)
+    if chat_model is None:
+        return None
+
+    pydantic_object = getattr(steps[-1], "pydantic_object", None)
+    key_data = {
+        "model": [chat_model._llm_type, chat_model._identifying_params],
+        "parser": [type(steps[-1]).__name__, pydantic_object.model_json_schema() if pydantic_object is not None else None],
+        "messages": [[message.type, _normalize_content(message.content)] for message in messages],
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def _dump_output(output: Any) -> Optional[dict]:
+    # Messages are pydantic models too, but are loaded without a parser
+    if isinstance(output, BaseMessage):
+        return {"kind": "message", "value": messages_to_dict([output])[0]}
+    if isinstance(output, BaseModel):
+        return {"kind": "pydantic", "value": output.model_dump(mode="json")}
+    try:
+        json.dumps(output)
+    except (TypeError, ValueError):
+        return None
+    return {"kind": "json", "value": output}
+
+
+def _load_output(runnable, stored: dict) -> Any:
+    if stored["kind"] == "pydantic":
+        parser = runnable.last if isinstance(runnable, RunnableSequence) else runnable
+        return parser.pydantic_object.model_validate(stored["value"])
+    if stored["kind"] == "message":
+        return messages_from_dict([stored["value"]])[0]
+    return stored["value"]
+
+
+async def cached_ainvoke(runnable, input: Any) -> Any:
+    """
+    Drop-in replacement for runnable.ainvoke(input) that goes through the LLM response cache.
+
+    The runnable is a chat model, optionally preceded by a prompt template and
+    followed by output parsers. The final output is cached only after it has been
+    produced successfully, so a response that fails to parse is never cached and
+    retries still reach the LLM. The cache is read and written in a worker thread,
+    off the event loop.
+    """
+    with span("llm", "llm") as llm_span:
+        cache = _llm_response_cache
+        key = _make_key(runnable, input) if cache is not None else None
+
+        if key is not None:
+            stored = await asyncio.to_thread(cache.get, key)
+            if stored is not None:
+                try:
+                    output = _load_output(runnable, stored)
+                    llm_span.set(cache_hit=True)
+                    return output
+                except Exception as e:
+                    # e.g. the output schema changed in an incompatible way
+                    logging.warning(f"Ignoring cached LLM response that cannot be loaded: {e}")
+
+        config = {"callbacks": [TokenUsageCallbackHandler(llm_span)]} if isinstance(llm_span, Span) else None
+        start_time = time.perf_counter()
+        output = await runnable.ainvoke(input, config=config)
+        duration = time.perf_counter() - start_time
+
+        if key is not None:
+            dumped = _dump_output(output)
+            if dumped is not None:
+                await asyncio.to_thread(cache.put, key, dumped, duration)
+        return output
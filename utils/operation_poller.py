@@ -0,0 +1,172 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+
+class _PendingOperation:
+    def __init__(
+        self,
+        operation: Any,
+        future: asyncio.Future,
+        interval: float,
+    ):
+        self.operation = operation
+        self.future = future
+        self.interval = interval
+        self.next_poll_time = time.monotonic() + interval
+        self.num_errors = 0
+
+
+class OperationPoller:
+    """
+    Single background task that polls every outstanding long-running operation.
+
+    Callers register an operation with wait() and get its finished state back,
+    instead of each running its own sleep-and-poll loop. On every tick, the
+    operations that are due are checked together, up to max_batch_size at once,
+    and each operation backs off exponentially from initial_interval to
+    max_interval while it is still running. Transient polling errors are retried
+    with the same backoff and only fail the caller after max_errors in a row.
+    """
+
+    def __init__(
+        self,
+        get_operation: Callable[[Any], Awaitable[Any]],
+        initial_interval: float = 2.0,
+        max_interval: float = 20.0,
+        backoff_factor: float = 1.5,
+        max_batch_size: int = 16,
+        max_errors: int = 5,
+    ):
+        """
+        Initialize the operation poller.
+
+        Args:
+            get_operation: Coroutine function that fetches the current state of an
+                           operation, e.g. client.aio.operations.get.
+            initial_interval: Seconds before the first status check of an operation.
+            max_interval: Upper bound of the seconds between two checks of an operation.
+            backoff_factor: Factor by which the interval grows after every check.
+            max_batch_size: Maximum number of status checks in flight at the same time.
+            max_errors: Number of consecutive failed checks after which the caller gets the error.
+        """
+        self.get_operation = get_operation
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.max_batch_size = max_batch_size
+        self.max_errors = max_errors
+
+        self.pending: List[_PendingOperation] = []
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup: Optional[asyncio.Event] = None
+
+        self.num_checks = 0
+        self.num_ticks = 0
+
+    async def wait(self, operation: Any) -> Any:
+        """
+        Wait until an operation is done.
+
+        Returns:
+            The finished operation, as returned by get_operation.
+        """
+        if getattr(operation, "done", False):
+            return operation
+
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.pending = [item for item in self.pending if not item.future.done() and item.future.get_loop() is loop]
+            self.wakeup = asyncio.Event()
+            self.task = loop.create_task(self._run())
+
+        pending_operation = _PendingOperation(operation, loop.create_future(), self.initial_interval)
+        self.pending.append(pending_operation)
+        self.wakeup.set()
+        return await pending_operation.future
+
+    async def _run(self):
+        try:
+            await self._poll_forever()
+        except BaseException as e:
+            # Never leave callers waiting on a poller that has stopped, including when it is cancelled
+            stranded = [item for item in self.pending if not item.future.done()]
+            if stranded:
+                logging.error(f"Operation poller stopped with {len(stranded)} operations pending: {e!r}")
+            for item in stranded:
+                if isinstance(e, asyncio.CancelledError):
+                    item.future.cancel()
+                else:
+                    item.future.set_exception(e)
+            self.pending = []
+            raise
+
+    async def _poll_forever(self):
+        while True:
+            # Callers that were cancelled no longer need their operation
+            self.pending = [item for item in self.pending if not item.future.done()]
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            current_time = time.monotonic()
+            due = sorted(
+                [item for item in self.pending if item.next_poll_time <= current_time],
+                key=lambda item: item.next_poll_time,
+            )[:self.max_batch_size]
+
+            if due:
+                self.num_ticks += 1
+                self.num_checks += len(due)
+                results = await asyncio.gather(
+                    *[self.get_operation(item.operation) for item in due],
+                    return_exceptions=True,
+                )
+                for item, result in zip(due, results):
+                    self._update(item, result)
+                continue
+
+            # Sleep until the next operation is due, or until a new one is registered
+            self.wakeup.clear()
+            timeout = min(item.next_poll_time for item in self.pending) - time.monotonic()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    def _update(self, item: _PendingOperation, result: Any):
+        if item.future.done():
+            return
+
+        # A check that was cancelled on its own, e.g. by a timeout of the client, is retried
+        # like any other transient error; cancelling the poller itself never gets here
+        if isinstance(result, BaseException):
+            item.num_errors += 1
+            if item.num_errors >= self.max_errors:
+                logging.error(f"Failed to poll operation status after {self.max_errors} attempts: {result}")
+                item.future.set_exception(result)
+                return
+
+        else:
+            item.num_errors = 0
+            item.operation = result
+            if getattr(result, "done", False):
+                item.future.set_result(result)
+                return
+
+        item.interval = min(self.max_interval, item.interval * self.backoff_factor)
+        item.next_poll_time = time.monotonic() + item.interval
+
+        if isinstance(result, BaseException):
+            logging.warning(f"Error while polling operation: {result}. Retrying in {item.interval:.1f}s... (attempt {item.num_errors}/{self.max_errors})")
+        else:
+            logging.info(f"Operation not completed, checking again in {item.interval:.1f}s...")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "checks": self.num_checks,
+            "ticks": self.num_ticks,
+        }
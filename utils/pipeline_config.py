@@ -0,0 +1,174 @@
+import os
+import importlib
+from typing import Any, Optional, Tuple
+
+from langchain.chat_models import init_chat_model
+
+from utils.rate_limiter import RateLimiter
+from utils.chat_rate_limiter import ChatModelRateLimiter
+from utils.http import configure_http_client_pool
+from utils.adaptive_concurrency import AdaptiveConcurrencyLimiter, AdaptiveConcurrencyProxy
+from utils.hedging import HedgedRequestProxy, RequestHedger
+from utils.provider_router import make_provider_router
+from utils.artifact_cache import ArtifactCache
+from utils.llm_cache import LLMResponseCache, set_llm_response_cache
+
+
+def make_rate_limiter(
+    name: str,
+    config: dict,
+) -> Optional[RateLimiter]:
+    """
+    Build a RateLimiter from the max_requests_per_minute and max_requests_per_day of a
+    config section, and print them.
+
+    Returns:
+        The rate limiter, or None if the section sets no limit.
+    """
+    rpm = config.get("max_requests_per_minute", None)
+    rpd = config.get("max_requests_per_day", None)
+    if not (rpm or rpd):
+        return None
+
+    limits = []
+    if rpm:
+        limits.append(f"{rpm} req/min")
+    if rpd:
+        limits.append(f"{rpd} req/day")
+    print(f"{name} rate limiting: {', '.join(limits)}")
+    return RateLimiter(
+        max_requests_per_minute=rpm,
+        max_requests_per_day=rpd,
+    )
+
+
+def _make_generator(
+    config: dict,
+    rate_limiter: Optional[RateLimiter],
+    artifact_cache: Optional[ArtifactCache],
+):
+    cls_module, cls_name = config["class_path"].rsplit(".", 1)
+    cls = getattr(importlib.import_module(cls_module), cls_name)
+    args = dict(config["init_args"])
+    if rate_limiter is not None:
+        args["rate_limiter"] = rate_limiter
+    if artifact_cache:
+        args["artifact_cache"] = artifact_cache
+    return cls(**args)
+
+
+def _make_routed_generator(
+    name: str,
+    config: dict,
+    rate_limiter: Optional[RateLimiter],
+    artifact_cache: Optional[ArtifactCache],
+):
+    # Several interchangeable backends are routed by observed latency, quota and errors if configured
+    if config.get("backends", None):
+        generator = make_provider_router(
+            name=name,
+            backend_configs=config["backends"],
+            artifact_cache=artifact_cache,
+            shared_rate_limiter=rate_limiter,
+            max_consecutive_failures=config.get("max_consecutive_failures", 3),
+            failure_cooldown=config.get("failure_cooldown_seconds", 60),
+        )
+        print(f"{name} routing: {', '.join(backend.name for backend in generator.backends)}")
+        return generator
+    return _make_generator(config, rate_limiter, artifact_cache)
+
+
+def build_models_from_config(config: dict) -> Tuple[Any, Any, Any]:
+    """
+    Build the chat model and the image and video generators of a pipeline config,
+    with the LLM response cache, rate limiters, HTTP pool, artifact cache, backend
+    routing, hedging and adaptive concurrency it configures.
+
+    Returns:
+        The chat model, the image generator and the video generator.
+    """
+    chat_model_args = dict(config["chat_model"]["init_args"])
+
+    # Parsed LLM responses are reused across runs if a cache is configured
+    chat_model_cache_config = config["chat_model"].get("cache", None)
+    if chat_model_cache_config:
+        ttl_hours = chat_model_cache_config.get("ttl_hours", None)
+        set_llm_response_cache(LLMResponseCache(
+            path=os.path.expanduser(chat_model_cache_config["path"]),
+            ttl_seconds=ttl_hours * 3600 if ttl_hours else None,
+            max_entries=chat_model_cache_config.get("max_entries", 100000),
+        ))
+        print(f"LLM response cache: {chat_model_cache_config['path']}")
+
+    # Create separate rate limiters for each service
+    chat_model_rate_limiter = make_rate_limiter("Chat model", config.get("chat_model", {}))
+    image_rate_limiter = make_rate_limiter("Image generator", config.get("image_generator", {}))
+    video_rate_limiter = make_rate_limiter("Video generator", config.get("video_generator", {}))
+
+    # The chat model draws from its rate limiter on every request, whichever agent or scene makes it
+    if chat_model_rate_limiter:
+        chat_model_args["rate_limiter"] = ChatModelRateLimiter(chat_model_rate_limiter)
+    chat_model = init_chat_model(**chat_model_args)
+
+    # Connection limits of the HTTP sessions shared by the tools
+    if config.get("http", None):
+        configure_http_client_pool(**config["http"])
+
+    # Generated images and videos are shared across working directories if a cache is configured
+    artifact_cache_config = config.get("artifact_cache", None)
+    artifact_cache = ArtifactCache(
+        root=artifact_cache_config["root"],
+        max_size_bytes=int(artifact_cache_config.get("max_size_gb", 20) * 1024 ** 3),
+    ) if artifact_cache_config else None
+    if artifact_cache:
+        print(f"Artifact cache: {artifact_cache.root}")
+
+    image_config = config["image_generator"]
+    image_limiter = AdaptiveConcurrencyLimiter(
+        name="Image generator",
+        initial_concurrency=image_config.get("initial_concurrency", 4),
+        max_concurrency=image_config.get("max_concurrency", 16),
+    )
+    image_generator = AdaptiveConcurrencyProxy(
+        _make_routed_generator("Image generator", image_config, image_rate_limiter, artifact_cache),
+        image_limiter,
+    )
+
+    # Image calls still running past a percentile of the recent latencies are duplicated if hedging is configured.
+    # Hedged requests take a concurrency slot of their own, and those to an alternate generator draw from
+    # its quota, or from the image generator's if it has none.
+    hedging_config = image_config.get("hedging", None)
+    if hedging_config:
+        alternate_generator, alternate_rate_limiter = None, None
+        alternate_generator_config = hedging_config.get("alternate_generator", None)
+        if alternate_generator_config:
+            alternate_rate_limiter = make_rate_limiter("Image generator hedging", alternate_generator_config) or image_rate_limiter
+            alternate_generator = AdaptiveConcurrencyProxy(
+                _make_generator(alternate_generator_config, None, artifact_cache),
+                image_limiter,
+            )
+        image_generator = HedgedRequestProxy(
+            image_generator,
+            RequestHedger(
+                name="Image generator",
+                hedge_percentile=hedging_config.get("percentile", 0.95),
+                min_samples=hedging_config.get("min_samples", 20),
+                max_hedge_ratio=hedging_config.get("max_hedge_ratio", 0.1),
+                min_hedge_delay=hedging_config.get("min_delay_seconds", 1.0),
+            ),
+            alternate_generator=alternate_generator,
+            alternate_rate_limiter=alternate_rate_limiter,
+        )
+        print(f"Image generator hedging: after p{hedging_config.get('percentile', 0.95) * 100:g} latency, at most {hedging_config.get('max_hedge_ratio', 0.1):.0%} of calls" + (f", to {alternate_generator_config['class_path'].rsplit('.', 1)[1]}" if alternate_generator else ""))
+
+    video_config = config["video_generator"]
+    video_generator = AdaptiveConcurrencyProxy(
+        _make_routed_generator("Video generator", video_config, video_rate_limiter, artifact_cache),
+        AdaptiveConcurrencyLimiter(
+            name="Video generator",
+            initial_concurrency=video_config.get("initial_concurrency", 1),
+            max_concurrency=video_config.get("max_concurrency", 8),
+        ),
+    )
+
+    return chat_model, image_generator, video_generator
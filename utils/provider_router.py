@@ -0,0 +1,279 @@
+import importlib
+import logging
+import time
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+from utils.adaptive_concurrency import get_retry_after, is_throttling_error, unwrap_retry_error
+from utils.rate_limiter import RateLimiter
+
+
+class BackendHealth:
+    """
+    Observed latency, load, quota and error state of one backend of a ProviderRouter.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        generator,
+        rate_limiter: Optional[RateLimiter] = None,
+        latency_smoothing: float = 0.2,
+    ):
+        """
+        Initialize the health of a backend.
+
+        Args:
+            name: Name of the backend, used in logs and stats.
+            generator: The image or video generator.
+            rate_limiter: Quota of the backend, acquired by the router before every call. Not every
+                          tool takes a rate limiter of its own, so it is applied outside of it.
+            latency_smoothing: Weight of the latest call in the moving averages of the latency and the success rate.
+        """
+        self.name = name
+        self.generator = generator
+        self.rate_limiter = rate_limiter
+        self.latency_smoothing = latency_smoothing
+
+        self.latency: Optional[float] = None
+        self.success_rate = 1.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.unavailable_until = 0.0
+
+        self.num_calls = 0
+        self.num_successes = 0
+        self.num_failures = 0
+        self.num_throttles = 0
+
+    def quota_wait(self) -> float:
+        """
+        Get the number of seconds a new call would wait for the backend's rate limiter.
+        """
+        if self.rate_limiter is None:
+            return 0.0
+        return max(0.0, self.rate_limiter.next_available_at() - time.time())
+
+    def expected_seconds(self, default_latency: float) -> float:
+        """
+        Estimate how long a new call would take: the quota wait, then the average
+        latency for every call already in flight and the new one, scaled up by the
+        failure rate.
+        """
+        latency = self.latency if self.latency is not None else default_latency
+        return (self.quota_wait() + latency * (self.in_flight + 1)) / max(0.05, self.success_rate)
+
+    def record_success(self, seconds: float) -> None:
+        self.num_successes += 1
+        self.consecutive_failures = 0
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.latency_smoothing * (seconds - self.latency)
+        self.success_rate += self.latency_smoothing * (1.0 - self.success_rate)
+
+    def record_failure(
+        self,
+        exc: BaseException,
+        max_consecutive_failures: int,
+        failure_cooldown: float,
+    ) -> None:
+        self.num_failures += 1
+        self.consecutive_failures += 1
+        self.success_rate -= self.latency_smoothing * self.success_rate
+
+        exc = unwrap_retry_error(exc)
+        cooldown = 0.0
+        if is_throttling_error(exc):
+            self.num_throttles += 1
+            cooldown = get_retry_after(exc) or 0.0
+        if self.consecutive_failures >= max_consecutive_failures:
+            cooldown = max(cooldown, failure_cooldown)
+        if cooldown > 0:
+            self.unavailable_until = max(self.unavailable_until, time.monotonic() + cooldown)
+            logging.warning(f"Backend {self.name} failed ({repr(exc)}, {self.consecutive_failures} in a row), not routing to it for {cooldown:.0f}s")
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.num_calls,
+            "successes": self.num_successes,
+            "failures": self.num_failures,
+            "throttles": self.num_throttles,
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "success_rate": self.success_rate,
+            "quota_wait": self.quota_wait(),
+            "available": self.unavailable_until <= time.monotonic(),
+        }
+
+
+class ProviderRouter:
+    """
+    Route the generate_single_* calls of several interchangeable image or video
+    generators to the backend expected to finish first.
+
+    The expectation combines the moving average of a backend's latency, its calls
+    in flight, the wait its rate limiter would impose and its recent success rate.
+    A failed call is retried on the next best backend, and a backend that failed
+    max_consecutive_failures times in a row, or asked to back off, is skipped for
+    a while unless every backend is. Every call also draws from the shared rate
+    limiter, if any, which is the quota of the service as a whole. All other
+    attributes are forwarded to the first backend.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        generators: Dict[str, Any],
+        rate_limiters: Optional[Dict[str, RateLimiter]] = None,
+        shared_rate_limiter: Optional[RateLimiter] = None,
+        max_consecutive_failures: int = 3,
+        failure_cooldown: float = 60.0,
+        latency_smoothing: float = 0.2,
+    ):
+        """
+        Initialize the provider router.
+
+        Args:
+            name: Name of the routed service, used in logs.
+            generators: The backends by name, in order of preference while their latencies are unknown.
+            rate_limiters: Quotas of some of the backends, by name.
+            shared_rate_limiter: Quota shared by all backends, acquired before every call.
+            max_consecutive_failures: Number of failures in a row after which a backend is skipped.
+            failure_cooldown: Number of seconds a failing backend is skipped.
+            latency_smoothing: Weight of the latest call in the moving averages of the backends.
+        """
+        if not generators:
+            raise ValueError("A provider router needs at least one backend.")
+        self.name = name
+        rate_limiters = rate_limiters or {}
+        self.backends = [
+            BackendHealth(backend_name, generator, rate_limiters.get(backend_name, None), latency_smoothing)
+            for backend_name, generator in generators.items()
+        ]
+        self.shared_rate_limiter = shared_rate_limiter
+        self.max_consecutive_failures = max_consecutive_failures
+        self.failure_cooldown = failure_cooldown
+
+        self.num_failovers = 0
+
+    def rank(self) -> List[BackendHealth]:
+        """
+        Order the backends by their expected completion time, available ones first.
+        """
+        now = time.monotonic()
+        # Until a backend has been measured it is assumed as fast as the fastest known one,
+        # so every backend gets tried; before any is measured, calls are spread by their load
+        known_latencies = [backend.latency for backend in self.backends if backend.latency is not None]
+        default_latency = min(known_latencies) if known_latencies else 1.0
+        return sorted(
+            self.backends,
+            key=lambda backend: (
+                max(0.0, backend.unavailable_until - now),
+                backend.expected_seconds(default_latency),
+            ),
+        )
+
+    async def run(
+        self,
+        method_name: str,
+        *args,
+        **kwargs,
+    ) -> Any:
+        """
+        Call a method on the best backend, failing over to the others in turn.
+
+        Returns:
+            The result of the first backend that succeeds.
+        """
+        error, failed_backend = None, None
+        for backend in self.rank():
+            if failed_backend is not None:
+                self.num_failovers += 1
+                logging.warning(f"{self.name}: {method_name} failed on {failed_backend.name} ({repr(error)}), failing over to {backend.name}")
+            backend.num_calls += 1
+            backend.in_flight += 1
+            try:
+                if self.shared_rate_limiter is not None:
+                    await self.shared_rate_limiter.acquire()
+                if backend.rate_limiter is not None:
+                    await backend.rate_limiter.acquire()
+                # The quota wait is estimated separately, so it is not part of the latency
+                start_time = time.monotonic()
+                result = await getattr(backend.generator, method_name)(*args, **kwargs)
+            except Exception as e:
+                backend.record_failure(e, self.max_consecutive_failures, self.failure_cooldown)
+                error, failed_backend = e, backend
+                continue
+            finally:
+                backend.in_flight -= 1
+
+            if result is None:
+                # Some tools report a failed task by returning None
+                error, failed_backend = ValueError(f"{backend.name} returned no result"), backend
+                backend.record_failure(error, self.max_consecutive_failures, self.failure_cooldown)
+                continue
+            backend.record_success(time.monotonic() - start_time)
+            return result
+
+        raise error
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.backends[0].generator, name)
+        if not name.startswith("generate_single_"):
+            return attr
+
+        @wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self.run(name, *args, **kwargs)
+
+        return wrapper
+
+    def stats(self) -> dict:
+        return {
+            "failovers": self.num_failovers,
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+        }
+
+
+def make_provider_router(
+    name: str,
+    backend_configs: List[dict],
+    artifact_cache=None,
+    shared_rate_limiter: Optional[RateLimiter] = None,
+    max_consecutive_failures: int = 3,
+    failure_cooldown: float = 60.0,
+) -> ProviderRouter:
+    """
+    Build a ProviderRouter from the backends section of an image_generator or
+    video_generator config. Every backend has a class_path, init_args and optional
+    max_requests_per_minute and max_requests_per_day limits of its own, on top of
+    the shared_rate_limiter built from the limits of the section itself.
+    """
+    generators, rate_limiters = {}, {}
+    for backend_config in backend_configs:
+        cls_module, cls_name = backend_config["class_path"].rsplit(".", 1)
+        cls = getattr(importlib.import_module(cls_module), cls_name)
+        args = dict(backend_config.get("init_args", {}))
+
+        if artifact_cache:
+            args["artifact_cache"] = artifact_cache
+
+        backend_name = backend_config.get("name", cls_name)
+        if backend_name in generators:
+            backend_name = f"{backend_name}_{len(generators)}"
+        generators[backend_name] = cls(**args)
+
+        rpm = backend_config.get("max_requests_per_minute", None)
+        rpd = backend_config.get("max_requests_per_day", None)
+        if rpm or rpd:
+            rate_limiters[backend_name] = RateLimiter(max_requests_per_minute=rpm, max_requests_per_day=rpd)
+
+    return ProviderRouter(
+        name=name,
+        generators=generators,
+        rate_limiters=rate_limiters,
+        shared_rate_limiter=shared_rate_limiter,
+        max_consecutive_failures=max_consecutive_failures,
+        failure_cooldown=failure_cooldown,
+    )
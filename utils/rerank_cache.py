@@ -0,0 +1,95 @@
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class RerankScoreCache:
+    """
+    Persistent cache of reranker relevance scores.
+
+    A score depends only on the model, the query and the document, so it is keyed
+    by the model and the hashes of the query and the document, and reused by every
+    later request that pairs the same query with the same document, whatever the
+    other documents of the request.
+    """
+
+    def __init__(
+        self,
+        path: str,
+    ):
+        """
+        Initialize the rerank score cache.
+
+        Args:
+            path: Path of the SQLite database. It can be shared by several working directories.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "model TEXT NOT NULL, query_hash TEXT NOT NULL, document_hash TEXT NOT NULL, score REAL NOT NULL, "
+                "PRIMARY KEY (model, query_hash, document_hash))"
+            )
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(
+        self,
+        model: str,
+        query_hash: str,
+        document_hashes: Iterable[str],
+    ) -> Dict[str, float]:
+        """
+        Look up the scores of several documents for one query.
+
+        Returns:
+            The scores found, keyed by document hash.
+        """
+        document_hashes = list(document_hashes)
+        scores = {}
+        with self.lock, self._connect() as conn:
+            # Stay below the SQLite limit on the number of variables of a statement
+            for start in range(0, len(document_hashes), 500):
+                batch = document_hashes[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT document_hash, score FROM scores WHERE model = ? AND query_hash = ? AND document_hash IN ({', '.join('?' * len(batch))})",
+                    [model, query_hash, *batch],
+                ).fetchall()
+                scores.update(rows)
+        self.num_hits += len(scores)
+        self.num_misses += len(document_hashes) - len(scores)
+        return scores
+
+    def put_many(
+        self,
+        model: str,
+        query_hash: str,
+        scores: Dict[str, float],
+    ) -> None:
+        """
+        Store the scores of several documents for one query, keyed by document hash.
+        """
+        with self.lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO scores (model, query_hash, document_hash, score) VALUES (?, ?, ?, ?)",
+                [(model, query_hash, document_hash, score) for document_hash, score in scores.items()],
+            )
+
+    def stats(self) -> dict:
+        with self.lock, self._connect() as conn:
+            num_entries = conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        return {
+            "hits": self.num_hits,
+            "misses": self.num_misses,
+            "entries": num_entries,
+        }
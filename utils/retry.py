@@ -1,9 +1,14 @@
 import tenacity
 import traceback
 import logging
+from utils.tracing import current_span
+from utils.adaptive_concurrency import report_throttling
 
 def after_func(retry_state: tenacity.RetryCallState) -> None:
     if retry_state.outcome.failed:
         exc = retry_state.outcome.exception()
+        current_span().add("retries")
         logging.warning(f"Retrying {retry_state.fn.__name__} due to {repr(exc)} (Attempt {retry_state.attempt_number})")
         logging.debug(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        # Let the concurrency limiter of the call back off before the retries are exhausted
+        report_throttling(exc)
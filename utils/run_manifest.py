@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from utils.artifact_cache import file_sha256
+
+
+def inputs_sha256(*inputs: Any) -> str:
+    """
+    Get the SHA-256 of the inputs of a stage, e.g. prompts, model dumps or the content hashes of other artifacts.
+    """
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    """
+    SQLite manifest of the stages and artifacts of one pipeline run.
+
+    Every artifact of the working directory is recorded by its relative path with
+    its stage, status, content hash, the hash of the inputs it was made from and
+    its timing. Artifacts are written to a temporary sibling file that is renamed
+    into place only once it is complete, and recorded as done after the rename, so
+    a crash never leaves a partial image or video that a later run takes as done.
+    Resume checks and progress queries are single indexed lookups.
+
+    Pipelines call the a-prefixed variants, which run the SQLite queries and the
+    hashing of the artifacts in a worker thread instead of on the event loop.
+    """
+
+    filename = "run_manifest.sqlite"
+
+    def __init__(
+        self,
+        working_dir: str,
+        adopt_existing: bool = True,
+    ):
+        """
+        Initialize the run manifest.
+
+        Args:
+            working_dir: Working directory of the run. The manifest is stored in it.
+            adopt_existing: Whether a file that exists but was never recorded, e.g. from a run
+                            made before the manifest existed, counts as done.
+        """
+        self.working_dir = working_dir
+        self.adopt_existing = adopt_existing
+        os.makedirs(self.working_dir, exist_ok=True)
+
+        self.db_path = os.path.join(self.working_dir, self.filename)
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            # WAL lets a progress view read the manifest while the pipeline writes it
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "path TEXT PRIMARY KEY, stage TEXT NOT NULL, status TEXT NOT NULL, "
+                "content_hash TEXT, inputs_hash TEXT, started_at REAL, finished_at REAL, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS artifacts_stage_status ON artifacts (stage, status)")
+
+        self.num_reused = 0
+        self.num_adopted = 0
+        self.num_written = 0
+        self.num_stale = 0
+        self.num_failed = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _key(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.working_dir)).replace(os.sep, "/")
+
+    @staticmethod
+    def temp_path(path: str) -> str:
+        # A fixed sibling name, so that a resumable download picks up where an interrupted run stopped.
+        # It keeps the extension because PIL and ffmpeg pick the format from it.
+        root, ext = os.path.splitext(path)
+        return os.path.join(os.path.dirname(root), f".{os.path.basename(root)}.tmp{ext}")
+
+    def get(self, path: str) -> Optional[dict]:
+        """
+        Look up the record of an artifact.
+
+        Returns:
+            The record of the artifact, or None if it was never recorded.
+        """
+        with self.lock, self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM artifacts WHERE path = ?", (self._key(path),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def is_done(
+        self,
+        path: str,
+        stage: str,
+        inputs_hash: Optional[str] = None,
+    ) -> bool:
+        """
+        Check whether an artifact is complete and was made from the same inputs.
+
+        Args:
+            path: Path of the artifact.
+            stage: Stage of the artifact, recorded if an existing file is adopted.
+            inputs_hash: Hash of the inputs the artifact is made from. If None, any complete artifact is reused.
+        """
+        record = self.get(path)
+        if record is None:
+            if not (self.adopt_existing and os.path.exists(path)):
+                return False
+            self._record_done(path, stage, inputs_hash, started_at=None)
+            self.num_adopted += 1
+            return True
+
+        if record["status"] != "done" or not os.path.exists(path):
+            return False
+        if inputs_hash is not None and record["inputs_hash"] is not None and record["inputs_hash"] != inputs_hash:
+            self.num_stale += 1
+            return False
+        self.num_reused += 1
+        return True
+
+    async def ais_done(
+        self,
+        path: str,
+        stage: str,
+        inputs_hash: Optional[str] = None,
+    ) -> bool:
+        """
+        Like is_done(), without blocking the event loop.
+        """
+        return await asyncio.to_thread(self.is_done, path, stage, inputs_hash)
+
+    def content_hash(self, path: str) -> Optional[str]:
+        """
+        Get the content hash of a complete artifact, e.g. to make it part of the inputs hash of another one.
+        """
+        record = self.get(path)
+        if record is not None and record["status"] == "done":
+            return record["content_hash"]
+        return file_sha256(path) if os.path.exists(path) else None
+
+    async def acontent_hash(self, path: str) -> Optional[str]:
+        """
+        Like content_hash(), without blocking the event loop.
+        """
+        return await asyncio.to_thread(self.content_hash, path)
+
+    def _record_done(
+        self,
+        path: str,
+        stage: str,
+        inputs_hash: Optional[str],
+        started_at: Optional[float],
+    ) -> None:
+        content_hash = file_sha256(path)
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (path, stage, status, content_hash, inputs_hash, started_at, finished_at, error) "
+                "VALUES (?, ?, 'done', ?, ?, ?, ?, NULL)",
+                (self._key(path), stage, content_hash, inputs_hash, started_at, time.time()),
+            )
+
+    @contextmanager
+    def writing(
+        self,
+        path: str,
+        stage: str,
+        inputs_hash: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Record an artifact as running, yield the temporary path to write it to, then
+        move it into place and record it as done. If the block raises, the artifact is
+        recorded as failed and the previous file, if any, is left untouched.
+
+        Usage:
+            with run_manifest.writing(video_path, stage="video", inputs_hash=inputs_hash) as tmp_path:
+                await video_output.asave(tmp_path)
+        """
+        started_at = self._record_running(path, stage, inputs_hash)
+        tmp_path = self.temp_path(path)
+        try:
+            yield tmp_path
+        except BaseException as e:
+            self._record_failed(path, e)
+            raise
+        self._finish(path, stage, inputs_hash, started_at)
+
+    @asynccontextmanager
+    async def awriting(
+        self,
+        path: str,
+        stage: str,
+        inputs_hash: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Like writing(), without blocking the event loop.
+
+        Usage:
+            async with run_manifest.awriting(video_path, stage="video", inputs_hash=inputs_hash) as tmp_path:
+                await video_output.asave(tmp_path)
+        """
+        started_at = await asyncio.to_thread(self._record_running, path, stage, inputs_hash)
+        tmp_path = self.temp_path(path)
+        try:
+            yield tmp_path
+        except BaseException as e:
+            await asyncio.to_thread(self._record_failed, path, e)
+            raise
+        await asyncio.to_thread(self._finish, path, stage, inputs_hash, started_at)
+
+    def _record_running(
+        self,
+        path: str,
+        stage: str,
+        inputs_hash: Optional[str],
+    ) -> float:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        started_at = time.time()
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (path, stage, status, content_hash, inputs_hash, started_at, finished_at, error) "
+                "VALUES (?, ?, 'running', NULL, ?, ?, NULL, NULL)",
+                (self._key(path), stage, inputs_hash, started_at),
+            )
+        return started_at
+
+    def _record_failed(
+        self,
+        path: str,
+        exc: BaseException,
+    ) -> None:
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE artifacts SET status = 'failed', finished_at = ?, error = ? WHERE path = ?",
+                (time.time(), f"{type(exc).__name__}: {exc}", self._key(path)),
+            )
+        self.num_failed += 1
+
+    def _finish(
+        self,
+        path: str,
+        stage: str,
+        inputs_hash: Optional[str],
+        started_at: float,
+    ) -> None:
+        try:
+            os.replace(self.temp_path(path), path)
+        except BaseException as e:
+            self._record_failed(path, e)
+            raise
+        self._record_done(path, stage, inputs_hash, started_at)
+        self.num_written += 1
+
+    def write_json(
+        self,
+        path: str,
+        data: Any,
+        stage: str,
+        inputs_hash: Optional[str] = None,
+    ) -> None:
+        """
+        Write a JSON artifact atomically and record it as done.
+        """
+        with self.writing(path, stage=stage, inputs_hash=inputs_hash) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+
+    def write_text(
+        self,
+        path: str,
+        text: str,
+        stage: str,
+        inputs_hash: Optional[str] = None,
+    ) -> None:
+        """
+        Write a text artifact atomically and record it as done.
+        """
+        with self.writing(path, stage=stage, inputs_hash=inputs_hash) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+
+    async def awrite_json(
+        self,
+        path: str,
+        data: Any,
+        stage: str,
+        inputs_hash: Optional[str] = None,
+    ) -> None:
+        """
+        Like write_json(), without blocking the event loop.
+        """
+        await asyncio.to_thread(self.write_json, path, data, stage, inputs_hash)
+
+    async def awrite_text(
+        self,
+        path: str,
+        text: str,
+        stage: str,
+        inputs_hash: Optional[str] = None,
+    ) -> None:
+        """
+        Like write_text(), without blocking the event loop.
+        """
+        await asyncio.to_thread(self.write_text, path, text, stage, inputs_hash)
+
+    def list(
+        self,
+        stage: Optional[str] = None,
+        status: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        List the records of the artifacts, optionally of one stage and status, in path order.
+        """
+        conditions, params = [], []
+        if stage is not None:
+            conditions.append("stage = ?")
+            params.append(stage)
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.lock, self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(f"SELECT * FROM artifacts{where} ORDER BY path", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def progress(self) -> Dict[str, Dict[str, int]]:
+        """
+        Count the artifacts of every stage by status, e.g. for a progress view.
+
+        Returns:
+            {stage: {status: count}}
+        """
+        with self.lock, self._connect() as conn:
+            rows = conn.execute("SELECT stage, status, COUNT(*) FROM artifacts GROUP BY stage, status").fetchall()
+        progress = {}
+        for stage, status, count in rows:
+            progress.setdefault(stage, {})[status] = count
+        return progress
+
+    def stats(self) -> dict:
+        return {
+            "reused": self.num_reused,
+            "adopted": self.num_adopted,
+            "written": self.num_written,
+            "stale": self.num_stale,
+            "failed": self.num_failed,
+        }
+
+
+def read_run_progress(working_dir: str) -> Dict[str, Dict[str, int]]:
+    """
+    Read the progress of a run from its manifest without creating one, e.g. from a GUI polling a running pipeline.
+
+    Returns:
+        {stage: {status: count}}, empty if the run has no manifest yet.
+    """
+    db_path = os.path.join(working_dir, RunManifest.filename)
+    if not os.path.exists(db_path):
+        return {}
+    try:
+        with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30) as conn:
+            rows = conn.execute("SELECT stage, status, COUNT(*) FROM artifacts GROUP BY stage, status").fetchall()
+    except sqlite3.Error as e:
+        logging.warning(f"Could not read the run manifest {db_path}: {e}")
+        return {}
+    progress = {}
+    for stage, status, count in rows:
+        progress.setdefault(stage, {})[status] = count
+    return progress
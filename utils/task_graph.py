@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from utils.tracing import span, get_tracer
+
+
+class TaskGraph:
+    """
+    Dependency-driven scheduler for the async steps of a pipeline.
+
+    Every node wraps a coroutine function and starts as soon as the nodes it
+    depends on have finished and the events it waits on have been set, instead
+    of waiting for a whole phase of the pipeline to complete. Nodes can be added
+    while the graph is running, e.g. per-shot nodes that are only known once the
+    camera tree has been constructed.
+    """
+
+    def __init__(
+        self,
+        resource_limits: Optional[Dict[str, int]] = None,
+    ):
+        """
+        Initialize the task graph.
+
+        Args:
+            resource_limits: Maximum number of nodes that may run at the same time
+                             for each named resource, e.g. {"video": 1}. Nodes
+                             without a resource are not limited.
+        """
+        self.resource_limits = resource_limits or {}
+        self.semaphores = {
+            resource: asyncio.Semaphore(limit)
+            for resource, limit in self.resource_limits.items()
+        }
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.results: Dict[str, Any] = {}
+        self.spans: Dict[str, Any] = {}
+
+        # The first node that failed, recorded as soon as it finishes, including nodes added while run() waits
+        self.failed_task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+
+    def add_node(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        deps: Iterable[str] = (),
+        events: Iterable[asyncio.Event] = (),
+        resource: Optional[str] = None,
+    ) -> None:
+        """
+        Add a node to the graph and schedule it immediately.
+
+        Args:
+            name: Unique name of the node.
+            func: Coroutine function without arguments that performs the step.
+                  Results of finished dependencies are available in self.results.
+            deps: Names of the nodes that must finish before this node starts.
+                  They must already be part of the graph, which keeps it acyclic.
+            events: Events that must be set before this node starts.
+            resource: Name of the resource limit this node counts against.
+        """
+        if name in self.tasks:
+            raise ValueError(f"Node {name} already exists in the task graph.")
+
+        deps = list(deps)
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Node {name} depends on unknown node {dep}.")
+
+        if resource is not None and resource not in self.semaphores:
+            raise ValueError(f"Node {name} uses unknown resource {resource}.")
+
+        task = asyncio.create_task(
+            self._run_node(name, func, deps, list(events), resource),
+            name=name,
+        )
+        task.add_done_callback(self._on_node_done)
+        self.tasks[name] = task
+
+    def _on_node_done(self, task: asyncio.Task) -> None:
+        # Retrieve the exception right away, so a node that fails before run() looks at it is never lost
+        if task.cancelled() or task.exception() is not None:
+            if self.failed_task is None or (self.failed_task.cancelled() and not task.cancelled()):
+                self.failed_task = task
+        self.changed.set()
+
+    async def _run_node(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        deps: list,
+        events: list,
+        resource: Optional[str],
+    ) -> Any:
+        for dep in deps:
+            await self.tasks[dep]
+        for event in events:
+            await event.wait()
+
+        logging.debug(f"Task graph node {name} started.")
+        with span(name, "task_graph", deps=deps, resource=resource) as node_span:
+            self.spans[name] = node_span
+            tracer = get_tracer()
+            if tracer is not None:
+                for dep in deps:
+                    tracer.link(self.spans[dep], node_span)
+
+            if resource is not None:
+                async with self.semaphores[resource]:
+                    result = await func()
+            else:
+                result = await func()
+        logging.debug(f"Task graph node {name} finished.")
+
+        self.results[name] = result
+        return result
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Wait until every node, including nodes added while waiting, has finished.
+
+        If a node fails, all remaining nodes are cancelled and the exception is raised.
+
+        Returns:
+            A dict mapping node names to their results.
+        """
+        while True:
+            if self.failed_task is not None:
+                failed_task = self.failed_task
+                await self.cancel()
+                # Report the root cause rather than a dependent node that was cancelled because of it
+                raise asyncio.CancelledError() if failed_task.cancelled() else failed_task.exception()
+
+            if all(task.done() for task in self.tasks.values()):
+                break
+
+            # Woken by every node that finishes, whether it was added before or during the wait
+            self.changed.clear()
+            await self.changed.wait()
+
+        return self.results
+
+    async def cancel(self) -> None:
+        """
+        Cancel all nodes that have not finished yet.
+        """
+        pending = [task for task in self.tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
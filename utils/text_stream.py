@@ -0,0 +1,107 @@
+from typing import Iterator, List, Optional, Tuple
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+class StreamingTextSplitter:
+    """
+    Split a text file into chunks lazily, reading it block by block, so that only a
+    block and a few chunks are in memory however large the file.
+
+    The last chunks of a block are held back, because the end of the block may cut
+    through them, and splitting restarts at one of them once the next block is read:
+    preferably at one that begins a paragraph (a piece of the coarsest separator),
+    otherwise at the second to last chunk once the buffer grew too large to keep
+    waiting.
+
+    The chunks near a restart can differ from those of splitting the whole text at
+    once, because the splitter merges pieces into chunks greedily from wherever it
+    starts. They still cover the whole text in order with the configured overlap,
+    and they only depend on the file and the block size, so every run over the same
+    file yields the same chunks and caches keyed by the chunk content stay valid.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int,
+        chunk_overlap: int,
+        separators: Optional[List[str]] = None,
+    ):
+        """
+        Initialize the streaming text splitter.
+
+        Args:
+            chunk_size: Characters per chunk.
+            chunk_overlap: Characters shared by two adjacent chunks.
+            separators: Separators of the recursive splitter, coarsest first.
+        """
+        self.chunk_size = chunk_size
+        self.separators = separators or ["\n\n", "\n", " ", ""]
+        self.splitter = RecursiveCharacterTextSplitter(
+            separators=self.separators,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            add_start_index=True,
+        )
+        self.num_chars_read = 0
+
+    def split_file(
+        self,
+        path: str,
+        start: int = 0,
+        block_size: int = 1 << 20,
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Split a UTF-8 text file into chunks.
+
+        Args:
+            path: Path of the text file.
+            start: Character offset from which to split; the text before it is skipped.
+            block_size: Characters read at a time.
+
+        Yields:
+            (start offset, chunk) pairs, in order. num_chars_read counts the characters read so far.
+        """
+        self.num_chars_read = 0
+        with open(path, "r", encoding="utf-8") as f:
+            while self.num_chars_read < start:
+                block = f.read(min(block_size, start - self.num_chars_read))
+                if not block:
+                    return
+                self.num_chars_read += len(block)
+
+            buffer, buffer_start = "", start
+            while True:
+                block = f.read(block_size)
+                self.num_chars_read += len(block)
+                buffer += block
+                if block and len(buffer) < 3 * self.chunk_size:
+                    continue
+
+                documents = self.splitter.create_documents([buffer])
+                if not block:
+                    for document in documents:
+                        yield buffer_start + document.metadata["start_index"], document.page_content
+                    return
+
+                separator = next((separator for separator in self.separators if separator and separator in buffer), None)
+                restart = next(
+                    (
+                        index for index in range(len(documents) - 2, 0, -1)
+                        if separator is not None and buffer[:documents[index].metadata["start_index"]].endswith(separator)
+                    ),
+                    None,
+                )
+                if restart is not None:
+                    # The splitter keeps the separator at the start of the piece that follows it
+                    restart_offset = documents[restart].metadata["start_index"] - len(separator)
+                else:
+                    if len(buffer) < 16 * self.chunk_size or len(documents) < 3:
+                        continue
+                    restart = len(documents) - 2
+                    restart_offset = documents[restart].metadata["start_index"]
+
+                for document in documents[:restart]:
+                    yield buffer_start + document.metadata["start_index"], document.page_content
+                buffer = buffer[restart_offset:]
+                buffer_start += restart_offset
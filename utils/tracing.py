@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import asyncio
+import inspect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.callbacks import AsyncCallbackHandler
+
+
+class Span:
+    """
+    One timed operation of a run, e.g. an agent method, a tool call or a rate limiter wait.
+
+    Counters such as bytes_in, bytes_out, input_tokens, output_tokens and retries are
+    accumulated while the span is open and exported with its other arguments.
+    """
+
+    def __init__(
+        self,
+        span_id: int,
+        name: str,
+        category: str,
+        parent: Optional["Span"],
+        lane: int,
+        args: Dict[str, Any],
+    ):
+        self.span_id = span_id
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.lane = lane
+        self.args = args
+        self.counters: Dict[str, float] = {}
+        self.start_time = time.perf_counter()
+        self.end_time: Optional[float] = None
+
+    def set(self, **args) -> None:
+        self.args.update(args)
+
+    def add(self, counter: str, value: float = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+
+class _NullSpan:
+    """
+    Stand-in returned by span() when no trace is being recorded.
+    """
+
+    def set(self, **args) -> None:
+        pass
+
+    def add(self, counter: str, value: float = 1) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Records the spans of a run and exports them in the Chrome trace event format,
+    which chrome://tracing and https://ui.perfetto.dev can open.
+
+    Every asyncio task (or thread, outside of a task) gets its own lane, named after
+    the task, so spans on a lane nest properly. A span's parent is the span that was
+    open in the context that started it, which follows the task graph since tasks
+    inherit the context of their creator. Parent/child and dependency links across
+    lanes are exported as flow arrows.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans: List[Span] = []
+        self.links: List[Tuple[Span, Span]] = []
+        self.lanes: Dict[Any, Tuple[int, str]] = {}
+        self.next_span_id = 1
+
+    def _lane(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            key, lane_name = task, task.get_name()
+        else:
+            key, lane_name = threading.get_ident(), threading.current_thread().name
+
+        with self.lock:
+            if key not in self.lanes:
+                self.lanes[key] = (len(self.lanes) + 1, lane_name)
+            return self.lanes[key][0]
+
+    def start_span(
+        self,
+        name: str,
+        category: str,
+        parent: Optional[Span],
+        args: Dict[str, Any],
+    ) -> Span:
+        lane = self._lane()
+        with self.lock:
+            span = Span(self.next_span_id, name, category, parent, lane, args)
+            self.next_span_id += 1
+            self.spans.append(span)
+        return span
+
+    def link(self, source: Span, target: Span) -> None:
+        """
+        Record that target could only start after source, e.g. a dependency in the task graph.
+        """
+        if not isinstance(source, Span) or not isinstance(target, Span):
+            return
+        with self.lock:
+            self.links.append((source, target))
+
+    def _ts(self, perf_time: float) -> float:
+        return (perf_time - self.origin) * 1e6
+
+    def _flow(self, flow_id: int, source: Span, target: Span) -> List[dict]:
+        # The start of a flow has to lie inside the source slice to be bound to it
+        source_end = source.end_time if source.end_time is not None else target.start_time
+        source_ts = max(self._ts(source.start_time), min(self._ts(target.start_time), self._ts(source_end) - 1))
+        return [
+            {"name": "link", "cat": "flow", "ph": "s", "id": flow_id, "pid": 1, "tid": source.lane, "ts": source_ts},
+            {"name": "link", "cat": "flow", "ph": "f", "bp": "e", "id": flow_id, "pid": 1, "tid": target.lane, "ts": self._ts(target.start_time)},
+        ]
+
+    def to_chrome_trace(self) -> dict:
+        end_time = time.perf_counter()
+        with self.lock:
+            spans = list(self.spans)
+            links = list(self.links)
+            lanes = list(self.lanes.values())
+
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": lane, "args": {"name": lane_name}}
+            for lane, lane_name in lanes
+        ]
+        for span in spans:
+            span_end = span.end_time if span.end_time is not None else end_time
+            args = {**span.args, **span.counters, "span_id": span.span_id}
+            if span.parent is not None:
+                args["parent_id"] = span.parent.span_id
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "pid": 1,
+                "tid": span.lane,
+                "ts": self._ts(span.start_time),
+                "dur": (span_end - span.start_time) * 1e6,
+                "args": args,
+            })
+
+        flow_id = 0
+        for span in spans:
+            if span.parent is not None and span.parent.lane != span.lane:
+                flow_id += 1
+                events.extend(self._flow(flow_id, span.parent, span))
+        for source, target in links:
+            flow_id += 1
+            events.extend(self._flow(flow_id, source, target))
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path: str) -> None:
+        """
+        Write the trace as a Chrome trace JSON file.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False, default=str)
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Get the number of spans and their total duration in seconds per category.
+        """
+        end_time = time.perf_counter()
+        summary: Dict[str, dict] = {}
+        with self.lock:
+            for span in self.spans:
+                span_end = span.end_time if span.end_time is not None else end_time
+                entry = summary.setdefault(span.category, {"count": 0, "seconds": 0.0})
+                entry["count"] += 1
+                entry["seconds"] += span_end - span.start_time
+        return summary
+
+
+_tracer: Optional[Tracer] = None
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def set_tracer(tracer: Optional[Tracer]) -> None:
+    """
+    Set the tracer that records the spans of the current run, or None to stop tracing.
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def current_span():
+    """
+    Get the innermost open span of the current context, or a no-op span if there is none.
+    """
+    return _current_span.get() or _NULL_SPAN
+
+
+@contextmanager
+def span(name: str, category: str, **args):
+    """
+    Record the enclosed block as a span that is a child of the currently open span.
+
+    Yields the span, so counters can be added to it; this is a no-op span if no
+    trace is being recorded.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield _NULL_SPAN
+        return
+
+    new_span = tracer.start_span(name, category, _current_span.get(), args)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.set(error=repr(e))
+        raise
+    finally:
+        new_span.end_time = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced(category: str, name: Optional[str] = None):
+    """
+    Decorate a function or method, sync or async, so that every call is recorded as a span.
+
+    Put it outermost, above @retry, so that retries are counted on the span.
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if not inspect.iscoroutinefunction(func):
+            @wraps(func)
+            def sync_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return func(*args, **kwargs)
+                with span(span_name, category):
+                    return func(*args, **kwargs)
+
+            return sync_wrapper
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return await func(*args, **kwargs)
+            with span(span_name, category):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_run(filename: str = "trace.json"):
+    """
+    Decorate the __call__ of a pipeline so that the run is traced and the trace is
+    written to filename in the pipeline's working_dir.
+
+    A pipeline that runs inside an already traced run, e.g. the Script2VideoPipeline
+    of a scene, records into the outer trace instead of starting its own.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            if _tracer is not None:
+                with span(type(self).__name__, "pipeline", working_dir=self.working_dir):
+                    return await func(self, *args, **kwargs)
+
+            tracer = Tracer()
+            set_tracer(tracer)
+            try:
+                with span(type(self).__name__, "pipeline", working_dir=self.working_dir):
+                    return await func(self, *args, **kwargs)
+            finally:
+                set_tracer(None)
+                trace_path = os.path.join(self.working_dir, filename)
+                try:
+                    tracer.export(trace_path)
+                    print(f"⏱️ Trace of {len(tracer.spans)} spans saved to {trace_path}.")
+                except OSError as e:
+                    logging.error(f"Failed to save the trace to {trace_path}: {e}")
+
+        return wrapper
+
+    return decorator
+
+
+class TokenUsageCallbackHandler(AsyncCallbackHandler):
+    """
+    Adds the token usage of every LLM call under a runnable to a span.
+    """
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    async def on_llm_end(self, response, **kwargs) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.span.add("input_tokens", usage.get("input_tokens", 0))
+                    self.span.add("output_tokens", usage.get("output_tokens", 0))
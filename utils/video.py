@@ -1,5 +1,12 @@
+import os
+import re
+import shutil
 import logging
-import requests
+import tempfile
+import subprocess
+from collections import Counter
+from typing import List
+from utils.http import get_requests_session
 from tenacity import retry
 
 
@@ -8,15 +15,280 @@ def download_video(url, save_path):
     try:
         logging.info(f"Downloading video from {url} to {save_path}")
 
-        response = requests.get(url, stream=True)
-        response.raise_for_status()  # 检查请求是否成功
-    
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        # The pooled session keeps the connection to the video host alive between downloads
+        with get_requests_session().get(url, stream=True) as response:
+            response.raise_for_status()  # 检查请求是否成功
+
+            with open(save_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
 
         logging.info(f"Video downloaded successfully to {save_path}")
     
     except Exception as e:
         logging.error(f"Error downloading video: {e}")
         raise e
+
+
+def _ffmpeg_binary() -> str:
+    # moviepy resolves the binary from FFMPEG_BINARY or the one bundled with imageio-ffmpeg
+    from moviepy.config import FFMPEG_BINARY
+    return FFMPEG_BINARY
+
+
+def probe_video(path: str) -> dict:
+    """
+    Read the stream parameters of a video file from ffmpeg's input description.
+
+    Returns:
+        A dict with the duration and the video codec, profile, pixel format, size, fps
+        and time base. audio is None if the file has no audio stream, otherwise a dict
+        with the codec, sample rate and channel layout.
+    """
+    result = subprocess.run(
+        [_ffmpeg_binary(), "-hide_banner", "-i", path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+    )
+    # ffmpeg exits with an error because no output is given; the description is on stderr
+    infos = result.stderr
+
+    duration = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", infos)
+    video = re.search(r"Stream #\d+:\d+.*?: Video: (.*)", infos)
+    audio = re.search(r"Stream #\d+:\d+.*?: Audio: (.*)", infos)
+    if video is None:
+        raise ValueError(f"No video stream found in {path}")
+
+    video_desc = video.group(1)
+    codec = re.match(r"(\w+)(?: \(([^)]*)\))?", video_desc)
+    pix_fmt = re.search(r"^[^,]+, (\w+)", video_desc)
+    size = re.search(r" (\d{2,5})x(\d{2,5})\b", video_desc)
+    fps = re.search(r"([\d.]+k?) fps", video_desc) or re.search(r"([\d.]+k?) tbr", video_desc)
+    tbn = re.search(r"([\d.]+k?) tbn", video_desc)
+
+    probe = {
+        "duration": int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3)) if duration else None,
+        "video_codec": codec.group(1),
+        "video_profile": codec.group(2),
+        "pix_fmt": pix_fmt.group(1) if pix_fmt else None,
+        "size": (int(size.group(1)), int(size.group(2))) if size else None,
+        "fps": fps.group(1) if fps else None,
+        "tbn": tbn.group(1) if tbn else None,
+        "audio": None,
+    }
+
+    if audio is not None:
+        audio_desc = audio.group(1)
+        sample_rate = re.search(r"(\d+) Hz", audio_desc)
+        channels = re.search(r"Hz, ([\w.()]+)", audio_desc)
+        probe["audio"] = {
+            "codec": re.match(r"(\w+)", audio_desc).group(1),
+            "sample_rate": int(sample_rate.group(1)) if sample_rate else None,
+            "channels": channels.group(1) if channels else None,
+        }
+
+    return probe
+
+
+def _stream_signature(probe: dict) -> tuple:
+    audio = probe["audio"]
+    return (
+        probe["video_codec"],
+        probe["video_profile"],
+        probe["pix_fmt"],
+        probe["size"],
+        probe["fps"],
+        probe["tbn"],
+        (audio["codec"], audio["sample_rate"], audio["channels"]) if audio else None,
+    )
+
+
+def _parse_ffmpeg_number(value: str) -> float:
+    return float(value[:-1]) * 1000 if value.endswith("k") else float(value)
+
+
+def _normalize_video(path: str, save_path: str, target: dict) -> None:
+    """
+    Re-encode a clip to H.264 with the size, fps, time base and audio layout of target.
+    """
+    width, height = target["size"]
+    command = [
+        _ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error",
+        "-i", path,
+    ]
+
+    source_audio = probe_video(path)["audio"]
+    target_audio = target["audio"]
+    if target_audio is not None and source_audio is None:
+        # Add a silent track, so that the clip has the same streams as the others
+        command += [
+            "-f", "lavfi",
+            "-i", f"anullsrc=channel_layout={target_audio['channels'] or 'stereo'}:sample_rate={target_audio['sample_rate'] or 44100}",
+            "-shortest",
+        ]
+
+    command += [
+        "-map", "0:v:0",
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1",
+        "-r", target["fps"],
+        "-c:v", "libx264", "-preset", "medium",
+        "-pix_fmt", target["pix_fmt"] or "yuv420p",
+    ]
+    profile = {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high"}.get(target["video_profile"])
+    if profile:
+        command += ["-profile:v", profile]
+    if target["tbn"]:
+        command += ["-video_track_timescale", str(int(_parse_ffmpeg_number(target["tbn"])))]
+
+    if target_audio is None:
+        command += ["-an"]
+    else:
+        command += [
+            "-map", "1:a:0" if source_audio is None else "0:a:0",
+            "-c:a", "aac",
+            "-ar", str(target_audio["sample_rate"] or 44100),
+            "-ac", "1" if target_audio["channels"] == "mono" else "2",
+        ]
+
+    command += [save_path]
+    subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def concatenate_videos_with_moviepy(video_paths: List[str], save_path: str) -> None:
+    """
+    Decode every clip and re-encode the whole movie with moviepy.
+    """
+    from moviepy import VideoFileClip, concatenate_videoclips
+
+    video_clips = [VideoFileClip(path) for path in video_paths]
+    try:
+        final_video = concatenate_videoclips(video_clips)
+        final_video.write_videofile(save_path, codec="libx264", preset="medium")
+    finally:
+        for video_clip in video_clips:
+            video_clip.close()
+
+
+def concatenate_videos(video_paths: List[str], save_path: str) -> str:
+    """
+    Concatenate video clips, copying the streams instead of re-encoding them where possible.
+
+    If all clips share the codec, pixel format, resolution, fps, time base and audio
+    layout, they are joined with the ffmpeg concat demuxer without re-encoding.
+    Otherwise only the clips that differ from the most common parameters are
+    re-encoded to match them, and the result is joined the same way. If ffmpeg
+    fails, the clips are concatenated with moviepy instead.
+
+    Args:
+        video_paths: Paths of the clips, in order.
+        save_path: Path of the concatenated video.
+
+    Returns:
+        How the video was assembled: "stream_copy", "normalized" or "moviepy".
+    """
+    if not video_paths:
+        raise ValueError("No videos to concatenate.")
+
+    save_dir = os.path.dirname(os.path.abspath(save_path))
+    tmp_dir = tempfile.mkdtemp(prefix=".concat_", dir=save_dir)
+    tmp_save_path = os.path.join(tmp_dir, "concat" + os.path.splitext(save_path)[1])
+
+    try:
+        probes = [probe_video(path) for path in video_paths]
+        signatures = [_stream_signature(probe) for probe in probes]
+        target_signature = Counter(signatures).most_common(1)[0][0]
+        target = probes[signatures.index(target_signature)]
+
+        if target["video_codec"] != "h264" or target["size"] is None or target["fps"] is None:
+            # Clips are re-encoded with libx264, so they cannot match a different codec
+            target = dict(target, video_codec="h264", video_profile=None)
+            target_signature = None
+
+        concat_paths = []
+        for idx, (path, signature) in enumerate(zip(video_paths, signatures)):
+            if signature == target_signature:
+                concat_paths.append(os.path.abspath(path))
+            else:
+                normalized_path = os.path.join(tmp_dir, f"normalized_{idx}.mp4")
+                logging.info(f"Normalizing {path} to {target['size']} @ {target['fps']} fps")
+                _normalize_video(path, normalized_path, target)
+                concat_paths.append(normalized_path)
+        num_normalized = sum(1 for signature in signatures if signature != target_signature)
+
+        list_path = os.path.join(tmp_dir, "concat.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in concat_paths:
+                escaped_path = path.replace("'", "'\\''")
+                f.write(f"file '{escaped_path}'\n")
+
+        subprocess.run(
+            [
+                _ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", list_path,
+                "-c", "copy", "-movflags", "+faststart",
+                tmp_save_path,
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        os.replace(tmp_save_path, save_path)
+        mode = "normalized" if num_normalized else "stream_copy"
+        logging.info(f"Concatenated {len(video_paths)} videos ({mode}, {num_normalized} re-encoded) to {save_path}")
+
+    except (subprocess.CalledProcessError, ValueError, OSError) as e:
+        stderr = getattr(e, "stderr", None)
+        logging.warning(f"ffmpeg concatenation failed, falling back to moviepy: {e}" + (f"\n{stderr.decode(errors='replace')}" if stderr else ""))
+        concatenate_videos_with_moviepy(video_paths, tmp_save_path)
+        os.replace(tmp_save_path, save_path)
+        mode = "moviepy"
+
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return mode
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # Benchmark: concatenate generated clips with the concat demuxer, with a few
+    # mismatched clips, and with moviepy.
+    num_clips = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    bench_dir = tempfile.mkdtemp(prefix="concat_bench_")
+
+    def make_clip(path: str, size: str, fps: int, with_audio: bool = True):
+        command = [
+            _ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}:duration=4",
+        ]
+        if with_audio:
+            command += ["-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100:duration=4", "-c:a", "aac"]
+        command += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-shortest", path]
+        subprocess.run(command, check=True)
+
+    matching_paths = []
+    for idx in range(num_clips):
+        path = os.path.join(bench_dir, f"clip_{idx}.mp4")
+        make_clip(path, "1280x720", 24)
+        matching_paths.append(path)
+
+    mismatched_paths = list(matching_paths)
+    for idx in range(0, num_clips, 5):
+        path = os.path.join(bench_dir, f"mismatched_{idx}.mp4")
+        make_clip(path, "960x720", 30, with_audio=False)
+        mismatched_paths[idx] = path
+
+    for name, func, paths in [
+        ("stream copy", concatenate_videos, matching_paths),
+        ("normalize 1 in 5", concatenate_videos, mismatched_paths),
+        ("moviepy", concatenate_videos_with_moviepy, matching_paths),
+    ]:
+        start_time = time.perf_counter()
+        func(paths, os.path.join(bench_dir, "final.mp4"))
+        print(f"{name:>16}: {time.perf_counter() - start_time:.2f}s for {num_clips} clips")
+
+    shutil.rmtree(bench_dir, ignore_errors=True)